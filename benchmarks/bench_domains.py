@@ -0,0 +1,96 @@
+"""
+Lookups per second, and resident memory, of a large domain blocklist:
+``registration.domains.DomainBlocklist``'s memory-mapped file, against
+the same domains held in a Python set. The memory-mapped file's
+resident pages are the file's pages in the page cache, which every
+process using the blocklist shares; the set's are private to each.
+
+The number of domains listed may be given on the command line::
+
+    python benchmarks/bench_domains.py 500000
+
+"""
+
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import sys
+import tempfile
+
+from common import rate, report
+
+from registration.domains import DomainBlocklist, reverse_domain, write_blocklist
+
+
+TLDS = ('com', 'net', 'org', 'io', 'ru', 'de', 'info', 'xyz')
+
+
+def make_domain(rng):
+    return '%s.%s' % (''.join([rng.choice('abcdefghijklmnopqrstuvwxyz')
+                               for i in range(rng.randint(6, 14))]),
+                      rng.choice(TLDS))
+
+
+def make_domains(count):
+    rng = random.Random(count)
+    return [make_domain(rng) for i in xrange(count)]
+
+
+def resident_memory():
+    """
+    Return this process's resident memory, in kilobytes: its current
+    size where ``/proc`` provides it, and otherwise its peak size.
+
+    """
+    try:
+        f = open('/proc/self/statm')
+        try:
+            return int(f.read().split()[1]) * resource.getpagesize() // 1024
+        finally:
+            f.close()
+    except IOError:
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Reported in bytes on Mac OS X, kilobytes elsewhere.
+        return sys.platform == 'darwin' and maxrss // 1024 or maxrss
+
+
+if __name__ == '__main__':
+    count = len(sys.argv) > 1 and int(sys.argv[1]) or 200000
+    directory = tempfile.mkdtemp()
+    try:
+        path = os.path.join(directory, 'blocklist')
+        # Build the file in another process, so that the domains it
+        # generates don't count towards this one's memory.
+        writer = multiprocessing.Process(target=lambda: write_blocklist(make_domains(count), path))
+        writer.start()
+        writer.join()
+
+        rng = random.Random(0)
+        listed = make_domains(count)[::max(count // 1000, 1)]
+        queries = listed + ['mail.%s' % domain for domain in listed] + \
+                  [make_domain(rng) for i in range(len(listed) * 2)]
+        rng.shuffle(queries)
+        lookup = lambda matches: lambda: [matches(domain) for domain in queries]
+
+        print '%d domains listed, %d bytes on disk' % (count, os.path.getsize(path))
+        before = resident_memory()
+        blocklist = DomainBlocklist(path)
+        report('mmap blocklist', rate(lookup(blocklist.matches), 10) * len(queries), 'lookups/s')
+        report('mmap blocklist resident memory', resident_memory() - before, 'KB')
+
+        before = resident_memory()
+        keys = set(open(path).read().splitlines())
+
+        def set_matches(domain):
+            labels = reverse_domain(domain).split('.')
+            for i in range(1, len(labels) + 1):
+                if '.'.join(labels[:i]) in keys:
+                    return True
+            return False
+        assert map(set_matches, queries) == map(blocklist.matches, queries)
+        report('Python set', rate(lookup(set_matches), 10) * len(queries), 'lookups/s')
+        report('Python set resident memory', resident_memory() - before, 'KB')
+    finally:
+        shutil.rmtree(directory, True)
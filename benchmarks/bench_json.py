@@ -0,0 +1,59 @@
+"""
+JSON registration requests validated per second, through a full
+``RegistrationForm`` and through its compiled validator
+(``registration.forms.compile_form()``): both for validation alone,
+and for whole requests to the ``register`` view, with ``Accept:
+application/json`` and data which fails validation. Both include the
+queries checking whether the username and email are taken.
+
+"""
+
+from common import rate, report, setup
+
+setup()
+
+from django.http import QueryDict
+from django.test.client import RequestFactory
+
+from registration import forms
+from registration.views import register
+
+
+class UncompiledForm(forms.RegistrationForm):
+    # Overriding full_clean() keeps compile_form() from compiling the
+    # form, so the view falls back to instantiating it.
+    def full_clean(self):
+        super(UncompiledForm, self).full_clean()
+
+
+backend = 'registration.backends.default.DefaultBackend'
+data = QueryDict('username=bob&email=bob@example.com&password1=secret&password2=terces')
+compiled = forms.compile_form(forms.RegistrationForm)
+factory = RequestFactory()
+
+
+def validate_form():
+    form = forms.RegistrationForm(data=data)
+    form.is_valid()
+    return form.errors
+
+
+def validate_compiled():
+    return compiled.validate(data)[1]
+
+
+def request(form_class):
+    def post():
+        return register(factory.post('/register/', data, HTTP_ACCEPT='application/json'),
+                        backend, form_class=form_class)
+    return post
+
+
+if __name__ == '__main__':
+    assert validate_form() == validate_compiled()
+    assert request(UncompiledForm)().content == request(forms.RegistrationForm)().content
+    number = 3000
+    report('validation, full form', rate(validate_form, number), 'validations/s')
+    report('validation, compiled', rate(validate_compiled, number), 'validations/s')
+    report('register view, full form', rate(request(UncompiledForm), number), 'requests/s')
+    report('register view, compiled', rate(request(forms.RegistrationForm), number), 'requests/s')
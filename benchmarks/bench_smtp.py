@@ -0,0 +1,67 @@
+"""
+Activation emails sent per second to a local SMTP server, over a new
+connection for each email and over ``registration.mail``'s connection
+pool (``REGISTRATION_EMAIL_POOL``).
+
+The server accepts and discards every message. A real server's TLS
+handshake and authentication can be simulated by delaying its
+greeting by a number of milliseconds given on the command line::
+
+    python benchmarks/bench_smtp.py 20
+
+"""
+
+import asyncore
+import smtpd
+import sys
+import threading
+import time
+
+from common import rate, report, setup
+
+
+class NullServer(smtpd.SMTPServer):
+    connect_delay = 0
+
+    def handle_accept(self):
+        time.sleep(self.connect_delay)
+        smtpd.SMTPServer.handle_accept(self)
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        pass
+
+
+server = NullServer(('127.0.0.1', 0), None)
+if len(sys.argv) > 1:
+    server.connect_delay = float(sys.argv[1]) / 1000
+thread = threading.Thread(target=asyncore.loop, kwargs={'timeout': 0.1})
+thread.daemon = True
+thread.start()
+
+setup(EMAIL_BACKEND='django.core.mail.backends.smtp.EmailBackend',
+      EMAIL_HOST='127.0.0.1',
+      EMAIL_PORT=server.socket.getsockname()[1])
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.contrib.sites.models import Site
+
+from registration import mail
+
+
+site = Site.objects.get_current()
+user = User.objects.create_user('alice', 'alice@example.com', 'swordfish')
+activation_key = 'a' * 40
+
+
+def send():
+    mail.send_activation_email(user, activation_key, site)
+
+
+if __name__ == '__main__':
+    number = 200
+    settings.REGISTRATION_EMAIL_POOL = False
+    report('new connection per email', rate(send, number), 'emails/s')
+    settings.REGISTRATION_EMAIL_POOL = True
+    report('pooled connection', rate(send, number), 'emails/s')
+    mail.connection_pool.close()
@@ -0,0 +1,42 @@
+"""
+Activation emails rendered per second, loading the templates for each
+email (as ``RegistrationProfile.send_activation_email()`` did with
+``render_to_string()``) and through the compiled-template cache of
+``registration.mail``.
+
+"""
+
+from common import rate, report, setup
+
+setup()
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.template.loader import render_to_string
+
+from registration import mail
+
+
+site = Site.objects.get_current()
+activation_key = 'a' * 40
+
+
+def uncached():
+    ctx_dict = {'activation_key': activation_key,
+                'expiration_days': settings.ACCOUNT_ACTIVATION_DAYS,
+                'site': site}
+    subject = render_to_string('registration/activation_email_subject.txt', ctx_dict)
+    subject = ''.join(subject.splitlines())
+    message = render_to_string('registration/activation_email.txt', ctx_dict)
+    return subject, message
+
+
+def cached():
+    return mail.render_activation_email(activation_key, site)
+
+
+if __name__ == '__main__':
+    assert uncached() == cached()
+    number = 2000
+    report('render_to_string() per email', rate(uncached, number), 'emails/s')
+    report('registration.mail template cache', rate(cached, number), 'emails/s')
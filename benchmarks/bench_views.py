@@ -0,0 +1,56 @@
+"""
+Requests per second to the ``register`` and ``activate`` function
+views and to their class-based equivalents, ``RegisterView`` and
+``ActivateView``, configured alike: a ``GET`` of the registration
+form, and activation with a key which doesn't exist.
+
+"""
+
+from common import rate, report, setup
+
+setup()
+
+from django.contrib.auth.models import AnonymousUser
+from django.test.client import RequestFactory
+
+from registration.views import ActivateView, RegisterView, activate, register
+
+
+backend = 'registration.backends.default.DefaultBackend'
+extra_context = {'title': 'Sign up', 'site_name': 'example.com', 'year': lambda: 2012}
+factory = RequestFactory()
+
+register_view = RegisterView.as_view(backend=backend, extra_context=extra_context)
+activate_view = ActivateView.as_view(backend=backend, extra_context=extra_context)
+
+
+def get(path):
+    request = factory.get(path)
+    request.user = AnonymousUser()
+    request.session = {}
+    return request
+
+
+def register_function():
+    return register(get('/register/'), backend, extra_context=extra_context)
+
+
+def register_class():
+    return register_view(get('/register/'))
+
+
+def activate_function():
+    return activate(get('/activate/foo/'), backend, extra_context=extra_context,
+                    activation_key='foo')
+
+
+def activate_class():
+    return activate_view(get('/activate/foo/'), activation_key='foo')
+
+
+if __name__ == '__main__':
+    number = 2000
+    report('register, function view', rate(register_function, number), 'requests/s')
+    report('register, RegisterView', rate(register_class, number), 'requests/s')
+    report('activate, function view', rate(activate_function, number), 'requests/s')
+    report('activate, ActivateView', rate(activate_class, number), 'requests/s')
@@ -0,0 +1,85 @@
+"""
+Setup shared by the benchmark scripts in this directory.
+
+Each script configures Django itself -- an in-memory SQLite database,
+the ``registration`` application and a temporary directory of
+templates -- so it can be run from a checkout without a project::
+
+    python benchmarks/bench_templates.py
+
+"""
+
+import atexit
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+TEMPLATES = {
+    'activation_email_subject.txt': u'Activate your account at {{ site.name }}',
+    'activation_email.txt': (u'Someone, hopefully you, signed up for a new account at '
+                             u'{{ site.name }} using this email address.\n\n'
+                             u'To activate the account, please visit:\n\n'
+                             u'http://{{ site.domain }}/accounts/activate/{{ activation_key }}/\n\n'
+                             u'The link is valid for {{ expiration_days }} days.\n'),
+    'registration_form.html': (u'<form method="post" action=".">{% csrf_token %}\n'
+                               u'{{ form.as_p }}\n'
+                               u'<input type="hidden" name="next" value="{{ next }}" />\n'
+                               u'<input type="submit" value="Register" />\n</form>\n'),
+    'activate.html': u'<p>Sorry, {{ activation_key }} is not a valid activation key.</p>\n',
+}
+
+
+def setup(**extra_settings):
+    """
+    Configure Django for a benchmark, with ``extra_settings`` added
+    to the defaults, and create the database tables.
+
+    """
+    template_dir = tempfile.mkdtemp()
+    atexit.register(shutil.rmtree, template_dir, True)
+    os.mkdir(os.path.join(template_dir, 'registration'))
+    for name, content in TEMPLATES.items():
+        f = open(os.path.join(template_dir, 'registration', name), 'w')
+        try:
+            f.write(content.encode('utf-8'))
+        finally:
+            f.close()
+
+    from django.conf import settings
+    options = {'DATABASES': {'default': {'ENGINE': 'django.db.backends.sqlite3',
+                                         'NAME': ':memory:'}},
+               'INSTALLED_APPS': ['django.contrib.auth',
+                                  'django.contrib.contenttypes',
+                                  'django.contrib.sessions',
+                                  'django.contrib.sites',
+                                  'registration'],
+               'SITE_ID': 1,
+               'ROOT_URLCONF': 'registration.backends.default.urls',
+               'TEMPLATE_DIRS': [template_dir],
+               'EMAIL_BACKEND': 'django.core.mail.backends.locmem.EmailBackend',
+               'ACCOUNT_ACTIVATION_DAYS': 7,
+               'SECRET_KEY': 'benchmark'}
+    options.update(extra_settings)
+    settings.configure(**options)
+
+    from django.core.management import call_command
+    call_command('syncdb', interactive=False, verbosity=0)
+
+
+def rate(func, number):
+    """
+    Return the number of calls of ``func`` per second, from the
+    fastest of three runs of ``number`` calls.
+
+    """
+    func()
+    return number / min(timeit.repeat(func, number=number, repeat=3))
+
+
+def report(label, value, unit):
+    print '%-40s %12.1f %s' % (label, value, unit)
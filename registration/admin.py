@@ -1,25 +1,150 @@
+import datetime
+
+from django.conf import settings
 from django.contrib import admin
-from django.contrib.sites.models import RequestSite
-from django.contrib.sites.models import Site
+from django.core.paginator import Paginator
+from django.db import connections
 from django.utils.translation import ugettext_lazy as _
+from django.utils.translation import ungettext
 
+from registration.backends import get_backend
 from registration.models import RegistrationProfile
+from registration.sites import get_current_site
+
+try:
+    from django.contrib.admin import SimpleListFilter
+except ImportError: # Django < 1.4 has no custom list filters.
+    SimpleListFilter = None
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    A paginator which, for an unfiltered queryset, takes its count
+    from the database's table statistics instead of running
+    ``SELECT COUNT(*)``, which must scan the whole table.
+
+    Estimates are only available on PostgreSQL and MySQL, and are
+    only used for tables larger than ``exact_below`` rows; in all
+    other cases the exact count is used.
+    
+    """
+    exact_below = 10000
+
+    def _get_count(self):
+        if self._count is None:
+            estimate = self._estimate()
+            if estimate is not None and estimate >= self.exact_below:
+                self._count = estimate
+            else:
+                self._count = super(EstimatedCountPaginator, self)._get_count()
+        return self._count
+    count = property(_get_count)
+
+    def _estimate(self):
+        queryset = self.object_list
+        if not hasattr(queryset, 'query') or queryset.query.where:
+            return None
+        connection = connections[queryset.db]
+        table = queryset.model._meta.db_table
+        if connection.vendor == 'postgresql':
+            sql = "SELECT reltuples FROM pg_class WHERE relname = %s"
+        elif connection.vendor == 'mysql':
+            sql = "SELECT table_rows FROM information_schema.tables WHERE table_schema = DATABASE() AND table_name = %s"
+        else:
+            return None
+        cursor = connection.cursor()
+        cursor.execute(sql, [table])
+        row = cursor.fetchone()
+        if row is None or row[0] is None:
+            return None
+        return int(row[0])
+
+
+if SimpleListFilter is not None:
+    class ActivationStatusFilter(SimpleListFilter):
+        """
+        Filters registration profiles by whether they are awaiting
+        activation, have expired or have been activated, using the
+        indexed ``expires_at`` and the ``activated`` fields.
+        
+        """
+        title = _('status')
+        parameter_name = 'status'
+
+        def lookups(self, request, model_admin):
+            return (('pending', _('Pending')),
+                    ('expired', _('Expired')),
+                    ('activated', _('Activated')))
+
+        def queryset(self, request, queryset):
+            if self.value() == 'pending':
+                return queryset & RegistrationProfile.objects.pending()
+            if self.value() == 'expired':
+                return queryset & RegistrationProfile.objects.expired()
+            if self.value() == 'activated':
+                return queryset.filter(activated=True)
+            return queryset
+
+    status_filter = ActivationStatusFilter
+else:
+    status_filter = 'activated'
 
 
 class RegistrationAdmin(admin.ModelAdmin):
     actions = ['activate_users', 'resend_activation_email']
-    list_display = ('user', 'activation_key_expired')
+    list_display = ('user', 'expires_at', 'activation_key_expired')
+    list_filter = (status_filter,)
+    list_select_related = True
     raw_id_fields = ['user']
-    search_fields = ('user__username', 'user__first_name', 'user__last_name')
+    search_fields = ('^user__username', '^user__email', '^user__first_name', '^user__last_name')
+
+    def queryset(self, request):
+        """
+        Adds whether each activation key has expired to the
+        changelist's query, so that displaying it doesn't cost a
+        query per row.
+        
+        """
+        queryset = super(RegistrationAdmin, self).queryset(request)
+        qn = connections[queryset.db].ops.quote_name
+        columns = dict([(name, '%s.%s' % (qn(self.model._meta.db_table), qn(name)))
+                        for name in ('activated', 'activation_key', 'expires_at')])
+        sql = ("CASE WHEN %(activated)s = %%s OR %(activation_key)s = %%s "
+               "OR %(expires_at)s <= %%s THEN 1 ELSE 0 END" % columns)
+        return queryset.extra(select={'key_expired': sql},
+                              select_params=(True, self.model.ACTIVATED, datetime.datetime.now()))
+
+    def activation_key_expired(self, obj):
+        if hasattr(obj, 'key_expired'):
+            return bool(obj.key_expired)
+        return obj.activation_key_expired()
+    activation_key_expired.boolean = True
+    activation_key_expired.short_description = _('activation key expired')
+
+    def get_paginator(self, request, queryset, per_page, orphans=0, allow_empty_first_page=True):
+        if getattr(settings, 'REGISTRATION_ADMIN_ESTIMATED_COUNT', False):
+            return EstimatedCountPaginator(queryset, per_page, orphans, allow_empty_first_page)
+        return super(RegistrationAdmin, self).get_paginator(request, queryset, per_page,
+                                                            orphans, allow_empty_first_page)
 
     def activate_users(self, request, queryset):
         """
         Activates the selected users, if they are not alrady
         activated.
+
+        Activation is done in bulk through the ``activate_users()``
+        method of the backend named by the setting
+        ``REGISTRATION_ADMIN_BACKEND`` (by default, the default
+        backend), so the ``user_activated`` signal is sent for each
+        account activated, with that backend's class as the sender.
         
         """
-        for profile in queryset:
-            RegistrationProfile.objects.activate_user(profile.activation_key)
+        backend = get_backend(getattr(settings, 'REGISTRATION_ADMIN_BACKEND',
+                                      'registration.backends.default.DefaultBackend'))
+        activated = backend.activate_users(request, queryset)
+        self.message_user(request, ungettext("%(count)d user was activated.",
+                                             "%(count)d users were activated.",
+                                             len(activated)) % {'count': len(activated)})
     activate_users.short_description = _("Activate users")
 
     def resend_activation_email(self, request, queryset):
@@ -30,16 +155,16 @@ class RegistrationAdmin(admin.ModelAdmin):
         who are eligible to activate; emails will not be sent to users
         whose activation keys have expired or who have already
         activated.
+
+        The emails are sent in batches, each over a single connection.
         
         """
-        if Site._meta.installed:
-            site = Site.objects.get_current()
-        else:
-            site = RequestSite(request)
+        site = get_current_site(request)
 
-        for profile in queryset:
-            if not profile.activation_key_expired():
-                profile.send_activation_email(site)
+        sent, skipped = RegistrationProfile.objects.send_activation_emails(queryset, site, resend=True)
+        self.message_user(request, ungettext("%(sent)d activation email was sent; %(skipped)d skipped.",
+                                             "%(sent)d activation emails were sent; %(skipped)d skipped.",
+                                             sent) % {'sent': sent, 'skipped': skipped})
     resend_activation_email.short_description = _("Re-send activation emails")
 
 
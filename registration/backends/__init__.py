@@ -1,3 +1,5 @@
+import threading
+
 from django.core.exceptions import ImproperlyConfigured
 
 
@@ -8,16 +10,21 @@ try:
 except ImportError:
     from django.utils.importlib import import_module
 
-def get_backend(path):
+
+_backends = {}
+_backends_lock = threading.Lock()
+
+
+def load_backend(path):
     """
-    Return an instance of a registration backend, given the dotted
-    Python import path (as a string) to the backend class.
+    Import the registration backend class at the dotted Python import
+    path (as a string) ``path``, and return a new instance of it.
 
     If the backend cannot be located (e.g., because no such module
     exists, or because the module does not contain a class of the
     appropriate name), ``django.core.exceptions.ImproperlyConfigured``
     is raised.
-    
+
     """
     i = path.rfind('.')
     module, attr = path[:i], path[i+1:]
@@ -30,3 +37,87 @@ def get_backend(path):
     except AttributeError:
         raise ImproperlyConfigured('Module "%s" does not define a registration backend named "%s"' % (module, attr))
     return backend_class()
+
+
+def get_backend(path):
+    """
+    Return an instance of a registration backend, given the dotted
+    Python import path (as a string) to the backend class.
+
+    Each backend is imported and instantiated only the first time it
+    is requested in this process; later calls with the same path
+    return the same instance, from any thread. Backends therefore
+    shouldn't keep per-request state on the instance.
+
+    If the backend cannot be located (e.g., because no such module
+    exists, or because the module does not contain a class of the
+    appropriate name), ``django.core.exceptions.ImproperlyConfigured``
+    is raised, and nothing is cached, so a later call tries again.
+
+    """
+    try:
+        return _backends[path]
+    except KeyError:
+        pass
+    _backends_lock.acquire()
+    try:
+        if path not in _backends:
+            _backends[path] = load_backend(path)
+        return _backends[path]
+    finally:
+        _backends_lock.release()
+
+
+def clear_backend_cache():
+    """
+    Discard all backend instances cached by ``get_backend()``.
+
+    """
+    _backends_lock.acquire()
+    try:
+        _backends.clear()
+    finally:
+        _backends_lock.release()
+
+
+def load_backends(urlpatterns, warm_up=False):
+    """
+    Load every registration backend named by a ``backend`` argument in
+    ``urlpatterns`` (including the patterns of any ``include()``), or
+    used by a class-based registration view, and return them as a
+    list.
+
+    Calling this from a URLconf means a misconfigured backend path
+    raises ``django.core.exceptions.ImproperlyConfigured`` when the
+    URLconf is loaded, rather than on the first request to the view.
+
+    If ``warm_up`` is ``True``, each backend's ``warm_up()`` method,
+    if it has one, is also called, so that the backend can load
+    anything it will need (such as templates) in advance.
+
+    """
+    backends = []
+    _load_backends(urlpatterns, backends, warm_up)
+    return backends
+
+
+def _load_backends(urlpatterns, backends, warm_up):
+    for pattern in urlpatterns:
+        if hasattr(pattern, 'url_patterns'):
+            _load_backends(pattern.url_patterns, backends, warm_up)
+            path = pattern.default_kwargs.get('backend')
+        else:
+            path = pattern.default_args.get('backend')
+        if path is not None:
+            backend = get_backend(path)
+        else:
+            # Class-based views carry the backend they loaded. Only
+            # look at callbacks which are already imported, rather
+            # than importing every view named by a string.
+            backend = getattr(getattr(pattern, '_callback', None), 'backend', None)
+            if backend is None:
+                continue
+        if backend not in backends:
+            if warm_up and hasattr(backend, 'warm_up'):
+                backend.warm_up()
+            backends.append(backend)
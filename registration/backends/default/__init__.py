@@ -1,10 +1,12 @@
 from django.conf import settings
-from django.contrib.sites.models import RequestSite
-from django.contrib.sites.models import Site
+from django.template import TemplateDoesNotExist
 
+from registration import mail
 from registration import signals
 from registration.forms import RegistrationForm
+from registration.forms import compile_form
 from registration.models import RegistrationProfile
+from registration.sites import get_current_site
 
 
 class DefaultBackend(object):
@@ -71,10 +73,7 @@ class DefaultBackend(object):
 
         """
         username, email, password = kwargs['username'], kwargs['email'], kwargs['password1']
-        if Site._meta.installed:
-            site = Site.objects.get_current()
-        else:
-            site = RequestSite(request)
+        site = get_current_site(request)
         new_user = RegistrationProfile.objects.create_inactive_user(username, email,
                                                                     password, site)
         signals.user_registered.send(sender=self.__class__,
@@ -82,6 +81,42 @@ class DefaultBackend(object):
                                      request=request)
         return new_user
 
+    def register_batch(self, request, registrations):
+        """
+        Register several new, inactive user accounts at once, given a
+        list of dictionaries each with a username, email address and
+        password, returning a ``(user, error)`` pair for each as
+        ``RegistrationProfile.objects.create_inactive_users()`` does.
+
+        The users and their ``RegistrationProfile``s are created in a
+        single transaction, and their activation emails are then sent
+        one by one over a single connection (or added to the outbox in
+        one query, if ``REGISTRATION_EMAIL_OUTBOX`` is ``True``). An
+        account whose email can't be sent is still created, and is
+        reported as a ``User`` together with an error; its email can
+        be sent again later from the admin. The signal
+        ``registration.signals.user_registered`` is sent for each new
+        ``User``, as by ``register()``.
+
+        """
+        site = get_current_site(request)
+        records = [(data['username'], data['email'], data['password1']) for data in registrations]
+        # The records have been cleaned by the registration form, so
+        # only uniqueness is left to check.
+        results = RegistrationProfile.objects.create_inactive_users(records, site, send_email=False,
+                                                                    batch_size=max(len(records), 1),
+                                                                    validate=False)
+        new_users = [new_user for new_user, error in results if new_user is not None]
+        keys = dict(RegistrationProfile.objects.filter(user__in=new_users).values_list('user', 'activation_key'))
+        failed = mail.send_activation_emails_separately([(new_user, keys[new_user.pk])
+                                                         for new_user in new_users], site)
+        for new_user in new_users:
+            signals.user_registered.send(sender=self.__class__,
+                                         user=new_user,
+                                         request=request)
+        return [(new_user, new_user in failed and u"The activation email could not be sent." or error)
+                for new_user, error in results]
+
     def activate(self, request, activation_key):
         """
         Given an an activation key, look up and activate the user
@@ -100,6 +135,26 @@ class DefaultBackend(object):
                                         request=request)
         return activated
 
+    def activate_users(self, request, queryset):
+        """
+        Activate, in bulk, the user accounts of all pending
+        ``registration.models.RegistrationProfile``s in ``queryset``,
+        returning a list of the activated ``User``s.
+
+        As with ``activate()``, the signal
+        ``registration.signals.user_activated`` will be sent for each
+        newly activated ``User``, with the class of this backend as
+        the sender; accounts which had expired or were already active
+        are skipped, and no signal is sent for them.
+        
+        """
+        activated = RegistrationProfile.objects.activate_users(queryset)
+        for user in activated:
+            signals.user_activated.send(sender=self.__class__,
+                                        user=user,
+                                        request=request)
+        return activated
+
     def registration_allowed(self, request):
         """
         Indicate whether account registration is currently permitted,
@@ -122,6 +177,27 @@ class DefaultBackend(object):
         """
         return RegistrationForm
 
+    def warm_up(self):
+        """
+        Load and cache the templates of the activation email and the
+        registration form, and resolve and compile the form class, so
+        that the first registration handled by this process doesn't
+        pay for any of them.
+
+        As with ``RegisterView``, the form class is obtained by
+        passing ``None`` as the request to ``get_form_class()``.
+        
+        """
+        mail.get_template('registration/activation_email_subject.txt')
+        mail.get_template('registration/activation_email.txt')
+        compile_form(self.get_form_class(None))
+        try:
+            mail.get_template('registration/registration_form.html')
+        except TemplateDoesNotExist:
+            # A site which only registers users through JSON needn't
+            # have one.
+            pass
+
     def post_registration_redirect(self, request, user):
         """
         Return the name of the URL to redirect to after successful
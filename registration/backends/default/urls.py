@@ -21,8 +21,11 @@ up your own URL patterns for these views instead.
 from django.conf.urls.defaults import *
 from django.views.generic.base import TemplateView
 
-from registration.views import activate
-from registration.views import register
+from registration.backends import load_backends
+from registration.views import ActivateView
+from registration.views import check_availability
+from registration.views import RegisterView
+from registration.views import register_batch
 
 
 urlpatterns = patterns('',
@@ -34,13 +37,19 @@ urlpatterns = patterns('',
                        # that way it can return a sensible "invalid key" message instead of a
                        # confusing 404.
                        url(r'^activate/(?P<activation_key>\w+)/$',
-                           activate,
-                           {'backend': 'registration.backends.default.DefaultBackend'},
+                           ActivateView.as_view(backend='registration.backends.default.DefaultBackend'),
                            name='registration_activate'),
                        url(r'^register/$',
-                           register,
-                           {'backend': 'registration.backends.default.DefaultBackend'},
+                           RegisterView.as_view(backend='registration.backends.default.DefaultBackend'),
                            name='registration_register'),
+                       url(r'^register/batch/$',
+                           register_batch,
+                           {'backend': 'registration.backends.default.DefaultBackend'},
+                           name='registration_register_batch'),
+                       url(r'^register/available/$',
+                           check_availability,
+                           {'backend': 'registration.backends.default.DefaultBackend'},
+                           name='registration_check_availability'),
                        url(r'^register/complete/$',
                            TemplateView.as_view(template_name='registration/registration_complete.html'),
                            name='registration_complete'),
@@ -49,3 +58,5 @@ urlpatterns = patterns('',
                            name='registration_disallowed'),
                        (r'', include('registration.auth_urls')),
                        )
+
+load_backends(urlpatterns)
@@ -21,17 +21,23 @@ up your own URL patterns for these views instead.
 from django.conf.urls.defaults import *
 from django.views.generic.base import TemplateView
 
-from registration.views import activate
-from registration.views import register
+from registration.backends import load_backends
+from registration.views import check_availability
+from registration.views import RegisterView
 
 
 urlpatterns = patterns('',
                        url(r'^register/$',
-                           register,
-                           {'backend': 'registration.backends.nameless.NamelessBackend'},
+                           RegisterView.as_view(backend='registration.backends.nameless.NamelessBackend'),
                            name='registration_register'),
+                       url(r'^register/available/$',
+                           check_availability,
+                           {'backend': 'registration.backends.nameless.NamelessBackend'},
+                           name='registration_check_availability'),
                        url(r'^register/closed/$',
                            TemplateView.as_view(template_name='registration/registration_closed.html'),
                            name='registration_disallowed'),
                        (r'', include('registration.auth_urls')),
                        )
+
+load_backends(urlpatterns)
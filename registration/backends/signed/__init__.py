@@ -0,0 +1,174 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils.crypto import constant_time_compare
+from django.utils.crypto import salted_hmac
+from django.utils.http import base36_to_int
+from django.utils.http import int_to_base36
+
+from registration import signals
+from registration.backends.default import DefaultBackend
+from registration.mail import send_activation_email
+from registration.sites import get_current_site
+
+
+class SignedBackend(DefaultBackend):
+    """
+    A registration backend which follows the same two-step workflow
+    as ``registration.backends.default.DefaultBackend``, but which
+    stores nothing in the database besides the ``User`` itself:
+
+    1. User signs up, inactive account is created.
+
+    2. Email is sent to user with activation link; the activation key
+       in the link is signed with the ``SECRET_KEY`` setting, and
+       encodes the account it belongs to and the time it expires.
+
+    3. User clicks activation link; if the signature is valid, the key
+       has not expired and the account has not changed since the key
+       was issued, the account is now active.
+
+    Because no ``RegistrationProfile`` is created, this backend
+    requires neither the ``registration`` models nor any cleanup of
+    activation data. Its settings, templates and redirects are
+    otherwise the same as those of the default backend.
+
+    Like the tokens of ``django.contrib.auth``'s password reset, the
+    signature also covers the account's password hash, ``last_login``
+    and ``is_active``, and activation updates ``last_login``; so a key
+    can only be used once, and an account which has been activated
+    and then deactivated by site administrators can't be reactivated
+    through its old activation link.
+    
+    """
+    key_salt = 'registration.backends.signed.SignedBackend'
+
+    def register(self, request, **kwargs):
+        """
+        Given a username, email address and password, register a new
+        user account, which will initially be inactive, and email it
+        an activation key.
+
+        The email will be rendered using the same two templates, and
+        with the same context, as
+        ``RegistrationProfile.send_activation_email()``, and is
+        likewise queued in the outbox if ``REGISTRATION_EMAIL_OUTBOX``
+        is ``True``.
+
+        After the ``User`` is created and the activation email is
+        sent, the signal ``registration.signals.user_registered`` will
+        be sent, with the new ``User`` as the keyword argument
+        ``user`` and the class of this backend as the sender.
+
+        """
+        username, email, password = kwargs['username'], kwargs['email'], kwargs['password1']
+        site = get_current_site(request)
+        new_user = User.objects.create_user(username, email, password)
+        new_user.is_active = False
+        new_user.save()
+        self.send_activation_email(new_user, site)
+        signals.user_registered.send(sender=self.__class__,
+                                     user=new_user,
+                                     request=request)
+        return new_user
+    register = transaction.commit_on_success(register)
+
+    # Batch registration isn't supported: the default backend's creates
+    # RegistrationProfiles, which this backend doesn't use. The
+    # register_batch view turns requests away when it is None.
+    register_batch = None
+
+    def activate(self, request, activation_key):
+        """
+        Given an an activation key, verify its signature and expiry
+        and, if both are valid, activate the user account it was
+        issued to.
+
+        Activation is a single conditional ``UPDATE`` of the account's
+        ``is_active`` and ``last_login`` fields, so a given key can
+        only activate an inactive account whose ``last_login`` is the
+        one it was signed with, and concurrent uses of the same key
+        will only activate it once.
+
+        After successful activation, the signal
+        ``registration.signals.user_activated`` will be sent, with the
+        newly activated ``User`` as the keyword argument ``user`` and
+        the class of this backend as the sender.
+        
+        """
+        user = self.check_activation_key(activation_key)
+        if user is None:
+            return False
+        # last_login is signed to the second, so it must move to a
+        # later second for the key to stop working.
+        last_login = max(datetime.datetime.now().replace(microsecond=0),
+                         user.last_login.replace(microsecond=0) + datetime.timedelta(seconds=1))
+        if not User.objects.filter(pk=user.pk, is_active=False,
+                                   last_login=user.last_login).update(is_active=True,
+                                                                      last_login=last_login):
+            return False
+        user.is_active = True
+        user.last_login = last_login
+        signals.user_activated.send(sender=self.__class__,
+                                    user=user,
+                                    request=request)
+        return user
+
+    def make_activation_key(self, user):
+        """
+        Return the signed activation key for a ``User``, which expires
+        ``ACCOUNT_ACTIVATION_DAYS`` days after the ``User``'s
+        ``date_joined``.
+        
+        """
+        expires = user.date_joined + datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS)
+        value = "%s-%s" % (int_to_base36(user.pk),
+                           int_to_base36(int(time.mktime(expires.timetuple()))))
+        return "%s-%s" % (value, self.make_signature(value, user))
+
+    def make_signature(self, value, user):
+        """
+        Sign ``value`` together with the state of ``user`` which
+        changes when the account is activated, deactivated or has its
+        password changed.
+
+        """
+        # last_login is signed to the second, since some databases
+        # don't store microseconds.
+        last_login = int(time.mktime(user.last_login.timetuple()))
+        state = "%s%s%s%s" % (value, user.password, last_login, user.is_active)
+        return salted_hmac(self.key_salt, state).hexdigest()
+
+    def check_activation_key(self, activation_key):
+        """
+        Return the ``User`` an activation key was issued to, or
+        ``None`` if the key is malformed, has been tampered with, has
+        expired or no longer matches the account.
+        
+        """
+        try:
+            user_b36, expires_b36, signature = activation_key.split('-')
+            user_id, expires = base36_to_int(user_b36), base36_to_int(expires_b36)
+        except ValueError:
+            return None
+        if expires <= time.time():
+            return None
+        try:
+            user = User.objects.get(pk=user_id)
+        except User.DoesNotExist:
+            return None
+        value = "%s-%s" % (user_b36, expires_b36)
+        if not constant_time_compare(self.make_signature(value, user), signature):
+            return None
+        return user
+
+    def send_activation_email(self, user, site):
+        """
+        Send an activation email, containing a signed activation key,
+        to a ``User``.
+        
+        """
+        send_activation_email(user, self.make_activation_key(user), site)
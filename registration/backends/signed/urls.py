@@ -0,0 +1,58 @@
+"""
+URLconf for registration and activation, using django-registration's
+signed-key backend.
+
+If the default behavior of these views is acceptable to you, simply
+use a line like this in your root URLconf to set up the default URLs
+for registration::
+
+    (r'^accounts/', include('registration.backends.signed.urls')),
+
+This will also automatically set up the views in
+``django.contrib.auth`` at sensible default locations.
+
+If you'd like to customize the behavior (e.g., by passing extra
+arguments to the various views) or split up the URLs, feel free to set
+up your own URL patterns for these views instead.
+
+"""
+
+
+from django.conf.urls.defaults import *
+from django.views.generic.base import TemplateView
+
+from registration.backends import load_backends
+from registration.views import activate
+from registration.views import check_availability
+from registration.views import register
+
+
+urlpatterns = patterns('',
+                       url(r'^activate/complete/$',
+                           TemplateView.as_view(template_name='registration/activation_complete.html'),
+                           name='registration_activation_complete'),
+                       # Activation keys get matched loosely because a bad activation key
+                       # should still get to the view; that way it can return a sensible
+                       # "invalid key" message instead of a confusing 404.
+                       url(r'^activate/(?P<activation_key>[-\w]+)/$',
+                           activate,
+                           {'backend': 'registration.backends.signed.SignedBackend'},
+                           name='registration_activate'),
+                       url(r'^register/$',
+                           register,
+                           {'backend': 'registration.backends.signed.SignedBackend'},
+                           name='registration_register'),
+                       url(r'^register/available/$',
+                           check_availability,
+                           {'backend': 'registration.backends.signed.SignedBackend'},
+                           name='registration_check_availability'),
+                       url(r'^register/complete/$',
+                           TemplateView.as_view(template_name='registration/registration_complete.html'),
+                           name='registration_complete'),
+                       url(r'^register/closed/$',
+                           TemplateView.as_view(template_name='registration/registration_closed.html'),
+                           name='registration_disallowed'),
+                       (r'', include('registration.auth_urls')),
+                       )
+
+load_backends(urlpatterns)
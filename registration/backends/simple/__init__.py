@@ -10,6 +10,9 @@ from registration import signals
 from registration.forms import RegistrationForm
 
 
+MODEL_BACKEND = 'django.contrib.auth.backends.ModelBackend'
+
+
 class SimpleBackend(object):
     """
     A registration backend which implements the simplest possible
@@ -21,14 +24,27 @@ class SimpleBackend(object):
     def register(self, request, **kwargs):
         """
         Create and immediately log in a new user.
+
+        The password is hashed only once, when the account is created;
+        the new user is logged in directly rather than through
+        ``authenticate()``, provided
+        ``django.contrib.auth.backends.ModelBackend`` is among the
+        ``AUTHENTICATION_BACKENDS``.
         
         """
         username, email, password = kwargs['username'], kwargs['email'], kwargs['password1']
-        User.objects.create_user(username, email, password)
-        
-        # authenticate() always has to be called before login(), and
-        # will return the user we just created.
-        new_user = authenticate(username=username, password=password)
+        new_user = User.objects.create_user(username, email, password)
+
+        if MODEL_BACKEND in settings.AUTHENTICATION_BACKENDS:
+            # login() needs to know which authentication backend
+            # vouched for the user, which authenticate() would record
+            # -- at the cost of fetching the user again and hashing
+            # the password a second time. The model backend is the one
+            # which knows about users we just created, so record it
+            # directly.
+            new_user.backend = MODEL_BACKEND
+        else:
+            new_user = authenticate(username=username, password=password)
         login(request, new_user)
         signals.user_registered.send(sender=self.__class__,
                                      user=new_user,
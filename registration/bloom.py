@@ -0,0 +1,336 @@
+"""
+An optional in-memory Bloom filter of the usernames and email
+addresses already in use, which lets the as-you-type availability
+checks of the ``check_availability`` view skip the database query
+whenever a username or email address is almost certainly not taken --
+the common case.
+
+Enabled by the setting ``REGISTRATION_BLOOM_FILTER``. The filter is
+built once per process, in a background thread started the first time
+it is asked for (or up front, by calling ``load_user_filter()`` at
+startup), either by streaming through the ``User`` table or, if
+``REGISTRATION_BLOOM_SNAPSHOT`` names a file written by the
+``buildregistrationbloom`` management command, by loading that file
+and then reading only the users created since. Until it is ready,
+checks go to the database as usual. It is kept up to date as users
+are saved in this process, and every ``refresh_interval`` seconds it
+reads any users created since its last read.
+
+A Bloom filter never reports a key it holds as absent, but may report
+an absent key as present; such false positives simply fall back to
+the database query, and are counted so that the filter's actual
+false-positive rate can be monitored. The filter can still miss users
+-- those created by another process since its last read, those
+committed out of primary key order, and those whose username or email
+address has changed -- so its negative answers are only a hint:
+registering always checks the database.
+
+"""
+
+import hashlib
+import math
+import os
+import random
+import struct
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import connections
+from django.db.models.signals import post_save
+
+from registration.signals import user_registered
+
+
+class BloomFilter(object):
+    """
+    A Bloom filter sized to hold ``capacity`` keys with a
+    false-positive rate of at most ``error_rate``.
+
+    """
+    def __init__(self, capacity, error_rate=0.01):
+        self.size = max(int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)), 8)
+        self.hashes = max(int(round(self.size * math.log(2) / capacity)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        # Derive all the bit positions from two 64-bit hashes.
+        h1, h2 = struct.unpack('<QQ', hashlib.md5(key.encode('utf-8')).digest())
+        return [(h1 + i * h2) % self.size for i in xrange(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        for position in self._positions(key):
+            if not self.bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def write(self, f):
+        f.write(struct.pack('<QQQ', self.size, self.hashes, self.count))
+        f.write(self.bits)
+
+    def read(cls, f):
+        bloom = cls.__new__(cls)
+        bloom.size, bloom.hashes, bloom.count = struct.unpack('<QQQ', f.read(24))
+        bloom.bits = bytearray(f.read((bloom.size + 7) // 8))
+        return bloom
+    read = classmethod(read)
+
+
+class UserFilter(object):
+    """
+    Bloom filters of the (lowercased) usernames and email addresses
+    of all users, with counters of how well they are working.
+
+    """
+    SNAPSHOT_MAGIC = 'RBF1'
+    batch_size = 10000
+    refresh_interval = 5
+
+    def __init__(self, capacity, error_rate=0.01):
+        self.usernames = BloomFilter(capacity, error_rate)
+        self.emails = BloomFilter(capacity, error_rate)
+        self.last_pk = 0
+        self.refreshed_at = 0
+        self.checks = self.skipped = self.false_positives = 0
+        self._lock = threading.RLock()
+
+    def add(self, username, email):
+        # Setting bits isn't atomic, and a bit lost to a race would
+        # make a taken username look available.
+        self._lock.acquire()
+        try:
+            self.usernames.add(username.lower())
+            if email:
+                self.emails.add(email.strip().lower())
+        finally:
+            self._lock.release()
+
+    def catch_up(self):
+        """
+        Add the users created since the last call, reading them in
+        batches ordered by primary key.
+
+        """
+        while True:
+            rows = list(User.objects.filter(pk__gt=self.last_pk).order_by('pk')
+                        .values_list('pk', 'username', 'email')[:self.batch_size])
+            for pk, username, email in rows:
+                self.add(username, email)
+                self.last_pk = pk
+            if len(rows) < self.batch_size:
+                break
+        self.refreshed_at = time.time()
+
+    def refresh(self):
+        """
+        Call ``catch_up()`` if it hasn't been called for
+        ``refresh_interval`` seconds, unless another thread already
+        is.
+
+        """
+        if time.time() - self.refreshed_at < self.refresh_interval:
+            return
+        if not self._lock.acquire(False):
+            return
+        try:
+            self.catch_up()
+        finally:
+            self._lock.release()
+
+    def might_have_username(self, username):
+        return self._check(self.usernames, username.lower())
+
+    def might_have_email(self, email):
+        return self._check(self.emails, email.strip().lower())
+
+    def _check(self, bloom, key):
+        self.refresh()
+        self.checks += 1
+        if key in bloom:
+            return True
+        self.skipped += 1
+        return False
+
+    def record_false_positive(self):
+        """
+        Record that a key the filter reported as possibly present
+        turned out not to be.
+
+        """
+        self.false_positives += 1
+
+    def stats(self):
+        """
+        Return a dictionary describing the filter: the memory it uses
+        in bytes, the number of keys added, the number of checks
+        made, how many of those skipped the database, and the
+        measured false-positive rate.
+
+        """
+        negatives = self.skipped + self.false_positives
+        return {'memory': len(self.usernames.bits) + len(self.emails.bits),
+                'keys': self.usernames.count + self.emails.count,
+                'checks': self.checks,
+                'skipped': self.skipped,
+                'false_positives': self.false_positives,
+                'false_positive_rate': negatives and float(self.false_positives) / negatives or 0.0}
+
+    def measure_false_positive_rate(self, samples=10000):
+        """
+        Estimate the false-positive rate by checking ``samples``
+        random keys, which are almost certainly absent.
+
+        """
+        hits = 0
+        for i in xrange(samples):
+            key = u'%032x' % random.getrandbits(128)
+            if key in self.usernames:
+                hits += 1
+        return float(hits) / samples
+
+    def save(self, path):
+        """
+        Write the filter to the file ``path``, replacing it atomically.
+
+        """
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+        f = os.fdopen(fd, 'wb')
+        try:
+            f.write(struct.pack('<4sQ', self.SNAPSHOT_MAGIC, self.last_pk))
+            self.usernames.write(f)
+            self.emails.write(f)
+        finally:
+            f.close()
+        os.rename(tmp_path, path)
+
+    def load(cls, path):
+        """
+        Read a filter written by ``save()``.
+
+        """
+        f = open(path, 'rb')
+        try:
+            magic, last_pk = struct.unpack('<4sQ', f.read(12))
+            if magic != cls.SNAPSHOT_MAGIC:
+                raise ValueError("%s is not a registration Bloom filter snapshot." % path)
+            user_filter = cls.__new__(cls)
+            user_filter.usernames = BloomFilter.read(f)
+            user_filter.emails = BloomFilter.read(f)
+        finally:
+            f.close()
+        user_filter.last_pk = last_pk
+        user_filter.refreshed_at = 0
+        user_filter.checks = user_filter.skipped = user_filter.false_positives = 0
+        user_filter._lock = threading.RLock()
+        return user_filter
+    load = classmethod(load)
+
+
+_user_filter = None
+_user_filter_lock = threading.Lock()
+_building = False
+
+
+def build_user_filter():
+    """
+    Build a ``UserFilter`` sized by the settings
+    ``REGISTRATION_BLOOM_CAPACITY`` (default one million) and
+    ``REGISTRATION_BLOOM_ERROR_RATE`` (default 0.01), from the
+    snapshot named by ``REGISTRATION_BLOOM_SNAPSHOT`` if it exists,
+    and bring it up to date from the ``User`` table.
+
+    """
+    snapshot = getattr(settings, 'REGISTRATION_BLOOM_SNAPSHOT', None)
+    if snapshot and os.path.exists(snapshot):
+        user_filter = UserFilter.load(snapshot)
+    else:
+        user_filter = UserFilter(getattr(settings, 'REGISTRATION_BLOOM_CAPACITY', 1000000),
+                                 getattr(settings, 'REGISTRATION_BLOOM_ERROR_RATE', 0.01))
+    user_filter.catch_up()
+    return user_filter
+
+
+def load_user_filter():
+    """
+    Build this process's ``UserFilter`` now, in the calling thread,
+    and return it; intended to be called at startup (e.g., from a
+    WSGI script), so that the filter is ready for the first request.
+
+    """
+    global _user_filter
+    user_filter = build_user_filter()
+    _user_filter = user_filter
+    return user_filter
+
+
+def _build_in_background():
+    global _building
+    try:
+        try:
+            load_user_filter()
+        except Exception:
+            # Leave the filter unbuilt; the next call to
+            # get_user_filter() will try again.
+            pass
+    finally:
+        _building = False
+        for connection in connections.all():
+            connection.close()
+
+
+def get_user_filter():
+    """
+    Return this process's ``UserFilter``, or ``None`` if
+    ``REGISTRATION_BLOOM_FILTER`` isn't ``True`` or the filter isn't
+    ready yet.
+
+    The first call starts building the filter in a background thread,
+    so that no request waits for it to read the ``User`` table.
+
+    """
+    global _building
+    if not getattr(settings, 'REGISTRATION_BLOOM_FILTER', False):
+        return None
+    if _user_filter is None and not _building:
+        _user_filter_lock.acquire()
+        try:
+            if _user_filter is None and not _building:
+                _building = True
+                thread = threading.Thread(target=_build_in_background)
+                thread.setDaemon(True)
+                thread.start()
+        finally:
+            _user_filter_lock.release()
+    return _user_filter
+
+
+def clear_user_filter():
+    """
+    Discard this process's ``UserFilter``; it will be rebuilt when
+    next needed.
+
+    """
+    global _user_filter
+    _user_filter = None
+
+
+def add_user(sender, **kwargs):
+    """
+    Add a saved or newly registered user to this process's filter, if
+    it has been built.
+
+    """
+    user = kwargs.get('instance') or kwargs.get('user')
+    if _user_filter is not None and user is not None:
+        _user_filter.add(user.username, user.email)
+
+post_save.connect(add_user, sender=User)
+user_registered.connect(add_user)
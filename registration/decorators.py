@@ -1,22 +1,27 @@
 
 import json
 
-from django.contrib.sites.models import Site
 from django.http import HttpResponse
 
+from registration.sites import get_current_site
+
 class HttpResponseNotAuthorized(HttpResponse):
     status_code = 401
 
     def __init__(self, *args, **kwargs):
+        request = kwargs.pop('request', None)
         HttpResponse.__init__(self, *args, **kwargs)
-        self['WWW-Authenticate'] = 'Cookie realm="%s"' % Site.objects.get_current().name
+        site = get_current_site(request)
+        if site is not None:
+            self['WWW-Authenticate'] = 'Cookie realm="%s"' % site.name
 
 def json_login_required(view_func):
     def wrap(instance, request, *args, **kwargs):
         if request.user.is_authenticated():
             return view_func(instance, request, *args, **kwargs)
         response_data = json.dumps({ 'not_authenticated': True })
-        return HttpResponseNotAuthorized(response_data, mimetype='application/json')
+        return HttpResponseNotAuthorized(response_data, mimetype='application/json',
+                                         request=request)
     wrap.__doc__ = view_func.__doc__
     wrap.__dict__ = view_func.__dict__
     return wrap
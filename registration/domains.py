@@ -0,0 +1,165 @@
+"""
+Matching of email domains against large blocklists (e.g., of
+disposable email providers), for use by
+``registration.forms.RegistrationFormNoFreeEmail``.
+
+A blocklist is a file with one domain per line, its labels reversed
+(``com.mailinator`` for ``mailinator.com``) and the lines sorted, as
+written by the ``builddomainblocklist`` management command. The file
+is memory-mapped and searched in place, so even very large lists are
+shared between processes through the page cache rather than loaded
+into each one. A domain matches if it, or any domain it is a
+subdomain of, is listed.
+
+The file is checked for changes every ``check_interval`` seconds, and
+reloaded if it has been replaced; replace it atomically (e.g., by
+writing a new file and renaming it over the old one), as the command
+does.
+
+"""
+
+import mmap
+import os
+import threading
+import time
+
+from django.conf import settings
+
+
+def reverse_domain(domain):
+    """
+    Return ``domain``, lowercased, with its labels reversed.
+
+    """
+    return '.'.join(reversed(domain.strip().strip('.').lower().split('.')))
+
+
+class DomainBlocklist(object):
+    """
+    A sorted, memory-mapped file of reversed domains.
+
+    """
+    check_interval = 1
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        f = open(self.path, 'rb')
+        try:
+            stat = os.fstat(f.fileno())
+            if stat.st_size:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                data = ''
+        finally:
+            f.close()
+        # Searches in progress in other threads keep using the old
+        # mapping, which is unmapped once they drop it.
+        self._data = data
+        self._stamp = (stat.st_ino, stat.st_mtime, stat.st_size)
+        self._checked_at = time.time()
+
+    def _reload_if_changed(self):
+        if time.time() - self._checked_at < self.check_interval:
+            return
+        if not self._lock.acquire(False):
+            return
+        try:
+            self._checked_at = time.time()
+            try:
+                stat = os.stat(self.path)
+            except OSError:
+                return
+            if (stat.st_ino, stat.st_mtime, stat.st_size) != self._stamp:
+                self._load()
+        finally:
+            self._lock.release()
+
+    def _contains(self, data, key):
+        # Binary search over byte offsets, widening each probe to the
+        # line containing it.
+        lo, hi = 0, len(data)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = data.rfind('\n', 0, mid) + 1
+            end = data.find('\n', start)
+            if end == -1:
+                end = len(data)
+            line = data[start:end]
+            if line == key:
+                return True
+            if line < key:
+                lo = end + 1
+            else:
+                hi = start
+        return False
+
+    def matches(self, domain):
+        """
+        Return ``True`` if ``domain``, or a domain it is a subdomain
+        of, is in the blocklist.
+
+        """
+        self._reload_if_changed()
+        data = self._data
+        labels = reverse_domain(domain).encode('utf-8').split('.')
+        for i in range(1, len(labels) + 1):
+            if self._contains(data, '.'.join(labels[:i])):
+                return True
+        return False
+
+
+_blocklists = {}
+_blocklists_lock = threading.Lock()
+
+
+def get_blocklist(path=None):
+    """
+    Return the ``DomainBlocklist`` for the file ``path`` (by default,
+    the setting ``REGISTRATION_DOMAIN_BLOCKLIST``), opening it only
+    the first time it is requested in this process, or ``None`` if no
+    path is given or set.
+
+    """
+    if path is None:
+        path = getattr(settings, 'REGISTRATION_DOMAIN_BLOCKLIST', None)
+        if path is None:
+            return None
+    try:
+        return _blocklists[path]
+    except KeyError:
+        pass
+    _blocklists_lock.acquire()
+    try:
+        if path not in _blocklists:
+            _blocklists[path] = DomainBlocklist(path)
+        return _blocklists[path]
+    finally:
+        _blocklists_lock.release()
+
+
+def write_blocklist(domains, path):
+    """
+    Write the domains in the iterable ``domains`` to the file
+    ``path`` as a blocklist, replacing any existing file atomically.
+
+    """
+    keys = set()
+    for domain in domains:
+        domain = domain.strip()
+        if domain.startswith('*.'):
+            domain = domain[2:]
+        if domain and not domain.startswith('#'):
+            keys.add(reverse_domain(domain).encode('utf-8'))
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    f = open(tmp_path, 'wb')
+    try:
+        for key in sorted(keys):
+            f.write(key + '\n')
+    finally:
+        f.close()
+    os.rename(tmp_path, path)
+    return len(keys)
@@ -3,11 +3,25 @@ Forms and validation code for user registration.
 
 """
 
+import operator
+import threading
 
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core import validators
+from django.db import connections
+from django.db.models import Q
 from django import forms
+from django.forms.forms import NON_FIELD_ERRORS
+from django.forms.util import ErrorList
+from django.utils import translation
+from django.utils.encoding import force_unicode
 from django.utils.translation import ugettext_lazy as _
 
+from registration import bloom
+from registration import domains
+from registration.models import UserLookup
+
 
 # I put this on all required fields, because it's easier to pick up
 # on them with CSS or JavaScript if they have a class of "required"
@@ -15,6 +29,136 @@ from django.utils.translation import ugettext_lazy as _
 # lands in trunk, this will no longer be necessary.
 attrs_dict = {'class': 'required'}
 
+_prefetched = threading.local()
+
+
+def username_taken(username):
+    """
+    Return ``True`` if a user already has ``username``, ignoring case.
+
+    If the setting ``REGISTRATION_USER_LOOKUP`` is ``True``, this is
+    answered from the indexed ``UserLookup`` table rather than by a
+    case-insensitive query on the ``User`` table.
+
+    """
+    prefetched = getattr(_prefetched, 'usernames', {})
+    if username.lower() in prefetched:
+        return prefetched[username.lower()]
+    if getattr(settings, 'REGISTRATION_USER_LOOKUP', False):
+        return UserLookup.objects.username_taken(username)
+    return User.objects.filter(username__iexact=username).exists()
+
+
+def email_taken(email):
+    """
+    Return ``True`` if a user already has the email address
+    ``email``, ignoring case.
+
+    If the setting ``REGISTRATION_USER_LOOKUP`` is ``True``, this is
+    answered from the indexed ``UserLookup`` table rather than by a
+    case-insensitive query on the ``User`` table.
+
+    """
+    prefetched = getattr(_prefetched, 'emails', {})
+    if email.strip().lower() in prefetched:
+        return prefetched[email.strip().lower()]
+    if getattr(settings, 'REGISTRATION_USER_LOOKUP', False):
+        return UserLookup.objects.email_taken(email)
+    return User.objects.filter(email__iexact=email).exists()
+
+
+def prefetch_taken(usernames=(), emails=(), hint=False):
+    """
+    Find out, in a single query, which of ``usernames`` and
+    ``emails`` are already taken, ignoring case, and have
+    ``username_taken()`` and ``email_taken()`` answer from the result
+    for those values in the current thread, until
+    ``clear_prefetched_taken()`` is called.
+
+    This lets the availability of many values be checked through the
+    forms' usual validation without a query for each.
+
+    If ``hint`` is ``True`` and the setting
+    ``REGISTRATION_BLOOM_FILTER`` is ``True``, values which the Bloom
+    filter of existing users doesn't hold are taken to be available
+    without querying for them. The filter may lag behind the
+    database, so this is only suitable when the answer is advisory,
+    as when checking a form's fields as the user types; never pass
+    ``hint`` when registering.
+
+    """
+    usernames = set([username.lower() for username in usernames])
+    emails = set([email.strip().lower() for email in emails])
+    candidate_usernames, candidate_emails = usernames, emails
+    user_filter = hint and bloom.get_user_filter() or None
+    if user_filter is not None:
+        candidate_usernames = set([username for username in usernames
+                                   if user_filter.might_have_username(username)])
+        candidate_emails = set([email for email in emails
+                                if user_filter.might_have_email(email)])
+
+    taken_usernames, taken_emails = set(), set()
+    if candidate_usernames or candidate_emails:
+        if getattr(settings, 'REGISTRATION_USER_LOOKUP', False):
+            lookups = []
+            if candidate_usernames:
+                lookups.append(Q(username__in=list(candidate_usernames)))
+            if candidate_emails:
+                lookups.append(Q(email__in=list(candidate_emails)))
+            rows = UserLookup.objects.filter(reduce(operator.or_, lookups))
+        else:
+            # Comparing uppercased values with IN, rather than OR-ing
+            # together one iexact lookup per value, keeps the query
+            # flat however many values there are; SQLite, for one,
+            # refuses deeply nested expressions.
+            qn = connections[User.objects.db].ops.quote_name
+            where, params = [], []
+            for column, values in (('username', candidate_usernames), ('email', candidate_emails)):
+                if values:
+                    where.append('UPPER(%s.%s) IN (%s)' % (qn(User._meta.db_table), qn(column),
+                                                           ', '.join(['UPPER(%s)'] * len(values))))
+                    params.extend(values)
+            rows = User.objects.extra(where=[' OR '.join(where)], params=params)
+        for username, email in rows.values_list('username', 'email'):
+            if username.lower() in candidate_usernames:
+                taken_usernames.add(username.lower())
+            if email.strip().lower() in candidate_emails:
+                taken_emails.add(email.strip().lower())
+        if user_filter is not None:
+            for i in range(len(candidate_usernames - taken_usernames) +
+                           len(candidate_emails - taken_emails)):
+                user_filter.record_false_positive()
+
+    _prefetched.usernames = dict([(username, username in taken_usernames) for username in usernames])
+    _prefetched.emails = dict([(email, email in taken_emails) for email in emails])
+
+
+def clear_prefetched_taken():
+    """
+    Discard the results of ``prefetch_taken()`` for the current
+    thread.
+
+    """
+    _prefetched.usernames = {}
+    _prefetched.emails = {}
+
+
+def mark_taken(username=None, email=None):
+    """
+    Have ``username_taken()`` and ``email_taken()`` report
+    ``username`` and ``email`` as taken in the current thread, until
+    ``clear_prefetched_taken()`` is called; used to stop one batch of
+    registrations from claiming the same username or email address
+    twice.
+
+    """
+    if username:
+        _prefetched.usernames = getattr(_prefetched, 'usernames', {})
+        _prefetched.usernames[username.lower()] = True
+    if email:
+        _prefetched.emails = getattr(_prefetched, 'emails', {})
+        _prefetched.emails[email.strip().lower()] = True
+
 
 class RegistrationForm(forms.Form):
     """
@@ -48,11 +192,9 @@ class RegistrationForm(forms.Form):
         in use.
         
         """
-        try:
-            user = User.objects.get(username__iexact=self.cleaned_data['username'])
-        except User.DoesNotExist:
-            return self.cleaned_data['username']
-        raise forms.ValidationError(_("A user with that username already exists."))
+        if username_taken(self.cleaned_data['username']):
+            raise forms.ValidationError(_("A user with that username already exists."))
+        return self.cleaned_data['username']
 
     def clean(self):
         """
@@ -91,7 +233,7 @@ class RegistrationFormUniqueEmail(RegistrationForm):
         site.
         
         """
-        if User.objects.filter(email__iexact=self.cleaned_data['email']):
+        if email_taken(self.cleaned_data['email']):
             raise forms.ValidationError(_("This email address is already in use. Please supply a different email address."))
         return self.cleaned_data['email']
 
@@ -116,11 +258,9 @@ class RegistrationFormUsernameEmailMatch(RegistrationFormUniqueEmail):
         if 'username' in self.cleaned_data and 'email' in self.cleaned_data:
             if self.cleaned_data['username'] != self.cleaned_data['email']:
                 raise forms.ValidationError(_("The username and email fields didn't match."))
-        try:
-            user = User.objects.get(username__iexact=self.cleaned_data['username'])
-        except User.DoesNotExist:
-            return self.cleaned_data['username']
-        raise forms.ValidationError(_("A user with that email address already exists."))
+        if username_taken(self.cleaned_data['username']):
+            raise forms.ValidationError(_("A user with that email address already exists."))
+        return self.cleaned_data['username']
 
 
 class RegistrationFormNoFreeEmail(RegistrationForm):
@@ -130,7 +270,14 @@ class RegistrationFormNoFreeEmail(RegistrationForm):
     useful for preventing automated spam registrations.
     
     To change the list of banned domains, subclass this form and
-    override the attribute ``bad_domains``.
+    override the attribute ``bad_domains``. To ban a large list of
+    domains (e.g., of disposable email providers), set
+    ``REGISTRATION_DOMAIN_BLOCKLIST`` to the path of a blocklist file
+    (see ``registration.domains``); domains in it are banned in
+    addition to ``bad_domains``.
+
+    Subdomains of banned domains are banned too, and domains are
+    compared without regard to case.
     
     """
     bad_domains = ['aim.com', 'aol.com', 'email.com', 'gmail.com',
@@ -144,7 +291,134 @@ class RegistrationFormNoFreeEmail(RegistrationForm):
         webmail domains.
         
         """
-        email_domain = self.cleaned_data['email'].split('@')[1]
-        if email_domain in self.bad_domains:
+        email_domain = self.cleaned_data['email'].split('@')[1].lower()
+        labels = email_domain.split('.')
+        suffixes = ['.'.join(labels[i:]) for i in range(len(labels))]
+        banned = [suffix for suffix in suffixes if suffix in self.bad_domains]
+        blocklist = domains.get_blocklist()
+        if banned or (blocklist is not None and blocklist.matches(email_domain)):
             raise forms.ValidationError(_("Registration using free email addresses is prohibited. Please supply a different email address."))
         return self.cleaned_data['email']
+
+
+class CompiledForm(object):
+    """
+    The validation rules of a form class, gathered once so that data
+    can be validated by them without instantiating the form, which
+    deep-copies every field and widget.
+
+    Data is validated exactly as ``is_valid()`` would: by each field,
+    then by the form's ``clean_<field>()`` methods and finally by its
+    ``clean()`` method, which are called on an instance sharing the
+    class's fields, but otherwise set up as the form's constructor
+    would set it up for ``data``. Only forms which don't override
+    ``__init__()``, or the methods which run validation, can be
+    compiled, since such overrides might change the fields or the
+    steps of validation.
+
+    """
+    def __init__(self, form_class):
+        self.form_class = form_class
+        self.fields = form_class.base_fields
+        self.cleaners = [(name, field, hasattr(form_class, 'clean_%s' % name) and 'clean_%s' % name or None)
+                         for name, field in self.fields.items()]
+        self._messages = {}
+
+    def messages(self):
+        """
+        Return the error messages of every field, translated into the
+        active language, as a dictionary mapping each field's name to
+        a dictionary of its messages. Messages are translated only
+        the first time they are needed in each language.
+
+        """
+        language = translation.get_language()
+        try:
+            return self._messages[language]
+        except KeyError:
+            table = self._messages[language] = dict([(name, dict([(key, force_unicode(message)) for key, message
+                                                                   in field.error_messages.items()]))
+                                                     for name, field in self.fields.items()])
+            return table
+
+    def validate(self, data, files=None):
+        """
+        Validate ``data`` (and ``files``), returning a tuple of the
+        cleaned data and a dictionary mapping the name of each field
+        with errors (or ``NON_FIELD_ERRORS``) to a list of its error
+        messages; the dictionary is empty if the data is valid.
+
+        """
+        if files is None:
+            files = {}
+        # Set the instance up as BaseForm.__init__() would, except for
+        # copying the fields.
+        form = self.form_class.__new__(self.form_class)
+        form.data, form.files, form.is_bound = data, files, True
+        form.auto_id, form.prefix, form.initial = 'id_%s', None, {}
+        form.error_class, form.label_suffix = ErrorList, ':'
+        form.empty_permitted, form._changed_data = False, None
+        form.fields = self.fields
+        form.cleaned_data = {}
+        messages = self.messages()
+        errors = form._errors = {}
+        for name, field, cleaner in self.cleaners:
+            value = field.widget.value_from_datadict(data, files, name)
+            if field.required and value in validators.EMPTY_VALUES:
+                # The most common error is answered from the table,
+                # without raising and translating a ValidationError.
+                errors[name] = [messages[name]['required']]
+                continue
+            try:
+                if isinstance(field, forms.FileField):
+                    form.cleaned_data[name] = field.clean(value, field.initial)
+                else:
+                    form.cleaned_data[name] = field.clean(value)
+                if cleaner is not None:
+                    form.cleaned_data[name] = getattr(form, cleaner)()
+            except forms.ValidationError, e:
+                errors[name] = e.messages
+                form.cleaned_data.pop(name, None)
+        try:
+            form.cleaned_data = form.clean()
+        except forms.ValidationError, e:
+            errors[NON_FIELD_ERRORS] = e.messages
+        return form.cleaned_data, errors
+
+
+_compiled_forms = {}
+_compiled_forms_lock = threading.Lock()
+
+
+# Methods which a compiled form would bypass if a form class
+# overrode them.
+_uncompilable_overrides = ('__init__', 'is_valid', 'full_clean', '_clean_fields',
+                           '_clean_form', '_post_clean')
+
+
+def compile_form(form_class):
+    """
+    Return the ``CompiledForm`` of ``form_class``, compiling it only
+    the first time it is requested in this process, or ``None`` if
+    the form class overrides ``__init__()`` or one of the methods
+    which run validation (``is_valid()``, ``full_clean()``,
+    ``_clean_fields()``, ``_clean_form()`` or ``_post_clean()``), and
+    so can't be compiled.
+
+    """
+    try:
+        return _compiled_forms[form_class]
+    except KeyError:
+        pass
+    _compiled_forms_lock.acquire()
+    try:
+        if form_class not in _compiled_forms:
+            if [name for name in _uncompilable_overrides
+                if getattr(getattr(form_class, name, None), 'im_func', None) is not
+                   getattr(forms.BaseForm, name).im_func]:
+                _compiled_forms[form_class] = None
+            else:
+                _compiled_forms[form_class] = CompiledForm(form_class)
+        return _compiled_forms[form_class]
+    finally:
+        _compiled_forms_lock.release()
@@ -0,0 +1,174 @@
+"""
+An optional negative cache of activation keys known not to activate
+anything -- keys which don't exist, have expired or have already been
+used -- so that repeated attempts with them (from email link scanners
+re-checking old links, or from brute-forcing) are answered by
+``RegistrationProfile.objects.activate_user()`` without a database
+query.
+
+Enabled by the setting ``REGISTRATION_KEY_CACHE``. Each process keeps
+up to ``REGISTRATION_KEY_CACHE_SIZE`` keys (default 10000), each for
+``REGISTRATION_KEY_CACHE_TIMEOUT`` seconds (default 3600); when full,
+the quarter of the keys closest to expiring is dropped. If
+``REGISTRATION_KEY_CACHE_SHARED`` names a cache in ``CACHES``, keys are
+also stored there, so that a key found bad by one process is known to
+all of them.
+
+A key is removed from the cache whenever a ``RegistrationProfile`` is
+saved with it, or created with it in bulk, so that a key which is
+issued, or whose expiry is extended, works at once in this process;
+other processes see the change once their local entry times out.
+
+"""
+
+import operator
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import get_cache
+
+
+class NegativeKeyCache(object):
+    """
+    A bounded, expiring set of bad activation keys, with an optional
+    shared tier, and counters of how often it is hit.
+
+    """
+    def __init__(self, max_size=10000, timeout=3600, shared_cache=None):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.shared_cache = shared_cache
+        self._keys = {}
+        self._lock = threading.Lock()
+        self.hits = self.shared_hits = self.misses = 0
+
+    def _shared_key(self, key):
+        return 'registration.badkey.%s' % key
+
+    def _remember(self, key, expires_at):
+        self._lock.acquire()
+        try:
+            if key not in self._keys and len(self._keys) >= self.max_size:
+                now = time.time()
+                for stale in [stale for stale, stale_expires_at in self._keys.items()
+                              if stale_expires_at <= now]:
+                    del self._keys[stale]
+                if len(self._keys) >= self.max_size:
+                    # Sorting is only needed once per quarter of the
+                    # cache's size, so its cost is spread thinly.
+                    oldest = sorted(self._keys.items(), key=operator.itemgetter(1))
+                    for stale, stale_expires_at in oldest[:max(len(oldest) // 4, 1)]:
+                        del self._keys[stale]
+            self._keys[key] = expires_at
+        finally:
+            self._lock.release()
+
+    def __contains__(self, key):
+        expires_at = self._keys.get(key)
+        if expires_at is not None:
+            if expires_at > time.time():
+                self.hits += 1
+                return True
+            self._keys.pop(key, None)
+        if self.shared_cache is not None and self.shared_cache.get(self._shared_key(key)):
+            self._remember(key, time.time() + self.timeout)
+            self.hits += 1
+            self.shared_hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, key):
+        """
+        Remember ``key`` as bad.
+
+        """
+        self._remember(key, time.time() + self.timeout)
+        if self.shared_cache is not None:
+            self.shared_cache.set(self._shared_key(key), 1, self.timeout)
+
+    def discard(self, key):
+        """
+        Forget ``key``, e.g. because it has just been issued.
+
+        """
+        self._keys.pop(key, None)
+        if self.shared_cache is not None:
+            self.shared_cache.delete(self._shared_key(key))
+
+    def clear(self):
+        """
+        Forget every key in this process, and reset the counters.
+
+        """
+        self._lock.acquire()
+        try:
+            self._keys.clear()
+            self.hits = self.shared_hits = self.misses = 0
+        finally:
+            self._lock.release()
+
+    def stats(self):
+        """
+        Return a dictionary describing the cache: the number of keys
+        held in this process, the number of lookups answered by it
+        (and how many of those came from the shared tier), the number
+        which had to go to the database, and the hit rate.
+
+        """
+        lookups = self.hits + self.misses
+        return {'size': len(self._keys),
+                'hits': self.hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': lookups and float(self.hits) / lookups or 0.0}
+
+
+_key_cache = None
+_key_cache_lock = threading.Lock()
+
+
+def get_key_cache():
+    """
+    Return this process's ``NegativeKeyCache``, creating it the first
+    time it is needed, or ``None`` if ``REGISTRATION_KEY_CACHE`` isn't
+    ``True``.
+
+    """
+    global _key_cache
+    if not getattr(settings, 'REGISTRATION_KEY_CACHE', False):
+        return None
+    if _key_cache is None:
+        _key_cache_lock.acquire()
+        try:
+            if _key_cache is None:
+                shared = getattr(settings, 'REGISTRATION_KEY_CACHE_SHARED', None)
+                _key_cache = NegativeKeyCache(getattr(settings, 'REGISTRATION_KEY_CACHE_SIZE', 10000),
+                                              getattr(settings, 'REGISTRATION_KEY_CACHE_TIMEOUT', 3600),
+                                              shared is not None and get_cache(shared) or None)
+        finally:
+            _key_cache_lock.release()
+    return _key_cache
+
+
+def clear_key_cache():
+    """
+    Discard this process's ``NegativeKeyCache``; it will be recreated
+    when next needed.
+
+    """
+    global _key_cache
+    _key_cache = None
+
+
+def forget_keys(keys):
+    """
+    Remove each of the activation keys ``keys`` from the cache, if it
+    is in use.
+
+    """
+    key_cache = get_key_cache()
+    if key_cache is not None:
+        for key in keys:
+            key_cache.discard(key)
@@ -0,0 +1,316 @@
+"""
+Rendering and delivery of the activation emails sent during
+registration.
+
+"""
+
+import smtplib
+import socket
+import threading
+import time
+
+from django.conf import settings
+from django.core.mail import EmailMessage
+from django.core.mail import get_connection
+from django.template import Context
+from django.template import loader
+from django.utils import translation
+
+from registration.models import QueuedEmail
+
+
+# Compiled templates, keyed by template name and active language.
+_template_cache = {}
+
+
+def get_template(template_name):
+    """
+    Return the compiled template ``template_name``, loading it only
+    the first time it is requested for the active language in this
+    process.
+
+    When ``DEBUG`` is ``True``, templates are loaded afresh each time,
+    so that changes to them show up without restarting the process.
+    Otherwise, call ``clear_template_cache()`` after changing them.
+    
+    """
+    if settings.DEBUG:
+        return loader.get_template(template_name)
+    key = (template_name, translation.get_language())
+    try:
+        return _template_cache[key]
+    except KeyError:
+        template = _template_cache[key] = loader.get_template(template_name)
+        return template
+
+
+def clear_template_cache():
+    """
+    Discard all templates cached by ``get_template()``.
+    
+    """
+    _template_cache.clear()
+
+
+def render_activation_email(activation_key, site):
+    """
+    Render the subject and body of an activation email, returning
+    them as a ``(subject, message)`` tuple.
+
+    See ``RegistrationProfile.send_activation_email()`` for the
+    templates used and the context they receive. The templates are
+    loaded through ``get_template()``, so rendering many emails only
+    loads and compiles them once.
+    
+    """
+    ctx_dict = {'activation_key': activation_key,
+                'expiration_days': settings.ACCOUNT_ACTIVATION_DAYS,
+                'site': site}
+    subject = get_template('registration/activation_email_subject.txt').render(Context(ctx_dict))
+    # Email subject *must not* contain newlines
+    subject = ''.join(subject.splitlines())
+    
+    message = get_template('registration/activation_email.txt').render(Context(ctx_dict))
+    return subject, message
+
+
+class ConnectionPool(object):
+    """
+    A pool of open connections to the mail server, which lets a
+    long-running process reuse connections across requests instead of
+    connecting (and, for SMTP, negotiating TLS and authenticating)
+    once per email.
+
+    Connections are obtained from the configured ``EMAIL_BACKEND``.
+    At most ``max_idle`` unused connections are kept open. A
+    connection which has been idle for ``idle_timeout`` seconds or
+    more is assumed to have been dropped by the server and is
+    replaced; one which has been idle for ``check_interval`` seconds
+    or more is checked with an SMTP ``NOOP`` before being reused, and
+    replaced if the check fails.
+
+    Connections handed out by ``acquire()`` are used by one caller at
+    a time, and must be returned with ``release()``, or with
+    ``discard()`` if an error leaves them in an unknown state.
+
+    Since the server may still drop an idle connection which passed
+    these checks, ``send_messages()`` sends the first email over a
+    reused connection on its own, and if the connection turns out to
+    have been dropped, retries it once over a new one.
+    
+    """
+    def __init__(self, max_idle=4, idle_timeout=30, check_interval=5):
+        self.max_idle = max_idle
+        self.idle_timeout = idle_timeout
+        self.check_interval = check_interval
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Return an open connection, reusing an idle one if there is a
+        healthy one available.
+        
+        """
+        return self._acquire()[0]
+
+    def _acquire(self):
+        # Returns the connection, and whether it was reused.
+        while True:
+            self._lock.acquire()
+            try:
+                if not self._idle:
+                    break
+                connection, last_used = self._idle.pop()
+            finally:
+                self._lock.release()
+            idle = time.time() - last_used
+            if idle < self.idle_timeout and \
+               (idle < self.check_interval or self._healthy(connection)):
+                return connection, True
+            self.discard(connection)
+        return self._connect(), False
+
+    def _connect(self):
+        connection = get_connection()
+        connection.open()
+        return connection
+
+    def release(self, connection):
+        """
+        Return a connection obtained from ``acquire()`` to the pool.
+        
+        """
+        self._lock.acquire()
+        try:
+            if len(self._idle) < self.max_idle:
+                self._idle.append((connection, time.time()))
+                return
+        finally:
+            self._lock.release()
+        self.discard(connection)
+
+    def discard(self, connection):
+        """
+        Close a connection obtained from ``acquire()`` instead of
+        returning it to the pool.
+        
+        """
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """
+        Close all idle connections.
+        
+        """
+        self._lock.acquire()
+        try:
+            idle, self._idle = self._idle, []
+        finally:
+            self._lock.release()
+        for connection, last_used in idle:
+            self.discard(connection)
+
+    def send_messages(self, email_messages):
+        """
+        Send a list of ``EmailMessage`` objects over a pooled
+        connection, returning the number sent.
+        
+        """
+        connection, reused = self._acquire()
+        sent = 0
+        try:
+            if reused and email_messages:
+                try:
+                    sent = connection.send_messages(email_messages[:1]) or 0
+                except (smtplib.SMTPServerDisconnected, socket.error):
+                    self.discard(connection)
+                    connection = self._connect()
+                    sent = connection.send_messages(email_messages[:1]) or 0
+                email_messages = email_messages[1:]
+            if email_messages:
+                sent += connection.send_messages(email_messages) or 0
+        except Exception:
+            self.discard(connection)
+            raise
+        self.release(connection)
+        return sent
+
+    def _healthy(self, connection):
+        # Only the SMTP backend has a server connection to check.
+        if not hasattr(connection, 'connection'):
+            return True
+        try:
+            return connection.connection is not None and \
+                   connection.connection.noop()[0] == 250
+        except Exception:
+            return False
+
+
+# The connection pool used for activation emails when the setting
+# ``REGISTRATION_EMAIL_POOL`` is ``True``.
+connection_pool = ConnectionPool()
+
+
+def send_activation_email(user, activation_key, site, resend=False,
+                          connection=None):
+    """
+    Render an activation email and deliver it to a ``User``.
+
+    If the setting ``REGISTRATION_EMAIL_OUTBOX`` is ``True``, the
+    email is not sent immediately but stored in the outbox (as a
+    ``QueuedEmail``), from which the ``sendregistrationmail``
+    management command will send it; ``resend`` indicates whether
+    this is a repeat of an email which was sent before, which places
+    it behind first-time emails in the outbox.
+
+    Otherwise the email is sent right away: over ``connection``, if
+    given, or else over a connection from ``connection_pool`` if the
+    setting ``REGISTRATION_EMAIL_POOL`` is ``True``, or else over a
+    new connection.
+    
+    """
+    subject, message = render_activation_email(activation_key, site)
+    if getattr(settings, 'REGISTRATION_EMAIL_OUTBOX', False):
+        QueuedEmail.objects.enqueue(user.email, subject, message,
+                                    settings.DEFAULT_FROM_EMAIL,
+                                    priority=resend and QueuedEmail.RESEND or QueuedEmail.FIRST_SEND)
+    elif connection is not None:
+        EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, [user.email],
+                     connection=connection).send()
+    elif getattr(settings, 'REGISTRATION_EMAIL_POOL', False):
+        connection_pool.send_messages([EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL,
+                                                    [user.email])])
+    else:
+        user.email_user(subject, message, settings.DEFAULT_FROM_EMAIL)
+
+
+def send_activation_emails(recipients, site, resend=False, connection=None):
+    """
+    Render activation emails for a sequence of ``(user,
+    activation_key)`` pairs and deliver them all at once, returning
+    the number of emails delivered.
+
+    As with ``send_activation_email()``, the emails are stored in the
+    outbox if ``REGISTRATION_EMAIL_OUTBOX`` is ``True``, with a single
+    query; otherwise they are sent together over ``connection``, a
+    pooled connection or a single new connection.
+    
+    """
+    emails = []
+    for user, activation_key in recipients:
+        subject, message = render_activation_email(activation_key, site)
+        emails.append((user.email, subject, message))
+    if not emails:
+        return 0
+    if getattr(settings, 'REGISTRATION_EMAIL_OUTBOX', False):
+        QueuedEmail.objects.enqueue_many(emails, settings.DEFAULT_FROM_EMAIL,
+                                         priority=resend and QueuedEmail.RESEND or QueuedEmail.FIRST_SEND)
+        return len(emails)
+    messages = [EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, [recipient])
+                for recipient, subject, message in emails]
+    if connection is None and getattr(settings, 'REGISTRATION_EMAIL_POOL', False):
+        return connection_pool.send_messages(messages) or 0
+    if connection is None:
+        connection = get_connection()
+    return connection.send_messages(messages) or 0
+
+
+def send_activation_emails_separately(recipients, site, resend=False):
+    """
+    Render and deliver activation emails for a sequence of ``(user,
+    activation_key)`` pairs, as ``send_activation_emails()`` does, but
+    sending each email on its own, so that a failure to send one
+    doesn't lose the rest; returns the list of the users whose emails
+    couldn't be sent, rather than raising.
+
+    With ``REGISTRATION_EMAIL_OUTBOX``, the emails are all queued in
+    one query, as by ``send_activation_emails()``.
+    
+    """
+    if getattr(settings, 'REGISTRATION_EMAIL_OUTBOX', False):
+        send_activation_emails(recipients, site, resend=resend)
+        return []
+    failed = []
+    connection = get_connection()
+    try:
+        connection.open()
+    except Exception:
+        return [user for user, activation_key in recipients]
+    try:
+        for user, activation_key in recipients:
+            subject, message = render_activation_email(activation_key, site)
+            try:
+                connection.send_messages([EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL,
+                                                       [user.email])])
+            except Exception:
+                failed.append(user)
+                # The connection may be unusable; later emails will
+                # each open a new one.
+                connection.close()
+    finally:
+        connection.close()
+    return failed
@@ -0,0 +1,53 @@
+"""
+A management command which adds a ``UserLookup`` for every existing
+``User`` which doesn't have one yet (e.g., accounts created before
+``UserLookup`` was installed).
+
+Users are read and their lookups inserted in batches, each in its own
+transaction, so the command can be run on a live site, and run again
+safely if interrupted. Once it has completed, set
+``REGISTRATION_USER_LOOKUP`` to ``True``.
+
+"""
+
+import time
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import NoArgsCommand
+from django.db import transaction
+
+from registration.models import UserLookup
+
+
+class Command(NoArgsCommand):
+    help = "Add the case-insensitive username and email lookups of existing users"
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=1000,
+                    help="Number of users to process per transaction."),
+        )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        users = User.objects.order_by('pk').only('username', 'email')
+        started = time.time()
+        created = 0
+        last_pk = None
+        while True:
+            batch = users
+            if last_pk is not None:
+                batch = batch.filter(pk__gt=last_pk)
+            batch = list(batch[:options['batch_size']])
+            if not batch:
+                break
+            created += self._sync_users(batch)
+            last_pk = batch[-1].pk
+            if verbosity > 1:
+                self.stdout.write("Added %d lookups, up to user %d.\n" % (created, last_pk))
+        if verbosity > 0:
+            elapsed = max(time.time() - started, 0.001)
+            self.stdout.write("Added %d lookups (%.1f/s).\n" % (created, created / elapsed))
+
+    def _sync_users(self, users):
+        return UserLookup.objects.sync_users(users)
+    _sync_users = transaction.commit_on_success(_sync_users)
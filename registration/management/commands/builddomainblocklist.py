@@ -0,0 +1,34 @@
+"""
+A management command which converts a plain list of email domains,
+one per line, into the sorted file of reversed domains searched by
+``registration.domains.DomainBlocklist`` (see the setting
+``REGISTRATION_DOMAIN_BLOCKLIST``).
+
+Blank lines and lines starting with ``#`` are ignored, and a leading
+``*.`` is dropped, since every listed domain also blocks its
+subdomains. The output file is replaced atomically, so processes using
+it pick up the new list without restarting.
+
+"""
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from registration.domains import write_blocklist
+
+
+class Command(BaseCommand):
+    args = '<domain list> <blocklist file>'
+    help = "Build an email domain blocklist file from a list of domains"
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError("Enter the path of a list of domains and of the blocklist file to write.")
+        source, path = args
+        f = open(source, 'rb')
+        try:
+            count = write_blocklist((line.decode('utf-8') for line in f), path)
+        finally:
+            f.close()
+        if int(options.get('verbosity', 1)) > 0:
+            self.stdout.write("Wrote %d domains to %s.\n" % (count, path))
@@ -0,0 +1,40 @@
+"""
+A management command which builds the Bloom filter of existing
+usernames and email addresses (see ``registration.bloom``) by
+streaming through the ``User`` table, and writes it to a snapshot
+file, from which processes can then load it at startup (through the
+setting ``REGISTRATION_BLOOM_SNAPSHOT``) instead of building it
+themselves.
+
+Reports the filter's memory use and its false-positive rate, measured
+by checking random keys against it.
+
+"""
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from registration.bloom import UserFilter
+
+
+class Command(BaseCommand):
+    args = '[<file>]'
+    help = "Build the registration Bloom filter of existing users and write it to a snapshot file"
+
+    def handle(self, *args, **options):
+        if len(args) > 1:
+            raise CommandError("Enter at most one snapshot path.")
+        path = args and args[0] or getattr(settings, 'REGISTRATION_BLOOM_SNAPSHOT', None)
+        if not path:
+            raise CommandError("Enter a snapshot path, or set REGISTRATION_BLOOM_SNAPSHOT.")
+
+        user_filter = UserFilter(getattr(settings, 'REGISTRATION_BLOOM_CAPACITY', 1000000),
+                                 getattr(settings, 'REGISTRATION_BLOOM_ERROR_RATE', 0.01))
+        user_filter.catch_up()
+        user_filter.save(path)
+        if int(options.get('verbosity', 1)) > 0:
+            stats = user_filter.stats()
+            self.stdout.write("Wrote %d keys to %s (%d bytes in memory); measured false-positive rate %.4f.\n" % \
+                              (stats['keys'], path, stats['memory'],
+                               user_filter.measure_false_positive_rate()))
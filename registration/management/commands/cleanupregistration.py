@@ -2,18 +2,199 @@
 A management command which deletes expired accounts (e.g.,
 accounts which signed up but never activated) from the database.
 
-Calls ``RegistrationProfile.objects.delete_expired_users()``, which
-contains the actual logic for determining which accounts are deleted.
+Calls ``RegistrationProfile.objects.delete_expired_users_in_batches()``,
+which contains the actual logic for determining which accounts are
+deleted.
+
+Accounts are deleted in small batches, each in its own transaction,
+optionally pausing between batches (``--sleep``) and stopping after a
+time limit (``--max-runtime``), so that cleanup can run alongside a
+live site. A stopped run can be resumed from the last primary key it
+processed, either by passing that key as ``--start-after`` or by
+keeping it in a ``--state-file``.
+
+To clear a large backlog quickly, ``--workers`` splits the primary
+keys of the expired profiles into ranges and cleans them up
+concurrently from a pool of processes, each with its own database
+connection.
 
 """
 
+import multiprocessing
+import os
+import time
+from optparse import make_option
+
+from django.core.management.base import CommandError
 from django.core.management.base import NoArgsCommand
+from django.db import connections
+from django.db.models import Max
+from django.db.models import Min
 
 from registration.models import RegistrationProfile
 
 
+def split_pk_range(first, last, count):
+    """
+    Split the primary keys from ``first`` to ``last`` inclusive into
+    at most ``count`` contiguous ranges of (nearly) equal width,
+    returned as a list of ``(start_after, end_at)`` tuples.
+    
+    """
+    size = max((last - first + count) // count, 1)
+    ranges = []
+    start = first
+    while start <= last:
+        end = min(start + size - 1, last)
+        ranges.append((start - 1, end))
+        start = end + 1
+    return ranges
+
+
+def _close_connections():
+    """
+    Close any database connections, so that each worker process
+    opens its own rather than sharing one with its parent.
+    
+    """
+    for connection in connections.all():
+        connection.close()
+
+
+def _delete_range(args):
+    """
+    Clean up the expired accounts in one range of primary keys,
+    returning the number of accounts found.
+    
+    """
+    start_after, end_at, batch_size, sleep, dry_run = args
+    deleted = 0
+    for last_pk, count in RegistrationProfile.objects.delete_expired_users_in_batches(batch_size,
+                                                                                      start_after=start_after,
+                                                                                      end_at=end_at,
+                                                                                      dry_run=dry_run):
+        deleted += count
+        if sleep:
+            time.sleep(sleep)
+    return deleted
+
+
 class Command(NoArgsCommand):
     help = "Delete expired user registrations from the database"
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=1000,
+                    help="Number of accounts to delete per transaction."),
+        make_option('--sleep', dest='sleep', type='float', default=0,
+                    help="Seconds to wait between batches."),
+        make_option('--max-runtime', dest='max_runtime', type='float', default=None,
+                    help="Stop after this many seconds; the run can be resumed later."),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+                    help="Count the expired accounts without deleting them."),
+        make_option('--start-after', dest='start_after', type='int', default=None,
+                    help="Resume after this RegistrationProfile primary key."),
+        make_option('--state-file', dest='state_file', default=None,
+                    help="File recording the last primary key processed, resumed from on the next run."),
+        make_option('--workers', dest='workers', type='int', default=1,
+                    help="Number of processes to clean up ranges of primary keys concurrently."),
+        )
 
     def handle_noargs(self, **options):
-        RegistrationProfile.objects.delete_expired_users()
+        verbosity = int(options.get('verbosity', 1))
+        if options['workers'] > 1:
+            if options['state_file'] is not None or options['max_runtime'] is not None:
+                raise CommandError("--workers can't be combined with --state-file or --max-runtime.")
+            return self._handle_parallel(verbosity, options)
+        dry_run = options['dry_run']
+        state_file = options['state_file']
+        start_after = options['start_after']
+        if start_after is None and state_file is not None:
+            start_after = self._read_state(state_file)
+
+        started = time.time()
+        deadline = options['max_runtime'] is not None and started + options['max_runtime'] or None
+        batches = RegistrationProfile.objects.delete_expired_users_in_batches(options['batch_size'],
+                                                                              start_after=start_after,
+                                                                              dry_run=dry_run)
+        deleted = 0
+        last_pk = start_after
+        finished = True
+        for last_pk, count in batches:
+            deleted += count
+            if state_file is not None and not dry_run:
+                self._write_state(state_file, last_pk)
+            if verbosity > 1:
+                self._report(deleted, last_pk, started, dry_run)
+            if deadline is not None and time.time() + options['sleep'] >= deadline:
+                finished = False
+                break
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        if finished and state_file is not None and not dry_run and os.path.exists(state_file):
+            os.remove(state_file)
+        if verbosity > 0:
+            self._report(deleted, last_pk, started, dry_run, detail=verbosity > 1)
+        if not finished and verbosity > 0:
+            self.stdout.write("Stopped at the time limit; resume with --start-after=%d.\n" % last_pk)
+
+    def _handle_parallel(self, verbosity, options):
+        bounds = RegistrationProfile.objects.expired()
+        if options['start_after'] is not None:
+            bounds = bounds.filter(pk__gt=options['start_after'])
+        bounds = bounds.aggregate(first=Min('pk'), last=Max('pk'))
+        started = time.time()
+        deleted = 0
+        if bounds['first'] is not None:
+            # Use more ranges than workers, so that a range dense with
+            # expired accounts doesn't leave the other workers idle.
+            ranges = split_pk_range(bounds['first'], bounds['last'], options['workers'] * 4)
+            tasks = [(start_after, end_at, options['batch_size'], options['sleep'], options['dry_run'])
+                     for start_after, end_at in ranges]
+
+            # Connections mustn't be inherited across the fork.
+            _close_connections()
+            pool = multiprocessing.Pool(options['workers'], initializer=_close_connections)
+            try:
+                for count in pool.imap_unordered(_delete_range, tasks):
+                    deleted += count
+                    if verbosity > 1:
+                        self._report(deleted, None, started, options['dry_run'])
+                pool.close()
+            finally:
+                pool.terminate()
+                pool.join()
+        if verbosity > 0:
+            self._report(deleted, None, started, options['dry_run'], detail=verbosity > 1)
+
+    def _read_state(self, state_file):
+        if not os.path.exists(state_file):
+            return None
+        f = open(state_file)
+        try:
+            contents = f.read().strip()
+        finally:
+            f.close()
+        if not contents:
+            return None
+        try:
+            return int(contents)
+        except ValueError:
+            raise CommandError("State file %s does not contain a primary key." % state_file)
+
+    def _write_state(self, state_file, last_pk):
+        f = open(state_file, 'w')
+        try:
+            f.write('%d\n' % last_pk)
+        finally:
+            f.close()
+
+    def _report(self, deleted, last_pk, started, dry_run, detail=True):
+        # Without detail, just the total; with it, the rate and the
+        # last primary key processed too.
+        message = "%s %d expired accounts" % (dry_run and "Found" or "Deleted", deleted)
+        if detail:
+            elapsed = max(time.time() - started, 0.001)
+            message += " (%.1f/s)" % (deleted / elapsed)
+            if last_pk is not None:
+                message += ", up to primary key %d" % last_pk
+        self.stdout.write(message + ".\n")
@@ -0,0 +1,98 @@
+"""
+A management command which creates inactive accounts, each with a
+``RegistrationProfile``, from a file of existing user records (e.g.,
+when migrating users from another system).
+
+The file may be CSV, with a header row naming the columns
+``username``, ``email`` and ``password``, or newline-delimited JSON,
+with one object containing those keys per line. It is read and
+imported in batches, so files of any size can be imported in constant
+memory.
+
+Calls ``RegistrationProfile.objects.create_inactive_users()``, which
+contains the actual logic for creating the accounts.
+
+"""
+
+import csv
+import itertools
+import json
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.utils.encoding import smart_str
+
+from registration.models import RegistrationProfile
+from registration.sites import get_current_site
+
+
+def _csv_records(f):
+    for row in csv.DictReader(f):
+        yield tuple([(row.get(key) or '').decode('utf-8')
+                     for key in ('username', 'email', 'password')])
+
+
+def _ndjson_records(f):
+    for line in f:
+        if line.strip():
+            row = json.loads(line)
+            yield tuple([row.get(key) or u'' for key in ('username', 'email', 'password')])
+
+
+class Command(BaseCommand):
+    args = '<file>'
+    help = "Create inactive user registrations from a CSV or newline-delimited JSON file"
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default=None,
+                    help="The format of the file, 'csv' or 'ndjson'; guessed from the file extension if not given."),
+        make_option('--batch-size', dest='batch_size', type='int', default=500,
+                    help="Number of accounts to create per transaction."),
+        make_option('--no-email', action='store_false', dest='send_email', default=True,
+                    help="Don't send activation emails; they can be sent later with the admin's re-send action."),
+        )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError("Enter the path of a single file to import.")
+        path = args[0]
+        format = options['format'] or (path.endswith('.csv') and 'csv' or 'ndjson')
+        if format == 'csv':
+            read_records = _csv_records
+        elif format == 'ndjson':
+            read_records = _ndjson_records
+        else:
+            raise CommandError("Unknown format %r; use 'csv' or 'ndjson'." % format)
+
+        send_email = options['send_email']
+        site = None
+        if send_email:
+            site = get_current_site()
+            if site is None:
+                raise CommandError("Sending activation emails requires django.contrib.sites; use --no-email.")
+
+        batch_size = options['batch_size']
+        verbosity = int(options.get('verbosity', 1))
+        created = failed = 0
+        f = open(path, 'rb')
+        try:
+            records = read_records(f)
+            while True:
+                batch = list(itertools.islice(records, batch_size))
+                if not batch:
+                    break
+                results = RegistrationProfile.objects.create_inactive_users(batch, site,
+                                                                            send_email=send_email,
+                                                                            batch_size=batch_size)
+                for (username, email, password), (user, error) in zip(batch, results):
+                    if user is None:
+                        failed += 1
+                        self.stderr.write(smart_str(u"Skipped %s: %s\n" % (username, error)))
+                    else:
+                        created += 1
+                if verbosity > 1:
+                    self.stdout.write("Imported %d accounts so far.\n" % created)
+        finally:
+            f.close()
+        if verbosity > 0:
+            self.stdout.write("Created %d accounts; skipped %d.\n" % (created, failed))
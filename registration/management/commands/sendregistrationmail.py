@@ -0,0 +1,93 @@
+"""
+A management command which sends the emails waiting in the outbox
+(see ``registration.models.QueuedEmail``), for use when the setting
+``REGISTRATION_EMAIL_OUTBOX`` is ``True``.
+
+By default the command runs until interrupted, polling the outbox for
+new emails; pass ``--once`` to have it exit once the outbox is empty
+(e.g., when running it from cron). Emails are sent in batches over a
+single connection to the mail server, which is reopened after any
+error. Emails which fail to send are retried with exponential
+backoff.
+
+"""
+
+import time
+from optparse import make_option
+
+from django.core import mail
+from django.core.management.base import NoArgsCommand
+
+from registration.models import QueuedEmail
+
+
+class Command(NoArgsCommand):
+    help = "Send the activation emails waiting in the registration outbox"
+    option_list = NoArgsCommand.option_list + (
+        make_option('--batch-size', dest='batch_size', type='int', default=100,
+                    help="Number of emails to claim from the outbox at a time."),
+        make_option('--poll-interval', dest='poll_interval', type='float', default=5,
+                    help="Seconds to wait before checking an empty outbox again."),
+        make_option('--backoff', dest='backoff', type='int', default=60,
+                    help="Seconds to wait before the first retry of a failed email; doubles with each further attempt."),
+        make_option('--max-attempts', dest='max_attempts', type='int', default=5,
+                    help="Number of attempts after which a failing email is given up on."),
+        make_option('--once', action='store_true', dest='once', default=False,
+                    help="Exit once the outbox is empty instead of waiting for more emails."),
+        )
+
+    def handle_noargs(self, **options):
+        verbosity = int(options.get('verbosity', 1))
+        started = time.time()
+        sent = retried = failed = 0
+        connection = None
+        try:
+            while True:
+                batch = QueuedEmail.objects.claim(options['batch_size'])
+                if not batch:
+                    if options['once']:
+                        break
+                    if connection is not None:
+                        self._close(connection)
+                        connection = None
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                for queued in batch:
+                    try:
+                        if connection is None:
+                            connection = mail.get_connection()
+                            connection.open()
+                        connection.send_messages([queued.email_message()])
+                    except Exception, e:
+                        if connection is not None:
+                            self._close(connection)
+                            connection = None
+                        queued.defer(e, backoff=options['backoff'],
+                                     max_attempts=options['max_attempts'])
+                        if queued.failed:
+                            failed += 1
+                        else:
+                            retried += 1
+                    else:
+                        queued.delete()
+                        sent += 1
+
+                if verbosity > 1:
+                    self._report(sent, retried, failed, started)
+        finally:
+            if connection is not None:
+                self._close(connection)
+        if verbosity > 0:
+            self._report(sent, retried, failed, started)
+
+    def _close(self, connection):
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _report(self, sent, retried, failed, started):
+        elapsed = max(time.time() - started, 0.001)
+        self.stdout.write("Sent %d emails (%.1f/s); %d to be retried, %d given up.\n" % \
+                          (sent, sent / elapsed, retried, failed))
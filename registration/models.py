@@ -1,17 +1,91 @@
 import datetime
+import itertools
 import random
 import re
 
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.core.validators import validate_email
+from django.db import IntegrityError
+from django.db import connections
 from django.db import models
 from django.db import transaction
-from django.template.loader import render_to_string
+from django.db.models.signals import post_save
+from django.core.mail import EmailMessage
 from django.utils.hashcompat import sha_constructor
 from django.utils.translation import ugettext_lazy as _
 
+from registration import keycache
+
 
 SHA1_RE = re.compile('^[a-f0-9]{40}$')
+USERNAME_RE = re.compile(r'^\w+$')
+
+
+def _normalize_email(email):
+    """
+    Normalize an email address the way ``User.objects.create_user()``
+    does, by lowercasing its domain part.
+    
+    """
+    try:
+        email_name, domain_part = email.strip().split('@', 1)
+    except ValueError:
+        return email
+    return '@'.join([email_name, domain_part.lower()])
+
+
+def _bulk_create(model, objs):
+    """
+    Insert the given instances of ``model`` with as few queries as
+    the installed version of Django allows.
+    
+    """
+    # QuerySet.bulk_create() is new in Django 1.4; on older versions,
+    # fall back to one INSERT per instance.
+    if hasattr(model._default_manager, 'bulk_create'):
+        model._default_manager.bulk_create(objs)
+    else:
+        for obj in objs:
+            obj.save(force_insert=True)
+
+
+def _taken_usernames(usernames):
+    """
+    Return the set of ``usernames`` (lowercased) which existing users
+    already have, ignoring case, using a single query.
+    
+    """
+    usernames = list(set([username.lower() for username in usernames]))
+    if not usernames:
+        return set()
+    qn = connections[User.objects.db].ops.quote_name
+    where = 'UPPER(%s.%s) IN (%s)' % (qn(User._meta.db_table), qn('username'),
+                                      ', '.join(['UPPER(%s)'] * len(usernames)))
+    return set([username.lower() for username in
+                User.objects.extra(where=[where], params=usernames).values_list('username', flat=True)])
+
+
+def _record_error(username, email):
+    """
+    Check a username and email address to be registered in bulk by
+    the same rules as ``registration.forms.RegistrationForm``,
+    returning a message describing the first problem found, or
+    ``None`` if there is none.
+    
+    """
+    if not username or not email:
+        return u"A username and email address are required."
+    if len(username) > 30 or not USERNAME_RE.search(username):
+        return u"The username must be at most 30 letters, numbers and underscores."
+    try:
+        validate_email(email)
+    except ValidationError:
+        return u"The email address is not valid."
+    if len(email) > 75:
+        return u"The email address must be at most 75 characters."
+    return None
 
 
 class RegistrationManager(models.Manager):
@@ -23,6 +97,25 @@ class RegistrationManager(models.Manager):
     keys), and for cleaning out expired inactive accounts.
     
     """
+    def pending(self):
+        """
+        Return a ``QuerySet`` of ``RegistrationProfile``s which have
+        not been activated and whose activation keys have not yet
+        expired.
+
+        """
+        return self.filter(activated=False,
+                           expires_at__gt=datetime.datetime.now()).exclude(activation_key=self.model.ACTIVATED)
+
+    def expired(self):
+        """
+        Return a ``QuerySet`` of ``RegistrationProfile``s which have
+        not been activated and whose activation keys have expired.
+
+        """
+        return self.filter(activated=False,
+                           expires_at__lte=datetime.datetime.now()).exclude(activation_key=self.model.ACTIVATED)
+
     def activate_user(self, activation_key):
         """
         Validate an activation key and activate the corresponding
@@ -41,24 +134,105 @@ class RegistrationManager(models.Manager):
         reset to the string constant ``RegistrationProfile.ACTIVATED``
         after successful activation.
 
+        The key is reset with a single conditional ``UPDATE`` which
+        only matches a profile that is still pending, so if the same
+        key is submitted concurrently (e.g., by a double-clicked
+        activation link) exactly one caller activates the account and
+        the others receive ``False``. The ``User`` is then activated
+        by updating its ``is_active`` column alone; note that this
+        means no ``post_save`` signal is sent for the ``User``.
+
+        If the setting ``REGISTRATION_KEY_CACHE`` is ``True``, keys
+        which turn out not to exist, to have expired or to have been
+        used are remembered (see ``registration.keycache``), and
+        rejected without a query when they are tried again.
+
         """
         # Make sure the key we're trying conforms to the pattern of a
         # SHA1 hash; if it doesn't, no point trying to look it up in
         # the database.
         if SHA1_RE.search(activation_key):
+            key_cache = keycache.get_key_cache()
+            if key_cache is not None and activation_key in key_cache:
+                return False
             try:
-                profile = self.get(activation_key=activation_key)
+                profile = self.select_related('user').get(activation_key=activation_key)
             except self.model.DoesNotExist:
-                return False
-            if not profile.activation_key_expired():
-                user = profile.user
-                user.is_active = True
-                user.save()
-                profile.activation_key = self.model.ACTIVATED
-                profile.save()
-                return user
+                profile = None
+            if profile is not None and not profile.activation_key_expired():
+                claimed = self.pending().filter(pk=profile.pk).update(activation_key=self.model.ACTIVATED,
+                                                                       activated=True)
+                if claimed:
+                    User.objects.filter(pk=profile.user_id).update(is_active=True)
+                    user = profile.user
+                    user.is_active = True
+                    # The key is used up; a second click on the link
+                    # needn't reach the database.
+                    if key_cache is not None:
+                        key_cache.add(activation_key)
+                    return user
+            if key_cache is not None:
+                key_cache.add(activation_key)
         return False
+    activate_user = transaction.commit_on_success(activate_user)
     
+    def activate_users(self, queryset=None, batch_size=500):
+        """
+        Activate the accounts of all pending ``RegistrationProfile``s
+        in ``queryset`` (by default, all ``RegistrationProfile``s),
+        returning a list of the ``User``s which were activated.
+
+        This is the bulk equivalent of ``activate_user()``, and has
+        the same semantics: profiles which have expired or already
+        activated are skipped, and the activation key of each
+        activated profile is reset to ``RegistrationProfile.ACTIVATED``.
+        Profiles are activated ``batch_size`` at a time, using a
+        fixed number of queries per batch; each batch is claimed
+        with a single conditional ``UPDATE``, so accounts activated
+        concurrently by other means are neither activated nor
+        returned twice.
+
+        Like ``activate_user()``, this method does not send the
+        ``user_activated`` signal; that is left to the backend.
+        
+        """
+        if queryset is None:
+            queryset = self.all()
+        pending = (queryset & self.pending()).order_by('pk')
+        pending = pending.values_list('pk', flat=True)
+
+        activated = []
+        last_pk = None
+        while True:
+            batch = pending
+            if last_pk is not None:
+                batch = batch.filter(pk__gt=last_pk)
+            pks = list(batch[:batch_size])
+            if not pks:
+                break
+            activated.extend(self._activate_batch(pks))
+            last_pk = pks[-1]
+        return activated
+
+    def _activate_batch(self, pks):
+        """
+        Activate one batch of profiles for ``activate_users()``.
+        
+        """
+        # Mark the profiles which are still pending with a key unique
+        # to this batch, so that exactly the profiles claimed here can
+        # be found again.
+        claim = sha_constructor(str(random.random())).hexdigest()
+        self.pending().filter(pk__in=pks).update(activation_key=claim,
+                                                 activated=True)
+        users = list(User.objects.filter(registrationprofile__activation_key=claim))
+        User.objects.filter(pk__in=[user.pk for user in users]).update(is_active=True)
+        self.filter(activation_key=claim).update(activation_key=self.model.ACTIVATED)
+        for user in users:
+            user.is_active = True
+        return users
+    _activate_batch = transaction.commit_on_success(_activate_batch)
+
     def create_inactive_user(self, username, email, password,
                              site, send_email=True):
         """
@@ -82,6 +256,164 @@ class RegistrationManager(models.Manager):
         return new_user
     create_inactive_user = transaction.commit_on_success(create_inactive_user)
 
+    def create_inactive_users(self, records, site, send_email=True,
+                              batch_size=500, validate=True):
+        """
+        Create new, inactive ``User``s and their
+        ``RegistrationProfile``s in bulk, from an iterable of
+        ``(username, email, password)`` records.
+
+        Records are consumed ``batch_size`` at a time; the users and
+        profiles for each batch are inserted together in a single
+        transaction, with one query to find usernames which are
+        already taken, ignoring case. Unless ``validate`` is
+        ``False`` (because the records have already been cleaned by
+        a registration form, whose rules may differ), each record is
+        first checked by the rules of
+        ``registration.forms.RegistrationForm``, so that a bad record
+        is skipped rather than failing the batch's insert. If
+        ``send_email`` is ``True``, activation emails for
+        a batch are sent once it has been committed.
+
+        If another process takes one of a batch's usernames between
+        the check and the insert, the batch's transaction is rolled
+        back and its records are inserted one at a time, so that only
+        the clashing ones are skipped.
+
+        Returns a list with one ``(user, error)`` pair per record, in
+        the order given: ``user`` is the new ``User`` if the record
+        was created (and ``error`` is ``None``), and ``error`` is a
+        message explaining why it was skipped otherwise.
+        
+        """
+        results = []
+        records = iter(records)
+        while True:
+            batch = list(itertools.islice(records, batch_size))
+            if not batch:
+                break
+            try:
+                batch_results = self._create_inactive_batch(batch, validate)
+            except IntegrityError:
+                batch_results = []
+                for record in batch:
+                    try:
+                        batch_results.extend(self._create_inactive_batch([record], validate))
+                    except IntegrityError:
+                        batch_results.append((None, u"A user with that username already exists."))
+            if send_email:
+                from registration.mail import send_activation_emails
+                send_activation_emails([(profile.user, profile.activation_key)
+                                        for profile, error in batch_results if profile is not None],
+                                       site)
+            results.extend([(profile is not None and profile.user or None, error)
+                            for profile, error in batch_results])
+        return results
+
+    def _create_inactive_batch(self, batch, validate=True):
+        """
+        Insert one batch of records for ``create_inactive_users()``,
+        returning a ``(profile, error)`` pair per record.
+        
+        """
+        taken = _taken_usernames([username for username, email, password in batch if username])
+
+        now = datetime.datetime.now()
+        new_users = []
+        errors = []
+        for username, email, password in batch:
+            error = validate and _record_error(username, email) or None
+            if error is not None:
+                errors.append(error)
+            elif username.lower() in taken:
+                errors.append(u"A user with that username already exists.")
+            else:
+                taken.add(username.lower())
+                user = User(username=username, email=_normalize_email(email),
+                            is_staff=False, is_active=False, is_superuser=False,
+                            last_login=now, date_joined=now)
+                user.set_password(password)
+                new_users.append(user)
+                errors.append(None)
+        _bulk_create(User, new_users)
+
+        # Bulk inserts don't report primary keys back on every
+        # database, so read the new users back in one query.
+        created = User.objects.filter(username__in=[user.username for user in new_users])
+        created = dict([(user.username, user) for user in created])
+        profiles = {}
+        for username in created:
+            profiles[username] = self._new_profile(created[username])
+        _bulk_create(self.model, profiles.values())
+        keycache.forget_keys([profile.activation_key for profile in profiles.values()])
+        # Bulk inserts don't send post_save, so add the users' lookups.
+        if user_lookup_synced():
+            UserLookup.objects.sync_users(created.values())
+
+        return [(error is None and profiles[username] or None, error)
+                for (username, email, password), error in zip(batch, errors)]
+    _create_inactive_batch = transaction.commit_on_success(_create_inactive_batch)
+
+    def send_activation_emails(self, queryset, site, resend=False,
+                               batch_size=500):
+        """
+        Send activation emails for all pending ``RegistrationProfile``s
+        in ``queryset``, returning a ``(sent, skipped)`` tuple giving
+        the number of emails sent and the number of profiles skipped
+        because they had expired or already activated.
+
+        Profiles are read, together with their ``User``s,
+        ``batch_size`` at a time, and counted as they are read; the
+        emails for each batch's pending profiles are rendered and then
+        sent together (or queued in the outbox, if
+        ``REGISTRATION_EMAIL_OUTBOX`` is ``True``). All the batches are
+        sent over one connection to the mail server, taken from the
+        connection pool if ``REGISTRATION_EMAIL_POOL`` is ``True``.
+        Pass ``resend=True`` if the emails have been sent before.
+        
+        """
+        from registration import mail
+        queryset = queryset.select_related('user').order_by('pk')
+
+        pooled = getattr(settings, 'REGISTRATION_EMAIL_POOL', False)
+        connection = None
+        if not getattr(settings, 'REGISTRATION_EMAIL_OUTBOX', False):
+            if pooled:
+                connection = mail.connection_pool.acquire()
+            else:
+                connection = mail.get_connection()
+                connection.open()
+        sent = skipped = 0
+        last_pk = None
+        try:
+            while True:
+                batch = queryset
+                if last_pk is not None:
+                    batch = batch.filter(pk__gt=last_pk)
+                profiles = list(batch[:batch_size])
+                if not profiles:
+                    break
+                recipients = []
+                for profile in profiles:
+                    if profile.activation_key_expired():
+                        skipped += 1
+                    else:
+                        recipients.append((profile.user, profile.activation_key))
+                sent += mail.send_activation_emails(recipients, site, resend=resend,
+                                                    connection=connection)
+                last_pk = profiles[-1].pk
+        except Exception:
+            if pooled and connection is not None:
+                mail.connection_pool.discard(connection)
+            elif connection is not None:
+                connection.close()
+            raise
+        if pooled and connection is not None:
+            mail.connection_pool.release(connection)
+        elif connection is not None:
+            connection.close()
+        return sent, skipped
+
     def create_profile(self, user):
         """
         Create a ``RegistrationProfile`` for a given
@@ -89,7 +421,19 @@ class RegistrationManager(models.Manager):
         
         The activation key for the ``RegistrationProfile`` will be a
         SHA1 hash, generated from a combination of the ``User``'s
-        username and a random salt.
+        username and a random salt. The key expires
+        ``ACCOUNT_ACTIVATION_DAYS`` days after the ``User``'s
+        ``date_joined``.
+        
+        """
+        profile = self._new_profile(user)
+        profile.save(using=self._db)
+        return profile
+
+    def _new_profile(self, user):
+        """
+        Build, but do not save, a ``RegistrationProfile`` with a fresh
+        activation key for the given ``User``.
         
         """
         salt = sha_constructor(str(random.random())).hexdigest()[:5]
@@ -97,10 +441,12 @@ class RegistrationManager(models.Manager):
         if isinstance(username, unicode):
             username = username.encode('utf-8')
         activation_key = sha_constructor(salt+username).hexdigest()
-        return self.create(user=user,
-                           activation_key=activation_key)
+        expires_at = user.date_joined + datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS)
+        return self.model(user=user,
+                          activation_key=activation_key,
+                          expires_at=expires_at)
         
-    def delete_expired_users(self):
+    def delete_expired_users(self, batch_size=1000):
         """
         Remove expired instances of ``RegistrationProfile`` and their
         associated ``User``s.
@@ -137,14 +483,67 @@ class RegistrationManager(models.Manager):
         account while keeping it in the database, simply delete the
         associated ``RegistrationProfile``; an inactive ``User`` which
         does not have an associated ``RegistrationProfile`` will not
-        be deleted.
+        be deleted. Accounts which have already activated (and whose
+        ``RegistrationProfile`` has had its key reset to
+        ``RegistrationProfile.ACTIVATED``) are likewise left alone,
+        even if they have since been deactivated.
+
+        Expired accounts are selected with a single cutoff on
+        ``expires_at`` and deleted ``batch_size`` at a time, walking
+        the table in order of primary key, so that memory use and the
+        size of each transaction stay bounded regardless of how many
+        accounts are pending. Returns the number of deleted users.
+        
+        """
+        deleted = 0
+        for last_pk, count in self.delete_expired_users_in_batches(batch_size):
+            deleted += count
+        return deleted
+
+    def delete_expired_users_in_batches(self, batch_size=1000, start_after=None, end_at=None,
+                                        dry_run=False):
+        """
+        Delete expired accounts as ``delete_expired_users()`` does, one
+        batch at a time, yielding after each batch a tuple of the
+        primary key of the last ``RegistrationProfile`` in the batch
+        and the number of accounts it contained.
+
+        Nothing is deleted until the generator is advanced, so the
+        caller can pause between batches or stop at any point; passing
+        the last primary key yielded as ``start_after`` resumes from
+        where a previous run stopped. If ``end_at`` is given, profiles
+        with a greater primary key are left alone, so that separate
+        ranges can be cleaned up concurrently. If ``dry_run`` is
+        ``True``, the expired accounts are counted but not deleted.
         
         """
-        for profile in self.all():
-            if profile.activation_key_expired():
-                user = profile.user
-                if not user.is_active:
-                    user.delete()
+        expired = self.expired().filter(user__is_active=False)
+        if end_at is not None:
+            expired = expired.filter(pk__lte=end_at)
+        expired = expired.order_by('pk').values_list('pk', 'user')
+
+        last_pk = start_after
+        while True:
+            batch = expired
+            if last_pk is not None:
+                batch = batch.filter(pk__gt=last_pk)
+            rows = list(batch[:batch_size])
+            if not rows:
+                break
+            if not dry_run:
+                self._delete_users([user_id for pk, user_id in rows])
+            last_pk = rows[-1][0]
+            yield last_pk, len(rows)
+
+    def _delete_users(self, user_ids):
+        """
+        Delete the inactive ``User``s with the given primary keys (and,
+        through the usual cascade, their ``RegistrationProfile``s) in
+        a single transaction.
+        
+        """
+        User.objects.filter(pk__in=user_ids, is_active=False).delete()
+    _delete_users = transaction.commit_on_success(_delete_users)
 
 
 class RegistrationProfile(models.Model):
@@ -167,6 +566,8 @@ class RegistrationProfile(models.Model):
     
     user = models.ForeignKey(User, unique=True, verbose_name=_('user'))
     activation_key = models.CharField(_('activation key'), max_length=40)
+    activated = models.BooleanField(_('activated'), default=False, db_index=True)
+    expires_at = models.DateTimeField(_('expires at'), db_index=True, blank=True)
     
     objects = RegistrationManager()
     
@@ -176,6 +577,17 @@ class RegistrationProfile(models.Model):
     
     def __unicode__(self):
         return u"Registration information for %s" % self.user
+
+    def save(self, *args, **kwargs):
+        """
+        Save the profile, first setting ``expires_at``, if it isn't
+        set, to ``ACCOUNT_ACTIVATION_DAYS`` days after the user
+        joined.
+        
+        """
+        if self.expires_at is None:
+            self.expires_at = self.user.date_joined + datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS)
+        super(RegistrationProfile, self).save(*args, **kwargs)
     
     def activation_key_expired(self):
         """
@@ -185,26 +597,27 @@ class RegistrationProfile(models.Model):
         
         Key expiration is determined by a two-step process:
         
-        1. If the user has already activated, the key will have been
-           reset to the string constant ``ACTIVATED``. Re-activating
-           is not permitted, and so this method returns ``True`` in
-           this case.
+        1. If the user has already activated, ``activated`` will be
+           set and the key will have been reset to the string
+           constant ``ACTIVATED``. Re-activating is not permitted, and
+           so this method returns ``True`` in this case.
+
+        2. Otherwise, ``expires_at`` (the date the user signed up,
+           incremented by the number of days specified in the setting
+           ``ACCOUNT_ACTIVATION_DAYS`` at the time the profile was
+           created) is compared to the current date; if it is less
+           than or equal to the current date, the key has expired and
+           this method returns ``True``.
 
-        2. Otherwise, the date the user signed up is incremented by
-           the number of days specified in the setting
-           ``ACCOUNT_ACTIVATION_DAYS`` (which should be the number of
-           days after signup during which a user is allowed to
-           activate their account); if the result is less than or
-           equal to the current date, the key has expired and this
-           method returns ``True``.
+        Since this only consults fields of the ``RegistrationProfile``
+        itself, it does not need to fetch the associated ``User``.
         
         """
-        expiration_date = datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS)
-        return self.activation_key == self.ACTIVATED or \
-               (self.user.date_joined + expiration_date <= datetime.datetime.now())
+        return self.activated or self.activation_key == self.ACTIVATED or \
+               self.expires_at <= datetime.datetime.now()
     activation_key_expired.boolean = True
 
-    def send_activation_email(self, site):
+    def send_activation_email(self, site, resend=False, connection=None):
         """
         Send an activation email to the user associated with this
         ``RegistrationProfile``.
@@ -241,17 +654,244 @@ class RegistrationProfile(models.Model):
             not). Consult the documentation for the Django sites
             framework for details regarding these objects' interfaces.
 
+        If the setting ``REGISTRATION_EMAIL_OUTBOX`` is ``True``, the
+        email is placed in the outbox (see ``QueuedEmail``) rather
+        than sent immediately; pass ``resend=True`` when re-sending
+        an activation email, so that it queues behind first-time
+        emails.
+
+        Otherwise, the email is sent over ``connection`` (an email
+        backend instance, as returned by
+        ``django.core.mail.get_connection()``) if one is given; see
+        ``registration.mail.send_activation_email()`` for the other
+        options.
+
+        """
+        from registration.mail import send_activation_email
+        send_activation_email(self.user, self.activation_key, site, resend=resend,
+                              connection=connection)
+
+
+class QueuedEmailManager(models.Manager):
+    """
+    Custom manager for the ``QueuedEmail`` model.
+    
+    """
+    def enqueue(self, recipient, subject, message, from_email,
+                priority=0):
+        """
+        Add an email to the outbox, to be sent as soon as possible.
+        
+        """
+        return self.create(recipient=recipient, subject=subject,
+                           message=message, from_email=from_email,
+                           priority=priority)
+
+    def enqueue_many(self, emails, from_email, priority=0):
+        """
+        Add several emails, given as ``(recipient, subject, message)``
+        tuples, to the outbox with as few queries as possible.
+        
+        """
+        _bulk_create(self.model, [self.model(recipient=recipient, subject=subject,
+                                             message=message, from_email=from_email,
+                                             priority=priority)
+                                  for recipient, subject, message in emails])
+
+    def claim(self, batch_size, lease=300):
+        """
+        Claim up to ``batch_size`` emails which are due to be sent,
+        first-time emails first, and return them.
+
+        Claimed emails are not due again for ``lease`` seconds, so if
+        the process sending them dies before it is able to record the
+        outcome, they will be picked up again once the lease expires.
+        Each claim marks its emails with a random ``claim_key``, so
+        that processes claiming at the same time each get only the
+        emails their own ``UPDATE`` claimed.
+        
+        """
+        now = datetime.datetime.now()
+        due = self.filter(failed=False, next_attempt_at__lte=now)
+        ids = list(due.order_by('priority', 'next_attempt_at').values_list('pk', flat=True)[:batch_size])
+        if not ids:
+            return []
+        lease_until = now + datetime.timedelta(seconds=lease)
+        claim = sha_constructor(str(random.random())).hexdigest()
+        self.filter(pk__in=ids, failed=False,
+                    next_attempt_at__lte=now).update(next_attempt_at=lease_until, claim_key=claim)
+        return list(self.filter(claim_key=claim).order_by('priority', 'pk'))
+
+
+class QueuedEmail(models.Model):
+    """
+    An email waiting in the outbox to be sent.
+
+    When the setting ``REGISTRATION_EMAIL_OUTBOX`` is ``True``,
+    activation emails are stored as instances of this model -- in the
+    same transaction as the account they belong to -- rather than
+    being sent during the request which registered the account. They
+    are then sent, and deleted, by the ``sendregistrationmail``
+    management command. Emails which could not be sent are retried
+    with increasing delays, and are kept, marked as ``failed``, once
+    they run out of attempts.
+    
+    """
+    FIRST_SEND = 0
+    RESEND = 1
+    PRIORITY_CHOICES = ((FIRST_SEND, _('first send')),
+                        (RESEND, _('resend')))
+
+    recipient = models.EmailField(_('recipient'), max_length=75)
+    from_email = models.CharField(_('from'), max_length=255)
+    subject = models.CharField(_('subject'), max_length=255)
+    message = models.TextField(_('message'))
+    priority = models.PositiveSmallIntegerField(_('priority'), choices=PRIORITY_CHOICES,
+                                                default=FIRST_SEND)
+    created_at = models.DateTimeField(_('created at'), default=datetime.datetime.now)
+    next_attempt_at = models.DateTimeField(_('next attempt at'), default=datetime.datetime.now,
+                                           db_index=True)
+    attempts = models.PositiveIntegerField(_('attempts'), default=0)
+    failed = models.BooleanField(_('failed'), default=False)
+    last_error = models.TextField(_('last error'), blank=True)
+    claim_key = models.CharField(_('claim key'), max_length=40, blank=True, db_index=True)
+
+    objects = QueuedEmailManager()
+
+    class Meta:
+        verbose_name = _('queued email')
+        verbose_name_plural = _('queued emails')
+
+    def __unicode__(self):
+        return u"Email to %s" % self.recipient
+
+    def email_message(self):
+        """
+        Return this email as a ``django.core.mail.EmailMessage``.
+        
+        """
+        return EmailMessage(self.subject, self.message, self.from_email,
+                            [self.recipient])
+
+    def defer(self, error, backoff=60, max_attempts=5):
+        """
+        Record a failed attempt to send this email. It will be retried
+        after ``backoff`` seconds, doubling with each further failed
+        attempt, until it has been tried ``max_attempts`` times, after
+        which it is marked as ``failed``.
+        
+        """
+        self.attempts += 1
+        self.last_error = unicode(error)
+        if self.attempts >= max_attempts:
+            self.failed = True
+        else:
+            delay = backoff * 2 ** (self.attempts - 1)
+            self.next_attempt_at = datetime.datetime.now() + datetime.timedelta(seconds=delay)
+        self.save()
+
+
+class UserLookupManager(models.Manager):
+    """
+    Custom manager for the ``UserLookup`` model.
+    
+    """
+    def username_taken(self, username):
         """
-        ctx_dict = {'activation_key': self.activation_key,
-                    'expiration_days': settings.ACCOUNT_ACTIVATION_DAYS,
-                    'site': site}
-        subject = render_to_string('registration/activation_email_subject.txt',
-                                   ctx_dict)
-        # Email subject *must not* contain newlines
-        subject = ''.join(subject.splitlines())
+        Return ``True`` if a user has ``username``, ignoring case.
         
-        message = render_to_string('registration/activation_email.txt',
-                                   ctx_dict)
+        """
+        return self.filter(username=username.lower()).exists()
+
+    def email_taken(self, email):
+        """
+        Return ``True`` if a user has the email address ``email``,
+        ignoring case.
         
-        self.user.email_user(subject, message, settings.DEFAULT_FROM_EMAIL)
+        """
+        return self.filter(email=email.strip().lower()).exists()
+
+    def sync_user(self, user):
+        """
+        Create or update the ``UserLookup`` of ``user``.
+        
+        """
+        username, email = user.username.lower(), user.email.strip().lower()
+        if not self.filter(user=user.pk).update(username=username, email=email):
+            self.create(user_id=user.pk, username=username, email=email)
+
+    def sync_users(self, users):
+        """
+        Create ``UserLookup``s, in bulk, for those of ``users`` which
+        don't have one yet, returning the number created.
+        
+        """
+        existing = set(self.filter(user__in=[user.pk for user in users]).values_list('user', flat=True))
+        missing = [self.model(user_id=user.pk, username=user.username.lower(), email=user.email.strip().lower())
+                   for user in users if user.pk not in existing]
+        _bulk_create(self.model, missing)
+        return len(missing)
+
+
+class UserLookup(models.Model):
+    """
+    The username and email address of a ``User``, lowercased, so that
+    checking whether a username or email address is already in use,
+    ignoring case, can use an ordinary index rather than scanning the
+    ``User`` table.
+
+    Kept up to date whenever a ``User`` is saved (and deleted along
+    with it) while either of the settings ``REGISTRATION_USER_LOOKUP``
+    or ``REGISTRATION_USER_LOOKUP_SYNC`` is ``True``; accounts created
+    before then can be added with the ``backfillregistrationlookup``
+    management command. The registration forms only use it when
+    ``REGISTRATION_USER_LOOKUP`` is ``True``.
+    
+    """
+    user = models.OneToOneField(User, verbose_name=_('user'))
+    username = models.CharField(_('username'), max_length=30, db_index=True)
+    email = models.CharField(_('e-mail address'), max_length=75, db_index=True)
+
+    objects = UserLookupManager()
+
+    class Meta:
+        verbose_name = _('user lookup')
+        verbose_name_plural = _('user lookups')
+
+    def __unicode__(self):
+        return self.username
+
+
+def user_lookup_synced():
+    """
+    Return ``True`` if ``UserLookup``s are to be kept up to date, i.e.
+    if either ``REGISTRATION_USER_LOOKUP`` or
+    ``REGISTRATION_USER_LOOKUP_SYNC`` is ``True``.
     
+    """
+    return getattr(settings, 'REGISTRATION_USER_LOOKUP', False) or \
+           getattr(settings, 'REGISTRATION_USER_LOOKUP_SYNC', False)
+
+
+def update_user_lookup(sender, instance, **kwargs):
+    """
+    Keep the ``UserLookup`` of a ``User`` up to date as it is saved,
+    if ``UserLookup``s are in use.
+    
+    """
+    if user_lookup_synced():
+        UserLookup.objects.sync_user(instance)
+
+post_save.connect(update_user_lookup, sender=User)
+
+
+def forget_activation_key(sender, instance, **kwargs):
+    """
+    Remove a saved ``RegistrationProfile``'s activation key from the
+    negative cache of bad keys, since it may have just been issued or
+    had its expiry extended.
+    
+    """
+    keycache.forget_keys([instance.activation_key])
+
+post_save.connect(forget_activation_key, sender=RegistrationProfile)
@@ -0,0 +1,188 @@
+"""
+Throttling of the registration and activation views, per client IP
+address and per subnet, so that floods of requests from bots are
+turned away before they cause any form validation, password hashing
+or database queries.
+
+Enabled by the setting ``REGISTRATION_RATE_LIMIT``. Each client may
+make ``REGISTRATION_RATE_LIMIT_IP`` requests, and each subnet (a /24
+for IPv4, a /64 for IPv6) ``REGISTRATION_RATE_LIMIT_SUBNET`` requests,
+per period; both settings are ``(requests, seconds)`` tuples. Limits
+apply to each view separately.
+
+Counts are kept in Django's cache -- the cache named by
+``REGISTRATION_RATE_LIMIT_CACHE``, or the default one -- so every
+process serving the site must share a cache (e.g., memcached) for the
+limits to be enforced across them. They are kept with atomic
+increments, in fixed windows of one period; the count of the previous
+window, weighted by how much of it still overlaps the last period, is
+added to the current one. Like a token bucket of ``requests`` tokens
+refilled over ``seconds``, this allows short bursts but holds the
+sustained rate to the limit, without the read-modify-write a true
+token bucket would need.
+
+"""
+
+import json
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache import get_cache
+from django.http import HttpResponse
+
+
+class HttpResponseTooManyRequests(HttpResponse):
+    status_code = 429
+
+
+def unmap(ip):
+    """
+    Return the IPv4 address an IPv4-mapped IPv6 address
+    (``::ffff:a.b.c.d``, as reported by dual-stack servers) stands
+    for, or ``ip`` itself if it is not one.
+
+    """
+    if ip.lower().startswith('::ffff:') and '.' in ip:
+        return ip[len('::ffff:'):]
+    return ip
+
+
+def subnet(ip):
+    """
+    Return the subnet of the IP address ``ip``: its /24 for IPv4, or
+    its /64 for IPv6. IPv4-mapped IPv6 addresses count as IPv4.
+
+    """
+    ip = unmap(ip)
+    if ':' not in ip:
+        return '%s.0/24' % '.'.join(ip.split('.')[:3])
+    head, separator, tail = ip.partition('::')
+    groups = head and head.split(':') or []
+    if separator:
+        tail = tail and tail.split(':') or []
+        groups = groups + ['0'] * (8 - len(groups) - len(tail)) + tail
+    return '%s::/64' % ':'.join([group.lower() or '0' for group in groups[:4]])
+
+
+def get_rate_cache():
+    """
+    Return the cache which holds the counts.
+
+    """
+    name = getattr(settings, 'REGISTRATION_RATE_LIMIT_CACHE', None)
+    if name is None:
+        return cache
+    return get_cache(name)
+
+
+class RateLimit(object):
+    """
+    A limit of ``requests`` per ``period`` seconds for each key.
+
+    """
+    def __init__(self, requests, period):
+        self.requests = requests
+        self.period = period
+
+    def keys(self, key, now):
+        window = int(now // self.period)
+        return ('registration.ratelimit.%s.%d' % (key, window),
+                'registration.ratelimit.%s.%d' % (key, window - 1))
+
+    def incr(self, rate_cache, key):
+        """
+        Count a request in the window ``key``, returning the count.
+
+        """
+        # Keep each window's count for two periods, while it still
+        # counts towards the next window.
+        if rate_cache.add(key, 1, self.period * 2):
+            return 1
+        try:
+            return rate_cache.incr(key)
+        except ValueError:
+            # The count expired since add() found it.
+            rate_cache.set(key, 1, self.period * 2)
+            return 1
+
+    def estimate(self, now, count, previous):
+        """
+        Estimate the number of requests in the last ``period``
+        seconds, given the counts of the current and previous
+        windows.
+
+        """
+        overlap = 1 - (now % self.period) / float(self.period)
+        return count + (previous or 0) * overlap
+
+    def retry_after(self, now):
+        return int(math.ceil(self.period - now % self.period))
+
+
+def get_limits():
+    """
+    Return the configured limits, as a list of ``(name, RateLimit)``
+    pairs.
+
+    """
+    limits = []
+    for name, setting, default in (('ip', 'REGISTRATION_RATE_LIMIT_IP', (20, 60)),
+                                   ('subnet', 'REGISTRATION_RATE_LIMIT_SUBNET', (200, 60))):
+        value = getattr(settings, setting, default)
+        if value:
+            limits.append((name, RateLimit(*value)))
+    return limits
+
+
+def check(ip, scope, now=None):
+    """
+    Count a request from ``ip`` to the view ``scope`` against each
+    limit, returning ``None`` if it is within all of them, or else the
+    number of seconds after which the client may try again.
+
+    """
+    if now is None:
+        now = time.time()
+    ip = unmap(ip)
+    rate_cache = get_rate_cache()
+    keys = {'ip': '%s.ip.%s' % (scope, ip), 'subnet': '%s.subnet.%s' % (scope, subnet(ip))}
+    limits = [(limit,) + limit.keys(keys[name], now) for name, limit in get_limits()]
+    counts = [limit.incr(rate_cache, current) for limit, current, previous in limits]
+    previous = rate_cache.get_many([previous for limit, current, previous in limits])
+    retry_after = None
+    for (limit, current, previous_key), count in zip(limits, counts):
+        if limit.estimate(now, count, previous.get(previous_key)) > limit.requests:
+            retry_after = max(retry_after or 0, limit.retry_after(now))
+    return retry_after
+
+
+def throttle(request, scope):
+    """
+    Return a 429 response if ``REGISTRATION_RATE_LIMIT`` is ``True``
+    and ``request`` exceeds a limit for the view ``scope``, or
+    ``None`` if it may go ahead.
+
+    The response is JSON if the request accepts JSON, in the format of
+    the ``register`` view's JSON responses, and plain text otherwise;
+    either way it carries a ``Retry-After`` header.
+
+    """
+    if not getattr(settings, 'REGISTRATION_RATE_LIMIT', False):
+        return None
+    ip = request.META.get('REMOTE_ADDR')
+    if not ip:
+        return None
+    retry_after = check(ip, scope)
+    if retry_after is None:
+        return None
+    accept = request.META.get('HTTP_ACCEPT')
+    if accept and 'application/json' in accept:
+        response = HttpResponseTooManyRequests(json.dumps({'success': False,
+                                                           'errors': [u'Too many requests.']}),
+                                               mimetype='application/json')
+    else:
+        response = HttpResponseTooManyRequests(u'Too many requests.', mimetype='text/plain')
+    response['Retry-After'] = str(retry_after)
+    return response
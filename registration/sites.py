@@ -0,0 +1,51 @@
+"""
+Resolution of the current site, for use wherever django-registration
+needs one (e.g., to build the links in activation emails).
+
+The ``Site`` is looked up once per process and then cached; the cache
+is cleared whenever a ``Site`` is saved or deleted in this process.
+Other processes keep their cached ``Site`` until they restart or call
+``clear_site_cache()``.
+
+"""
+
+from django.conf import settings
+from django.contrib.sites.models import RequestSite
+from django.contrib.sites.models import Site
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
+
+
+_site_cache = {}
+
+
+def get_current_site(request=None):
+    """
+    Return the current site.
+
+    If ``django.contrib.sites`` is installed, this is the ``Site``
+    whose id is ``SITE_ID``, fetched from the database only the first
+    time it is needed. Otherwise, it is a ``RequestSite`` built from
+    ``request``, or ``None`` if no request is given.
+
+    """
+    if Site._meta.installed:
+        try:
+            return _site_cache[settings.SITE_ID]
+        except KeyError:
+            site = _site_cache[settings.SITE_ID] = Site.objects.get(pk=settings.SITE_ID)
+            return site
+    if request is None:
+        return None
+    return RequestSite(request)
+
+
+def clear_site_cache(**kwargs):
+    """
+    Discard the ``Site`` cached by ``get_current_site()``.
+
+    """
+    _site_cache.clear()
+
+post_save.connect(clear_site_cache, sender=Site)
+post_delete.connect(clear_site_cache, sender=Site)
@@ -3,8 +3,14 @@ from django.test import TestCase
 import registration
 
 from registration.tests.backends import *
+from registration.tests.bloom import *
+from registration.tests.domains import *
 from registration.tests.forms import *
+from registration.tests.keycache import *
+from registration.tests.mail import *
 from registration.tests.models import *
+from registration.tests.ratelimit import *
+from registration.tests.sites import *
 from registration.tests.views import *
 from registration.tests.auth_views import *
 
@@ -1,23 +1,39 @@
 import datetime
+import json
+import socket
 
 from django.conf import settings
+from django.conf.urls.defaults import patterns
 from django.contrib import admin
+from django.contrib.auth import BACKEND_SESSION_KEY
+from django.contrib.auth import SESSION_KEY
 from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_in
+from django.contrib.messages.storage import default_storage
 from django.contrib.sessions.middleware import SessionMiddleware
 from django.contrib.sites.models import Site
 from django.core import mail
 from django.core.exceptions import ImproperlyConfigured
 from django.core.handlers.wsgi import WSGIRequest
+from django.core.mail.backends import locmem
+from django.core.urlresolvers import get_resolver
 from django.test import Client
 from django.test import TestCase
+from django.test.client import RequestFactory
+from django.utils.http import int_to_base36
 
 from registration import forms
 from registration import signals
+from registration import admin as registration_admin
 from registration.admin import RegistrationAdmin
+from registration import mail as registration_mail
 from registration.backends import get_backend
+from registration.backends import load_backends
 from registration.backends.default import DefaultBackend
+from registration.backends.signed import SignedBackend
 from registration.backends.simple import SimpleBackend
 from registration.models import RegistrationProfile
+from registration.views import register_batch
 
 
 class _MockRequestClient(Client):
@@ -54,10 +70,12 @@ class _MockRequestClient(Client):
         environ.update(request)
         request = WSGIRequest(environ)
 
-        # We have to manually add a session since we'll be bypassing
-        # the middleware chain.
+        # We have to manually add a session (and message storage, for
+        # admin actions) since we'll be bypassing the middleware
+        # chain.
         session_middleware = SessionMiddleware()
         session_middleware.process_request(request)
+        request._messages = default_storage(request)
         return request
 
 
@@ -104,6 +122,47 @@ class BackendRetrievalTests(TestCase):
         self.assertRaises(ImproperlyConfigured, get_backend,
                           'registration.backends.default.NonexistentBackend')
 
+    def test_backend_cached(self):
+        """
+        Test that ``get_backend()`` returns the same instance for
+        repeated calls with the same path.
+        
+        """
+        self.failUnless(get_backend('registration.backends.default.DefaultBackend') is
+                        get_backend('registration.backends.default.DefaultBackend'))
+        self.failIf(get_backend('registration.backends.default.DefaultBackend') is
+                    get_backend('registration.backends.simple.SimpleBackend'))
+
+    def test_load_backends(self):
+        """
+        Test that ``load_backends()`` finds the backends named in a
+        URLconf, including its includes, and fails on a bad path.
+        
+        """
+        backends = load_backends(get_resolver(None).url_patterns)
+        self.assertEqual(backends, [get_backend('registration.backends.default.DefaultBackend')])
+
+        bad_patterns = patterns('',
+                                (r'^register/$', 'registration.views.register',
+                                 {'backend': 'registration.backends.default.NonexistentBackend'}))
+        self.assertRaises(ImproperlyConfigured, load_backends, bad_patterns)
+
+    def test_backend_warm_up(self):
+        """
+        Test that warming up the default backend loads its activation
+        email and registration form templates, and compiles its form
+        class.
+        
+        """
+        registration_mail.clear_template_cache()
+        forms._compiled_forms.clear()
+        load_backends(get_resolver(None).url_patterns, warm_up=True)
+        self.assertEqual(sorted([name for name, language in registration_mail._template_cache]),
+                         ['registration/activation_email.txt',
+                          'registration/activation_email_subject.txt',
+                          'registration/registration_form.html'])
+        self.failUnless(forms.RegistrationForm in forms._compiled_forms)
+
 
 class DefaultRegistrationBackendTests(TestCase):
     """
@@ -162,6 +221,67 @@ class DefaultRegistrationBackendTests(TestCase):
         self.assertEqual(RegistrationProfile.objects.count(), 1)
         self.assertEqual(len(mail.outbox), 1)
 
+    def test_registration_batch(self):
+        """
+        Test that ``register_batch()`` creates several inactive
+        accounts, with profiles, sends their activation emails and a
+        ``user_registered`` signal for each, and reports usernames
+        which are already taken.
+
+        """
+        def receiver(sender, **kwargs):
+            received.append(kwargs['user'].username)
+
+        received = []
+        signals.user_registered.connect(receiver, sender=self.backend.__class__)
+        try:
+            results = self.backend.register_batch(_mock_request(),
+                                                  [{'username': 'bob', 'email': 'bob@example.com',
+                                                    'password1': 'secret'},
+                                                   {'username': 'bob', 'email': 'bob2@example.com',
+                                                    'password1': 'secret'},
+                                                   {'username': 'carol', 'email': 'carol@example.com',
+                                                    'password1': 'secret'}])
+        finally:
+            signals.user_registered.disconnect(receiver, sender=self.backend.__class__)
+
+        self.assertEqual([user and user.username for user, error in results], ['bob', None, 'carol'])
+        self.assertEqual(results[1][1], u"A user with that username already exists.")
+        self.failIf(User.objects.get(username='carol').is_active)
+        self.assertEqual(RegistrationProfile.objects.count(), 2)
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(received, ['bob', 'carol'])
+
+    def test_registration_batch_email_failure(self):
+        """
+        Test that ``register_batch()`` reports an activation email
+        which can't be sent in that account's result, and still sends
+        the others.
+
+        """
+        class FailingEmailBackend(locmem.EmailBackend):
+            def send_messages(self, messages):
+                if messages[0].to == ['bob@example.com']:
+                    raise socket.error("Connection refused")
+                return super(FailingEmailBackend, self).send_messages(messages)
+
+        old_get_connection = registration_mail.get_connection
+        registration_mail.get_connection = FailingEmailBackend
+        try:
+            results = self.backend.register_batch(_mock_request(),
+                                                  [{'username': 'bob', 'email': 'bob@example.com',
+                                                    'password1': 'secret'},
+                                                   {'username': 'carol', 'email': 'carol@example.com',
+                                                    'password1': 'secret'}])
+        finally:
+            registration_mail.get_connection = old_get_connection
+
+        self.assertEqual([user.username for user, error in results], ['bob', 'carol'])
+        self.assertEqual([error for user, error in results],
+                         [u"The activation email could not be sent.", None])
+        self.assertEqual(RegistrationProfile.objects.count(), 2)
+        self.assertEqual([message.to for message in mail.outbox], [['carol@example.com']])
+
     def test_registration_no_sites(self):
         """
         Test that registration still functions properly when
@@ -224,6 +344,8 @@ class DefaultRegistrationBackendTests(TestCase):
 
         expired_user.date_joined = expired_user.date_joined - datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS)
         expired_user.save()
+        RegistrationProfile.objects.filter(user=expired_user).update(expires_at=expired_user.date_joined +
+                                                                         datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS))
         expired_profile = RegistrationProfile.objects.get(user=expired_user)
         self.failIf(self.backend.activate(_mock_request(),
                                           expired_profile.activation_key))
@@ -327,6 +449,8 @@ class DefaultRegistrationBackendTests(TestCase):
                                          password1='secret')
         new_user.date_joined -= datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS + 1)
         new_user.save()
+        RegistrationProfile.objects.filter(user=new_user).update(expires_at=new_user.date_joined +
+                                                                     datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS))
         profile = RegistrationProfile.objects.get(user=new_user)
         self.backend.activate(_mock_request(), profile.activation_key)
 
@@ -355,7 +479,8 @@ class DefaultRegistrationBackendTests(TestCase):
 
     def test_activation_action(self):
         """
-        Test manual activation of users view admin action.
+        Test manual activation of users via the admin action, which
+        sends the ``user_activated`` signal.
         
         """
         admin_class = RegistrationAdmin(RegistrationProfile, admin.site)
@@ -365,9 +490,269 @@ class DefaultRegistrationBackendTests(TestCase):
                                       email='alice@example.com',
                                       password1='swordfish')
 
+        received = []
+        def receiver(sender, **kwargs):
+            received.append(kwargs['user'].username)
+        signals.user_activated.connect(receiver, sender=self.backend.__class__)
+
         admin_class.activate_users(_mock_request(),
                                    RegistrationProfile.objects.all())
         self.failUnless(User.objects.get(username='alice').is_active)
+        self.assertEqual(received, ['alice'])
+
+    def test_bulk_activation(self):
+        """
+        Test bulk activation: only pending accounts are activated, and
+        the ``user_activated`` signal is sent once for each.
+        
+        """
+        received = []
+        def receiver(sender, **kwargs):
+            received.append(kwargs['user'].username)
+        signals.user_activated.connect(receiver, sender=self.backend.__class__)
+
+        for username in ('alice', 'bob', 'carol', 'dave'):
+            self.backend.register(_mock_request(),
+                                  username=username,
+                                  email='%s@example.com' % username,
+                                  password1='secret')
+        carol = RegistrationProfile.objects.get(user__username='carol')
+        RegistrationProfile.objects.activate_user(carol.activation_key)
+        RegistrationProfile.objects.filter(user__username='dave').update(expires_at=datetime.datetime.now())
+
+        activated = self.backend.activate_users(_mock_request(),
+                                                RegistrationProfile.objects.all())
+        self.assertEqual(sorted([user.username for user in activated]), ['alice', 'bob'])
+        self.assertEqual(sorted(received), ['alice', 'bob'])
+        self.assertEqual(sorted(User.objects.filter(is_active=True).values_list('username', flat=True)),
+                         [u'alice', u'bob', u'carol'])
+        self.assertEqual(RegistrationProfile.objects.filter(activation_key=RegistrationProfile.ACTIVATED).count(), 3)
+
+        self.assertEqual(self.backend.activate_users(_mock_request(),
+                                                     RegistrationProfile.objects.all()), [])
+        self.assertEqual(len(received), 2)
+
+    def test_admin_changelist_queryset(self):
+        """
+        Test that the admin computes whether each activation key has
+        expired in the changelist query, in agreement with
+        ``RegistrationProfile.activation_key_expired()``.
+        
+        """
+        admin_class = RegistrationAdmin(RegistrationProfile, admin.site)
+        for username in ('alice', 'bob', 'carol'):
+            self.backend.register(_mock_request(),
+                                  username=username,
+                                  email='%s@example.com' % username,
+                                  password1='secret')
+        RegistrationProfile.objects.activate_user(RegistrationProfile.objects.get(user__username='bob').activation_key)
+        RegistrationProfile.objects.filter(user__username='carol').update(expires_at=datetime.datetime.now())
+
+        profiles = admin_class.queryset(_mock_request()).select_related('user')
+        expired = dict([(profile.user.username, admin_class.activation_key_expired(profile))
+                        for profile in profiles])
+        self.assertEqual(expired, {'alice': False, 'bob': True, 'carol': True})
+        for profile in profiles:
+            self.assertEqual(admin_class.activation_key_expired(profile), profile.activation_key_expired())
+
+    def test_admin_status_filter(self):
+        """
+        Test the admin's pending/expired/activated list filter.
+        
+        """
+        if registration_admin.SimpleListFilter is None:
+            return
+        admin_class = RegistrationAdmin(RegistrationProfile, admin.site)
+        for username in ('alice', 'bob', 'carol'):
+            self.backend.register(_mock_request(),
+                                  username=username,
+                                  email='%s@example.com' % username,
+                                  password1='secret')
+        RegistrationProfile.objects.activate_user(RegistrationProfile.objects.get(user__username='bob').activation_key)
+        RegistrationProfile.objects.filter(user__username='carol').update(expires_at=datetime.datetime.now())
+
+        request = _mock_request()
+        for status, username in (('pending', 'alice'), ('activated', 'bob'), ('expired', 'carol')):
+            status_filter = registration_admin.ActivationStatusFilter(request, {'status': status},
+                                                                      RegistrationProfile, admin_class)
+            profiles = status_filter.queryset(request, admin_class.queryset(request))
+            self.assertEqual([profile.user.username for profile in profiles], [username])
+
+    def test_admin_estimated_count_paginator(self):
+        """
+        Test that the estimated-count paginator is used when
+        ``REGISTRATION_ADMIN_ESTIMATED_COUNT`` is set, and falls back
+        to an exact count where no estimate is available.
+        
+        """
+        admin_class = RegistrationAdmin(RegistrationProfile, admin.site)
+        self.backend.register(_mock_request(),
+                              username='alice',
+                              email='alice@example.com',
+                              password1='secret')
+        queryset = RegistrationProfile.objects.all()
+
+        old_estimated_count = getattr(settings, 'REGISTRATION_ADMIN_ESTIMATED_COUNT', False)
+        settings.REGISTRATION_ADMIN_ESTIMATED_COUNT = True
+        try:
+            paginator = admin_class.get_paginator(_mock_request(), queryset, 100)
+        finally:
+            settings.REGISTRATION_ADMIN_ESTIMATED_COUNT = old_estimated_count
+        self.failUnless(isinstance(paginator, registration_admin.EstimatedCountPaginator))
+        self.assertEqual(paginator.count, 1)
+
+        paginator = admin_class.get_paginator(_mock_request(), queryset, 100)
+        self.failIf(isinstance(paginator, registration_admin.EstimatedCountPaginator))
+
+
+class SignedRegistrationBackendTests(TestCase):
+    """
+    Test the signed-key registration backend, which needs no
+    ``RegistrationProfile``.
+
+    """
+    backend = SignedBackend()
+
+    def setUp(self):
+        self.old_activation = getattr(settings, 'ACCOUNT_ACTIVATION_DAYS', None)
+        if self.old_activation is None:
+            settings.ACCOUNT_ACTIVATION_DAYS = 7
+
+    def tearDown(self):
+        if self.old_activation is None:
+            settings.ACCOUNT_ACTIVATION_DAYS = self.old_activation
+
+    def test_registration(self):
+        """
+        Test the registration process: registration creates a new
+        inactive account, but no profile, and sends an activation
+        email.
+
+        """
+        new_user = self.backend.register(_mock_request(),
+                                         username='bob',
+                                         email='bob@example.com',
+                                         password1='secret')
+
+        self.assertEqual(new_user.username, 'bob')
+        self.failUnless(new_user.check_password('secret'))
+        self.assertEqual(new_user.email, 'bob@example.com')
+        self.failIf(new_user.is_active)
+
+        self.assertEqual(RegistrationProfile.objects.count(), 0)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_valid_activation(self):
+        """
+        Test the activation process: a key issued to an account
+        activates it exactly once, with a signature check and a single
+        ``UPDATE``, and sends the ``user_activated`` signal.
+
+        """
+        received_signals = []
+        receiver = lambda sender, **kwargs: received_signals.append(kwargs.get('signal'))
+        signals.user_activated.connect(receiver, sender=self.backend.__class__)
+
+        new_user = self.backend.register(_mock_request(),
+                                         username='alice',
+                                         email='alice@example.com',
+                                         password1='swordfish')
+        key = self.backend.make_activation_key(new_user)
+
+        # One query to look the account up, and one to activate it.
+        results = []
+        self.assertNumQueries(2, lambda: results.append(self.backend.activate(_mock_request(), key)))
+        activated = results[0]
+        self.assertEqual(activated.pk, new_user.pk)
+        self.failUnless(activated.is_active)
+        self.failUnless(User.objects.get(pk=new_user.pk).is_active)
+        self.assertEqual(activated.last_login, User.objects.get(pk=new_user.pk).last_login)
+        self.assertEqual(received_signals, [signals.user_activated])
+
+        self.failIf(self.backend.activate(_mock_request(), key))
+        self.assertEqual(len(received_signals), 1)
+
+    def test_invalid_activation(self):
+        """
+        Test the activation process: malformed, tampered-with and
+        expired keys do not activate the account.
+
+        """
+        new_user = self.backend.register(_mock_request(),
+                                         username='bob',
+                                         email='bob@example.com',
+                                         password1='secret')
+        key = self.backend.make_activation_key(new_user)
+        user_b36, expires_b36, signature = key.split('-')
+
+        other_user = User.objects.create_user('carol', 'carol@example.com', 'secret')
+        other_user.is_active = False
+        other_user.save()
+        for invalid_key in ('foo', 'a-b-c-d', key[:-1] + 'x',
+                            '-'.join([int_to_base36(other_user.pk), expires_b36, signature])):
+            self.failIf(self.backend.activate(_mock_request(), invalid_key))
+        self.failIf(User.objects.filter(is_active=True).count())
+
+        new_user.date_joined -= datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS)
+        new_user.save()
+        self.failIf(self.backend.activate(_mock_request(),
+                                          self.backend.make_activation_key(new_user)))
+        self.failIf(User.objects.get(pk=new_user.pk).is_active)
+
+    def test_deactivated_activation(self):
+        """
+        Test that an account which is activated and then deactivated
+        can't be reactivated with its old key.
+
+        """
+        new_user = self.backend.register(_mock_request(),
+                                         username='bob',
+                                         email='bob@example.com',
+                                         password1='secret')
+        key = self.backend.make_activation_key(new_user)
+        self.failUnless(self.backend.activate(_mock_request(), key))
+
+        deactivated = User.objects.get(pk=new_user.pk)
+        deactivated.is_active = False
+        deactivated.save()
+
+        self.failIf(self.backend.activate(_mock_request(), key))
+        self.failIf(User.objects.get(pk=new_user.pk).is_active)
+
+    def test_post_activation_redirect(self):
+        """
+        Test that the default post-activation redirect is the named
+        pattern ``registration_activation_complete``.
+
+        """
+        self.assertEqual(self.backend.post_activation_redirect(_mock_request(), User()),
+                         ('registration_activation_complete', (), {}))
+
+    def test_registration_batch(self):
+        """
+        Test that batch registration, which would need profiles, is
+        refused by the ``register_batch`` view before any validation.
+
+        """
+        self.failUnless(self.backend.register_batch is None)
+        request = RequestFactory().post('/register/batch/',
+                                        json.dumps([{'username': 'bob', 'email': 'bob@example.com',
+                                                     'password1': 'secret', 'password2': 'secret'}]),
+                                        content_type='application/json')
+        request.user = User.objects.create_superuser('partner', 'partner@example.com', 'secret')
+        backend = get_backend('registration.backends.signed.SignedBackend')
+        def get_form_class(request):
+            raise AssertionError("The batch should not be validated.")
+        backend.get_form_class = get_form_class
+        try:
+            response = register_batch(request, 'registration.backends.signed.SignedBackend')
+        finally:
+            del backend.get_form_class
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(json.loads(response.content),
+                         {'success': False,
+                          'errors': [u'This backend does not support batch registration.']})
+        self.assertEqual(User.objects.count(), 1)
 
 
 class SimpleRegistrationBackendTests(TestCase):
@@ -399,6 +784,40 @@ class SimpleRegistrationBackendTests(TestCase):
         # New user must not be active.
         self.failUnless(new_user.is_active)
 
+    def test_registration_login(self):
+        """
+        Test that registration logs the new user in without checking
+        the password again, and sends the ``user_logged_in`` signal.
+
+        """
+        received = []
+        def receiver(sender, **kwargs):
+            received.append(kwargs['user'])
+        user_logged_in.connect(receiver)
+
+        checked = []
+        old_check_password = User.check_password
+        def check_password(user, raw_password):
+            checked.append(raw_password)
+            return old_check_password(user, raw_password)
+        User.check_password = check_password
+
+        request = _mock_request()
+        try:
+            new_user = self.backend.register(request,
+                                             username='bob',
+                                             email='bob@example.com',
+                                             password1='secret')
+        finally:
+            User.check_password = old_check_password
+            user_logged_in.disconnect(receiver)
+
+        self.assertEqual(checked, [])
+        self.assertEqual(received, [new_user])
+        self.assertEqual(request.session[SESSION_KEY], new_user.pk)
+        self.assertEqual(request.session[BACKEND_SESSION_KEY],
+                         'django.contrib.auth.backends.ModelBackend')
+
     def test_allow(self):
         """
         Test that the setting ``REGISTRATION_OPEN`` appropriately
@@ -0,0 +1,134 @@
+import os
+import tempfile
+import threading
+import time
+from StringIO import StringIO
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core import management
+from django.test import TestCase
+
+from registration import bloom
+from registration import forms
+
+
+class BloomFilterTests(TestCase):
+    """
+    Test the Bloom filter used to skip availability queries.
+
+    """
+    def setUp(self):
+        self.old_bloom_filter = getattr(settings, 'REGISTRATION_BLOOM_FILTER', False)
+        settings.REGISTRATION_BLOOM_FILTER = True
+        bloom.clear_user_filter()
+
+    def tearDown(self):
+        settings.REGISTRATION_BLOOM_FILTER = self.old_bloom_filter
+        bloom.clear_user_filter()
+
+    def test_bloom_filter(self):
+        """
+        Keys added to a ``BloomFilter`` are always found, and absent
+        keys are found at roughly the configured error rate.
+
+        """
+        bloom_filter = bloom.BloomFilter(1000, error_rate=0.01)
+        keys = [u'user%d' % i for i in range(1000)]
+        for key in keys:
+            bloom_filter.add(key)
+        for key in keys:
+            self.failUnless(key in bloom_filter)
+        false_positives = len([i for i in range(10000) if u'other%d' % i in bloom_filter])
+        self.failUnless(false_positives < 300)
+
+    def test_availability_precheck(self):
+        """
+        With ``REGISTRATION_BLOOM_FILTER`` set, a hinted prefetch
+        answers usernames and email addresses the filter doesn't hold
+        without a query, and users saved later are added to the
+        filter; unhinted checks always query the database.
+
+        """
+        User.objects.create_user('alice', 'alice@example.com', 'secret')
+        user_filter = bloom.load_user_filter()
+
+        try:
+            self.assertNumQueries(0, forms.prefetch_taken, usernames=['bob'],
+                                  emails=['bob@example.com'], hint=True)
+            self.failIf(forms.username_taken('bob'))
+            self.failIf(forms.email_taken('bob@example.com'))
+
+            self.assertNumQueries(1, forms.prefetch_taken, usernames=['Alice'],
+                                  emails=['ALICE@example.com'], hint=True)
+            self.failUnless(forms.username_taken('Alice'))
+            self.failUnless(forms.email_taken('ALICE@example.com'))
+        finally:
+            forms.clear_prefetched_taken()
+
+        # A rename the filter never saw, as if made by another
+        # process, is still found by the unhinted checks.
+        User.objects.filter(username='alice').update(username='carol')
+        self.failIf(user_filter.might_have_username('carol'))
+        self.failUnless(forms.username_taken('Carol'))
+        try:
+            forms.prefetch_taken(usernames=['carol'])
+            self.failUnless(forms.username_taken('carol'))
+        finally:
+            forms.clear_prefetched_taken()
+
+        User.objects.create_user('bob', 'bob@example.com', 'secret')
+        self.failUnless(user_filter.might_have_username('bob'))
+        self.assertEqual(user_filter.stats()['skipped'], 3)
+
+    def test_background_build(self):
+        """
+        ``get_user_filter()`` builds the filter in a background
+        thread, returning ``None`` until it is ready.
+
+        """
+        started, release = threading.Event(), threading.Event()
+        built = bloom.UserFilter(10)
+        def build_user_filter():
+            started.set()
+            release.wait(5)
+            return built
+        old_build_user_filter = bloom.build_user_filter
+        bloom.build_user_filter = build_user_filter
+        try:
+            self.failUnless(bloom.get_user_filter() is None)
+            started.wait(5)
+            self.failUnless(bloom.get_user_filter() is None)
+            release.set()
+            for i in range(500):
+                if not bloom._building:
+                    break
+                time.sleep(0.01)
+            self.failUnless(bloom.get_user_filter() is built)
+        finally:
+            release.set()
+            bloom.build_user_filter = old_build_user_filter
+
+    def test_snapshot(self):
+        """
+        The ``buildregistrationbloom`` management command writes a
+        snapshot which is loaded and brought up to date when the
+        filter is built.
+
+        """
+        User.objects.create_user('alice', 'alice@example.com', 'secret')
+        fd, path = tempfile.mkstemp()
+        os.close(fd)
+        old_snapshot = getattr(settings, 'REGISTRATION_BLOOM_SNAPSHOT', None)
+        try:
+            management.call_command('buildregistrationbloom', path, stdout=StringIO())
+            User.objects.create_user('bob', 'bob@example.com', 'secret')
+
+            settings.REGISTRATION_BLOOM_SNAPSHOT = path
+            user_filter = bloom.load_user_filter()
+            self.failUnless(user_filter.might_have_username('alice'))
+            self.failUnless(user_filter.might_have_username('bob'))
+            self.assertEqual(user_filter.last_pk, User.objects.get(username='bob').pk)
+        finally:
+            settings.REGISTRATION_BLOOM_SNAPSHOT = old_snapshot
+            os.remove(path)
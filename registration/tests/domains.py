@@ -0,0 +1,84 @@
+import os
+import shutil
+import tempfile
+import time
+from StringIO import StringIO
+
+from django.conf import settings
+from django.core import management
+from django.test import TestCase
+
+from registration import domains
+from registration import forms
+
+
+class DomainBlocklistTests(TestCase):
+    """
+    Test matching email domains against a blocklist file.
+
+    """
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.source = os.path.join(self.tmpdir, 'domains.txt')
+        self.path = os.path.join(self.tmpdir, 'blocklist')
+        self.write_source(['# Disposable domains', '', 'Mailinator.com',
+                           '*.guerrillamail.com', 'spam.example.org'])
+        management.call_command('builddomainblocklist', self.source, self.path,
+                                stdout=StringIO())
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write_source(self, lines):
+        f = open(self.source, 'w')
+        f.write('\n'.join(lines) + '\n')
+        f.close()
+
+    def test_matches(self):
+        """
+        Listed domains and their subdomains match, ignoring case;
+        other domains, including parents of listed domains, don't.
+
+        """
+        blocklist = domains.DomainBlocklist(self.path)
+        for domain in ('mailinator.com', 'MAILINATOR.COM', 'a.b.mailinator.com',
+                       'guerrillamail.com', 'spam.example.org'):
+            self.failUnless(blocklist.matches(domain), domain)
+        for domain in ('example.com', 'example.org', 'notmailinator.com', 'com'):
+            self.failIf(blocklist.matches(domain), domain)
+
+    def test_reload(self):
+        """
+        A blocklist picks up a replaced file.
+
+        """
+        blocklist = domains.DomainBlocklist(self.path)
+        self.failIf(blocklist.matches('example.net'))
+
+        self.write_source(['example.net'])
+        management.call_command('builddomainblocklist', self.source, self.path,
+                                stdout=StringIO())
+        blocklist._checked_at = time.time() - blocklist.check_interval
+        self.failUnless(blocklist.matches('example.net'))
+        self.failIf(blocklist.matches('mailinator.com'))
+
+    def test_form(self):
+        """
+        ``RegistrationFormNoFreeEmail`` rejects domains in the
+        blocklist named by ``REGISTRATION_DOMAIN_BLOCKLIST``, and
+        subdomains of its ``bad_domains``.
+
+        """
+        old_blocklist = getattr(settings, 'REGISTRATION_DOMAIN_BLOCKLIST', None)
+        settings.REGISTRATION_DOMAIN_BLOCKLIST = self.path
+        try:
+            for email, valid in (('foo@x.mailinator.com', False),
+                                 ('foo@mail.Yahoo.com', False),
+                                 ('foo@example.com', True)):
+                form = forms.RegistrationFormNoFreeEmail(data={'username': 'foo',
+                                                               'email': email,
+                                                               'password1': 'foo',
+                                                               'password2': 'foo'})
+                self.assertEqual(form.is_valid(), valid)
+        finally:
+            settings.REGISTRATION_DOMAIN_BLOCKLIST = old_blocklist
@@ -1,7 +1,10 @@
+from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
 from django.test import TestCase
 
 from registration import forms
+from registration.models import UserLookup
 
 
 class RegistrationFormTests(TestCase):
@@ -117,3 +120,92 @@ class RegistrationFormTests(TestCase):
         base_data['email'] = 'foo@example.com'
         form = forms.RegistrationFormNoFreeEmail(data=base_data)
         self.failUnless(form.is_valid())
+
+    def test_user_lookup(self):
+        """
+        Test that, with ``REGISTRATION_USER_LOOKUP`` set, the forms'
+        case-insensitive availability checks use ``UserLookup``,
+        which is kept up to date as users are saved and deleted, but
+        only while the setting is in effect.
+
+        """
+        old_user_lookup = getattr(settings, 'REGISTRATION_USER_LOOKUP', False)
+        settings.REGISTRATION_USER_LOOKUP = True
+        try:
+            alice = User.objects.create_user('Alice', 'Alice@Example.com', 'secret')
+            form = forms.RegistrationFormUniqueEmail(data={'username': 'ALICE',
+                                                           'email': 'alice@example.COM',
+                                                           'password1': 'foo',
+                                                           'password2': 'foo'})
+            self.failIf(form.is_valid())
+            self.assertEqual(sorted(form.errors.keys()), ['email', 'username'])
+
+            alice.username = 'carol'
+            alice.save()
+            self.failIf(forms.username_taken('alice'))
+            self.failUnless(forms.username_taken('Carol'))
+
+            alice.delete()
+            self.failIf(forms.email_taken('alice@example.com'))
+            self.assertEqual(UserLookup.objects.count(), 0)
+        finally:
+            settings.REGISTRATION_USER_LOOKUP = old_user_lookup
+
+        # Without the setting, saving a user leaves the table alone.
+        User.objects.create_user('bob', 'bob@example.com', 'secret')
+        self.assertEqual(UserLookup.objects.count(), 0)
+
+    def test_compiled_form(self):
+        """
+        Test that a compiled form reports the same cleaned data and
+        errors as the form itself, that its ``clean()`` methods see
+        the form's usual state, and that forms overriding
+        ``__init__()`` or the validation methods aren't compiled.
+
+        """
+        User.objects.create_user('alice', 'alice@example.com', 'secret')
+
+        data_dicts = [{},
+                      {'username': 'foo/bar', 'email': 'foo@example.com',
+                       'password1': 'foo', 'password2': 'foo'},
+                      {'username': 'alice', 'email': 'alice@example.com',
+                       'password1': 'foo', 'password2': 'bar'},
+                      {'username': 'foo', 'email': 'foo@example.com',
+                       'password1': 'foo', 'password2': 'foo'},
+                      {'username': 'foo', 'email': 'foo@example.com',
+                       'password1': 'foo', 'password2': 'foo', 'tos': 'on'}]
+
+        for form_class in (forms.RegistrationForm,
+                           forms.RegistrationFormTermsOfService,
+                           forms.RegistrationFormUniqueEmail):
+            compiled = forms.compile_form(form_class)
+            self.failUnless(forms.compile_form(form_class) is compiled)
+            for data in data_dicts:
+                form = form_class(data=data)
+                cleaned_data, errors = compiled.validate(data)
+                self.assertEqual(errors, dict(form.errors))
+                if form.is_valid():
+                    self.assertEqual(cleaned_data, form.cleaned_data)
+
+        class InitForm(forms.RegistrationForm):
+            def __init__(self, *args, **kwargs):
+                super(InitForm, self).__init__(*args, **kwargs)
+                del self.fields['email']
+
+        self.failUnless(forms.compile_form(InitForm) is None)
+
+        class FullCleanForm(forms.RegistrationForm):
+            def full_clean(self):
+                super(FullCleanForm, self).full_clean()
+        self.failUnless(forms.compile_form(FullCleanForm) is None)
+
+        # clean() methods see the state the constructor would set up.
+        class InitialForm(forms.RegistrationForm):
+            def clean(self):
+                if self.initial.get('username') or self.prefix or \
+                   self.add_prefix('email') != 'email':
+                    raise ValidationError(u'Unexpected form state.')
+                return self.cleaned_data
+        data = {'username': 'foo', 'email': 'foo@example.com',
+                'password1': 'foo', 'password2': 'foo'}
+        self.assertEqual(forms.compile_form(InitialForm).validate(data)[1], {})
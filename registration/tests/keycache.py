@@ -0,0 +1,88 @@
+import datetime
+import time
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+
+from registration import keycache
+from registration.models import RegistrationProfile
+
+
+class NegativeKeyCacheTests(TestCase):
+    """
+    Test the negative cache of bad activation keys.
+
+    """
+    def setUp(self):
+        self.old_key_cache = getattr(settings, 'REGISTRATION_KEY_CACHE', False)
+        self.old_activation = getattr(settings, 'ACCOUNT_ACTIVATION_DAYS', None)
+        settings.REGISTRATION_KEY_CACHE = True
+        if self.old_activation is None:
+            settings.ACCOUNT_ACTIVATION_DAYS = 7
+        keycache.clear_key_cache()
+        cache.clear()
+
+    def tearDown(self):
+        settings.REGISTRATION_KEY_CACHE = self.old_key_cache
+        if self.old_activation is None:
+            settings.ACCOUNT_ACTIVATION_DAYS = self.old_activation
+        keycache.clear_key_cache()
+        cache.clear()
+
+    def test_bounded(self):
+        """
+        Keys expire after the timeout, the cache drops its oldest
+        keys when full, and the shared tier is consulted on a local
+        miss.
+
+        """
+        key_cache = keycache.NegativeKeyCache(max_size=8, timeout=60, shared_cache=cache)
+        for i in range(9):
+            key_cache.add('key%d' % i)
+        self.assertEqual(key_cache.stats()['size'], 7)
+        self.failUnless('key8' in key_cache)
+
+        # The dropped keys are still in the shared tier.
+        dropped = [key for key in ['key%d' % i for i in range(8)] if key not in key_cache._keys]
+        self.assertEqual(len(dropped), 2)
+        self.failUnless(dropped[0] in key_cache)
+        self.assertEqual(key_cache.stats()['shared_hits'], 1)
+
+        key_cache._keys['key8'] = time.time() - 1
+        key_cache.discard('key8')
+        self.failIf('key8' in key_cache)
+        self.assertEqual(key_cache.stats()['hit_rate'], 2 / 3.0)
+
+    def test_activate_user(self):
+        """
+        With ``REGISTRATION_KEY_CACHE`` set, bad, expired and used
+        keys are answered without a query the second time, and a key
+        is forgotten when it is issued.
+
+        """
+        bad_key = 'a' * 40
+        self.failIf(RegistrationProfile.objects.activate_user(bad_key))
+        self.assertNumQueries(0, RegistrationProfile.objects.activate_user, bad_key)
+
+        user = User.objects.create_user('alice', 'alice@example.com', 'secret')
+        profile = RegistrationProfile.objects.create_profile(user)
+        profile.activation_key = bad_key
+        profile.save()
+        self.failUnless(RegistrationProfile.objects.activate_user(bad_key))
+        self.assertNumQueries(0, RegistrationProfile.objects.activate_user, bad_key)
+
+        user = User.objects.create_user('bob', 'bob@example.com', 'secret')
+        profile = RegistrationProfile.objects.create_profile(user)
+        RegistrationProfile.objects.filter(pk=profile.pk).update(expires_at=datetime.datetime.now())
+        self.failIf(RegistrationProfile.objects.activate_user(profile.activation_key))
+        self.assertNumQueries(0, RegistrationProfile.objects.activate_user, profile.activation_key)
+
+        # Extending the key's expiry lets it be used again.
+        profile.expires_at = datetime.datetime.now() + datetime.timedelta(days=1)
+        profile.save()
+        self.failUnless(RegistrationProfile.objects.activate_user(profile.activation_key))
+
+        stats = keycache.get_key_cache().stats()
+        self.assertEqual((stats['hits'], stats['misses']), (3, 4))
@@ -0,0 +1,184 @@
+import datetime
+
+from django.conf import settings
+from django.contrib.sites.models import Site
+from django.template import loader
+from django.test import TestCase
+from django.utils import translation
+
+from registration import mail
+from registration.models import RegistrationProfile
+from registration.tests.smtp import LocalSMTPServer
+
+
+class ActivationEmailTemplateTests(TestCase):
+    """
+    Test the cache of compiled activation email templates.
+
+    """
+    def setUp(self):
+        self.old_activation = getattr(settings, 'ACCOUNT_ACTIVATION_DAYS', None)
+        settings.ACCOUNT_ACTIVATION_DAYS = 7
+        self.old_get_template = loader.get_template
+        self.loaded = []
+        def get_template(template_name):
+            self.loaded.append(template_name)
+            return self.old_get_template(template_name)
+        loader.get_template = get_template
+        mail.clear_template_cache()
+
+    def tearDown(self):
+        settings.ACCOUNT_ACTIVATION_DAYS = self.old_activation
+        loader.get_template = self.old_get_template
+        mail.clear_template_cache()
+
+    def test_template_cache(self):
+        """
+        Rendering activation emails loads each template once per
+        language, until the cache is cleared.
+
+        """
+        site = Site.objects.get_current()
+        first = mail.render_activation_email('a' * 40, site)
+        mail.render_activation_email('b' * 40, site)
+        self.assertEqual(self.loaded, ['registration/activation_email_subject.txt',
+                                       'registration/activation_email.txt'])
+        self.assertEqual(first, mail.render_activation_email('a' * 40, site))
+
+        translation.activate('fr')
+        try:
+            mail.render_activation_email('a' * 40, site)
+        finally:
+            translation.deactivate()
+        self.assertEqual(len(self.loaded), 4)
+
+        mail.clear_template_cache()
+        mail.render_activation_email('a' * 40, site)
+        self.assertEqual(len(self.loaded), 6)
+
+
+class ConnectionPoolTests(TestCase):
+    """
+    Test the pool of reusable mail server connections, against a
+    local SMTP server.
+
+    """
+    def setUp(self):
+        self.old_activation = getattr(settings, 'ACCOUNT_ACTIVATION_DAYS', None)
+        self.old_pool = getattr(settings, 'REGISTRATION_EMAIL_POOL', False)
+        self.old_email = (settings.EMAIL_BACKEND, settings.EMAIL_HOST, settings.EMAIL_PORT)
+        settings.ACCOUNT_ACTIVATION_DAYS = 7
+        settings.REGISTRATION_EMAIL_POOL = True
+        self.smtp_server = LocalSMTPServer()
+        self.smtp_server.start()
+        settings.EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+        settings.EMAIL_HOST = self.smtp_server.host
+        settings.EMAIL_PORT = self.smtp_server.port
+        mail.connection_pool.close()
+
+    def tearDown(self):
+        mail.connection_pool.close()
+        self.smtp_server.stop()
+        settings.ACCOUNT_ACTIVATION_DAYS = self.old_activation
+        settings.REGISTRATION_EMAIL_POOL = self.old_pool
+        settings.EMAIL_BACKEND, settings.EMAIL_HOST, settings.EMAIL_PORT = self.old_email
+
+    def test_connection_reused(self):
+        """
+        With ``REGISTRATION_EMAIL_POOL`` set, activation emails share
+        one connection.
+
+        """
+        site = Site.objects.get_current()
+        for username in ('alice', 'bob', 'carol'):
+            RegistrationProfile.objects.create_inactive_user(username, '%s@example.com' % username,
+                                                             'secret', site)
+        self.assertEqual(len(self.smtp_server.messages), 3)
+        self.assertEqual(self.smtp_server.connections, 1)
+
+    def test_explicit_connection(self):
+        """
+        ``send_activation_email()`` uses a connection it is given.
+
+        """
+        site = Site.objects.get_current()
+        settings.REGISTRATION_EMAIL_POOL = False
+        new_user = RegistrationProfile.objects.create_inactive_user('alice', 'alice@example.com',
+                                                                    'secret', site, send_email=False)
+        profile = RegistrationProfile.objects.get(user=new_user)
+        connection = mail.get_connection()
+        connection.open()
+        try:
+            profile.send_activation_email(site, connection=connection)
+            profile.send_activation_email(site, connection=connection)
+        finally:
+            connection.close()
+        self.assertEqual(len(self.smtp_server.messages), 2)
+        self.assertEqual(self.smtp_server.connections, 1)
+
+    def test_batch_send(self):
+        """
+        ``RegistrationProfile.objects.send_activation_emails()`` sends
+        emails for pending profiles only, over one connection however
+        many batches it reads, and counts the profiles it skipped.
+
+        """
+        site = Site.objects.get_current()
+        settings.REGISTRATION_EMAIL_POOL = False
+        for username in ('alice', 'bob', 'carol'):
+            RegistrationProfile.objects.create_inactive_user(username, '%s@example.com' % username,
+                                                             'secret', site, send_email=False)
+        RegistrationProfile.objects.filter(user__username='carol').update(expires_at=datetime.datetime.now())
+
+        self.assertEqual(RegistrationProfile.objects.send_activation_emails(RegistrationProfile.objects.all(),
+                                                                            site, batch_size=1),
+                         (2, 1))
+        self.assertEqual(sorted([rcpttos for mailfrom, rcpttos, data in self.smtp_server.messages]),
+                         [['alice@example.com'], ['bob@example.com']])
+        self.assertEqual(self.smtp_server.connections, 1)
+
+        self.assertEqual(RegistrationProfile.objects.send_activation_emails(RegistrationProfile.objects.all(),
+                                                                            site),
+                         (2, 1))
+        self.assertEqual(self.smtp_server.connections, 2)
+
+    def test_unhealthy_connection_replaced(self):
+        """
+        Idle connections which fail a health check, or which have been
+        idle too long, are replaced.
+
+        """
+        pool = mail.ConnectionPool(check_interval=0)
+        connection = pool.acquire()
+        pool.release(connection)
+        connection.connection.close()
+        replacement = pool.acquire()
+        self.failIf(replacement is connection)
+        self.assertEqual(self.smtp_server.connections, 2)
+        pool.discard(replacement)
+
+        pool = mail.ConnectionPool(idle_timeout=0)
+        connection = pool.acquire()
+        pool.release(connection)
+        replacement = pool.acquire()
+        self.failIf(replacement is connection)
+        self.assertEqual(self.smtp_server.connections, 4)
+        pool.discard(replacement)
+
+    def test_dropped_connection_retried(self):
+        """
+        An email whose reused connection turns out to have been
+        dropped is sent again over a new connection.
+
+        """
+        pool = mail.ConnectionPool()
+        connection = pool.acquire()
+        pool.release(connection)
+        connection.connection.close()
+
+        messages = [mail.EmailMessage('Subject', 'Message', 'from@example.com', [recipient])
+                    for recipient in ('alice@example.com', 'bob@example.com')]
+        self.assertEqual(pool.send_messages(messages), 2)
+        self.assertEqual(len(self.smtp_server.messages), 2)
+        self.assertEqual(self.smtp_server.connections, 2)
+        pool.close()
@@ -1,15 +1,26 @@
 import datetime
+import os
 import re
+import tempfile
+import time
+from StringIO import StringIO
 
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.contrib.sites.models import Site
 from django.core import mail
 from django.core import management
+from django.core.management.base import CommandError
 from django.test import TestCase
+from django.test import TransactionTestCase
 from django.utils.hashcompat import sha_constructor
 
+from registration import models
+from registration.management.commands import cleanupregistration
+from registration.models import QueuedEmail
 from registration.models import RegistrationProfile
+from registration.models import UserLookup
+from registration.tests.smtp import LocalSMTPServer
 
 
 class RegistrationModelTests(TestCase):
@@ -44,6 +55,36 @@ class RegistrationModelTests(TestCase):
         self.assertEqual(unicode(profile),
                          "Registration information for alice")
 
+    def test_profile_expiration(self):
+        """
+        Creating a registration profile records when its activation
+        key expires, and the profile is pending until then.
+        
+        """
+        new_user = User.objects.create_user(**self.user_info)
+        profile = RegistrationProfile.objects.create_profile(new_user)
+
+        self.assertEqual(profile.expires_at,
+                         new_user.date_joined + datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS))
+        self.failIf(profile.activated)
+        self.assertEqual(list(RegistrationProfile.objects.pending()), [profile])
+        self.assertEqual(list(RegistrationProfile.objects.expired()), [])
+
+        RegistrationProfile.objects.filter(pk=profile.pk).update(expires_at=datetime.datetime.now())
+        self.assertEqual(list(RegistrationProfile.objects.pending()), [])
+        self.assertEqual(list(RegistrationProfile.objects.expired()), [profile])
+
+    def test_profile_default_expiration(self):
+        """
+        A profile saved without an expiry date expires
+        ``ACCOUNT_ACTIVATION_DAYS`` days after its user joined.
+        
+        """
+        new_user = User.objects.create_user(**self.user_info)
+        profile = RegistrationProfile.objects.create(user=new_user, activation_key='a' * 40)
+        self.assertEqual(profile.expires_at,
+                         new_user.date_joined + datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS))
+
     def test_activation_email(self):
         """
         ``RegistrationProfile.send_activation_email`` sends an
@@ -110,6 +151,8 @@ class RegistrationModelTests(TestCase):
                                                                     **self.user_info)
         new_user.date_joined -= datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS + 1)
         new_user.save()
+        RegistrationProfile.objects.filter(user=new_user).update(expires_at=new_user.date_joined +
+                                                                     datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS))
         profile = RegistrationProfile.objects.get(user=new_user)
         self.failUnless(profile.activation_key_expired())
 
@@ -130,6 +173,44 @@ class RegistrationModelTests(TestCase):
 
         profile = RegistrationProfile.objects.get(user=new_user)
         self.assertEqual(profile.activation_key, RegistrationProfile.ACTIVATED)
+        self.failUnless(profile.activated)
+
+    def test_activation_queries(self):
+        """
+        Activation reads the profile and user together, then claims
+        the key and activates the user with one ``UPDATE`` each.
+        
+        """
+        new_user = RegistrationProfile.objects.create_inactive_user(site=Site.objects.get_current(),
+                                                                    **self.user_info)
+        profile = RegistrationProfile.objects.get(user=new_user)
+        self.assertNumQueries(3, RegistrationProfile.objects.activate_user,
+                              profile.activation_key)
+        self.failUnless(User.objects.get(username='alice').is_active)
+
+    def test_activation_lost_race(self):
+        """
+        If another request activates the account between the lookup
+        of the profile and the claiming of its key, activation fails
+        and does not touch the user.
+        
+        """
+        new_user = RegistrationProfile.objects.create_inactive_user(site=Site.objects.get_current(),
+                                                                    **self.user_info)
+        profile = RegistrationProfile.objects.get(user=new_user)
+        key = profile.activation_key
+
+        # Claim the key behind the manager's back, and make the
+        # profile still look pending once it has been read, as it
+        # would to a request which lost the race.
+        RegistrationProfile.objects.filter(pk=profile.pk).update(activated=True)
+        old_expired = RegistrationProfile.activation_key_expired
+        RegistrationProfile.activation_key_expired = lambda self: False
+        try:
+            self.failIf(RegistrationProfile.objects.activate_user(key))
+        finally:
+            RegistrationProfile.activation_key_expired = old_expired
+        self.failIf(User.objects.get(username='alice').is_active)
 
     def test_expired_activation(self):
         """
@@ -141,6 +222,8 @@ class RegistrationModelTests(TestCase):
                                                                     **self.user_info)
         new_user.date_joined -= datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS + 1)
         new_user.save()
+        RegistrationProfile.objects.filter(user=new_user).update(expires_at=new_user.date_joined +
+                                                                     datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS))
 
         profile = RegistrationProfile.objects.get(user=new_user)
         activated = RegistrationProfile.objects.activate_user(profile.activation_key)
@@ -186,6 +269,23 @@ class RegistrationModelTests(TestCase):
         invalid_key = sha_constructor('foo').hexdigest()
         self.failIf(RegistrationProfile.objects.activate_user(invalid_key))
 
+    def test_bulk_activation_queries(self):
+        """
+        ``RegistrationProfile.objects.activate_users()`` uses a fixed
+        number of queries per batch, regardless of how many accounts
+        are in it.
+        
+        """
+        for username in ('alice', 'bob', 'carol'):
+            RegistrationProfile.objects.create_inactive_user(site=Site.objects.get_current(),
+                                                             username=username,
+                                                             password='secret',
+                                                             email='%s@example.com' % username)
+        # One query to find the batch, four to activate it, and one
+        # to find there are no more.
+        self.assertNumQueries(6, RegistrationProfile.objects.activate_users)
+        self.assertEqual(User.objects.filter(is_active=True).count(), 3)
+
     def test_expired_user_deletion(self):
         """
         ``RegistrationProfile.objects.delete_expired_users()`` only
@@ -200,11 +300,55 @@ class RegistrationModelTests(TestCase):
                                                                         email='bob@example.com')
         expired_user.date_joined -= datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS + 1)
         expired_user.save()
+        RegistrationProfile.objects.filter(user=expired_user).update(expires_at=expired_user.date_joined +
+                                                                         datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS))
 
         RegistrationProfile.objects.delete_expired_users()
         self.assertEqual(RegistrationProfile.objects.count(), 1)
         self.assertRaises(User.DoesNotExist, User.objects.get, username='bob')
 
+    def test_expired_user_deletion_batches(self):
+        """
+        ``RegistrationProfile.objects.delete_expired_users()`` deletes
+        every expired account regardless of batch size, and returns
+        the number of accounts deleted.
+        
+        """
+        for username in ('bob', 'carol', 'dave'):
+            expired_user = RegistrationProfile.objects.create_inactive_user(site=Site.objects.get_current(),
+                                                                            username=username,
+                                                                            password='secret',
+                                                                            email='%s@example.com' % username)
+            expired_user.date_joined -= datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS + 1)
+            expired_user.save()
+            RegistrationProfile.objects.filter(user=expired_user).update(expires_at=expired_user.date_joined +
+                                                                             datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS))
+
+        self.assertEqual(RegistrationProfile.objects.delete_expired_users(batch_size=2), 3)
+        self.assertEqual(RegistrationProfile.objects.count(), 0)
+        self.assertEqual(User.objects.count(), 0)
+
+    def test_expired_user_deletion_activated(self):
+        """
+        ``RegistrationProfile.objects.delete_expired_users()`` leaves
+        alone accounts which activated and were later deactivated.
+        
+        """
+        new_user = RegistrationProfile.objects.create_inactive_user(site=Site.objects.get_current(),
+                                                                    **self.user_info)
+        profile = RegistrationProfile.objects.get(user=new_user)
+        RegistrationProfile.objects.activate_user(profile.activation_key)
+
+        new_user = User.objects.get(username='alice')
+        new_user.is_active = False
+        new_user.date_joined -= datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS + 1)
+        new_user.save()
+        RegistrationProfile.objects.filter(user=new_user).update(expires_at=new_user.date_joined +
+                                                                     datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS))
+
+        self.assertEqual(RegistrationProfile.objects.delete_expired_users(), 0)
+        self.assertEqual(User.objects.filter(username='alice').count(), 1)
+
     def test_management_command(self):
         """
         The ``cleanupregistration`` management command properly
@@ -219,7 +363,414 @@ class RegistrationModelTests(TestCase):
                                                                         email='bob@example.com')
         expired_user.date_joined -= datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS + 1)
         expired_user.save()
+        RegistrationProfile.objects.filter(user=expired_user).update(expires_at=expired_user.date_joined +
+                                                                         datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS))
 
-        management.call_command('cleanupregistration')
+        management.call_command('cleanupregistration', stdout=StringIO())
         self.assertEqual(RegistrationProfile.objects.count(), 1)
         self.assertRaises(User.DoesNotExist, User.objects.get, username='bob')
+
+    def _create_expired_users(self, usernames):
+        for username in usernames:
+            expired_user = RegistrationProfile.objects.create_inactive_user(site=Site.objects.get_current(),
+                                                                            username=username,
+                                                                            password='secret',
+                                                                            email='%s@example.com' % username)
+            expired_user.date_joined -= datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS + 1)
+            expired_user.save()
+            RegistrationProfile.objects.filter(user=expired_user).update(expires_at=expired_user.date_joined +
+                                                                             datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS))
+
+    def test_expired_user_deletion_resume(self):
+        """
+        ``RegistrationProfile.objects.delete_expired_users_in_batches()``
+        yields after each batch, supports dry runs and resumes after a
+        given primary key.
+        
+        """
+        self._create_expired_users(('bob', 'carol', 'dave'))
+        pks = list(RegistrationProfile.objects.order_by('pk').values_list('pk', flat=True))
+
+        batches = list(RegistrationProfile.objects.delete_expired_users_in_batches(batch_size=2, dry_run=True))
+        self.assertEqual(batches, [(pks[1], 2), (pks[2], 1)])
+        self.assertEqual(User.objects.count(), 3)
+
+        batches = list(RegistrationProfile.objects.delete_expired_users_in_batches(start_after=pks[0]))
+        self.assertEqual(batches, [(pks[2], 2)])
+        self.assertEqual(list(User.objects.values_list('username', flat=True)), [u'bob'])
+
+    def test_management_command_options(self):
+        """
+        The ``cleanupregistration`` management command supports dry
+        runs, stops at its time limit and resumes from its state file;
+        it reports its totals by default, and its progress only at a
+        verbosity above 1.
+        
+        """
+        self._create_expired_users(('bob', 'carol', 'dave'))
+        fd, state_file = tempfile.mkstemp()
+        os.close(fd)
+        try:
+            out = StringIO()
+            management.call_command('cleanupregistration', dry_run=True, stdout=out)
+            self.assertEqual(User.objects.count(), 3)
+            self.assertEqual(out.getvalue(), "Found 3 expired accounts.\n")
+
+            # With a clock which only moves when the command sleeps,
+            # the one-second pauses run out the time limit after two
+            # batches.
+            class Clock(object):
+                now = 0
+                def time(cls):
+                    return cls.now
+                time = classmethod(time)
+                def sleep(cls, seconds):
+                    cls.now += seconds
+                sleep = classmethod(sleep)
+            cleanupregistration.time = Clock
+            out = StringIO()
+            try:
+                management.call_command('cleanupregistration', batch_size=1, sleep=1, max_runtime=1.5,
+                                        state_file=state_file, stdout=out)
+            finally:
+                cleanupregistration.time = time
+            self.assertEqual(User.objects.count(), 1)
+            lines = out.getvalue().splitlines()
+            self.assertEqual(lines[0], "Deleted 2 expired accounts.")
+            self.failUnless('--start-after' in lines[1])
+            self.assertEqual(len(lines), 2)
+            self.failUnless(open(state_file).read().strip())
+
+            management.call_command('cleanupregistration', batch_size=1, state_file=state_file,
+                                    stdout=StringIO())
+            self.assertEqual(User.objects.count(), 0)
+            self.failIf(os.path.exists(state_file))
+        finally:
+            if os.path.exists(state_file):
+                os.remove(state_file)
+
+    def test_management_command_ranges(self):
+        """
+        The ``cleanupregistration`` management command splits primary
+        keys into contiguous ranges for its workers, each of which
+        only cleans up accounts within its range.
+        
+        """
+        self.assertEqual(cleanupregistration.split_pk_range(1, 10, 3),
+                         [(0, 4), (4, 8), (8, 10)])
+        self.assertEqual(cleanupregistration.split_pk_range(5, 6, 4),
+                         [(4, 5), (5, 6)])
+
+        self._create_expired_users(('bob', 'carol', 'dave'))
+        pks = list(RegistrationProfile.objects.order_by('pk').values_list('pk', flat=True))
+        self.assertEqual(cleanupregistration._delete_range((pks[0], pks[1], 1000, 0, False)), 1)
+        self.assertEqual(sorted(User.objects.values_list('username', flat=True)), [u'bob', u'dave'])
+
+        self.assertRaises(CommandError, cleanupregistration.Command().handle_noargs,
+                          workers=2, max_runtime=10, state_file=None)
+
+    def test_management_command_workers(self):
+        """
+        The ``cleanupregistration`` management command hands its
+        ranges to a pool of ``--workers`` processes, and adds up the
+        accounts they deleted, reporting the total by default.
+        
+        """
+        self._create_expired_users(('bob', 'carol', 'dave'))
+        RegistrationProfile.objects.create_inactive_user(site=Site.objects.get_current(),
+                                                         **self.user_info)
+
+        # Run the pool's tasks in this process, against the test
+        # database, which closing the connection would destroy.
+        pools = []
+        class Pool(object):
+            def __init__(self, processes, initializer=None):
+                pools.append(processes)
+            def imap_unordered(self, func, tasks):
+                return map(func, tasks)
+            def close(self):
+                pass
+            terminate = join = close
+        old_pool = cleanupregistration.multiprocessing.Pool
+        old_close_connections = cleanupregistration._close_connections
+        cleanupregistration.multiprocessing.Pool = Pool
+        cleanupregistration._close_connections = lambda: None
+        command = cleanupregistration.Command()
+        command.stdout = StringIO()
+        try:
+            command.handle_noargs(workers=2, batch_size=1, sleep=0, dry_run=False, start_after=None,
+                                  state_file=None, max_runtime=None, verbosity=1)
+        finally:
+            cleanupregistration.multiprocessing.Pool = old_pool
+            cleanupregistration._close_connections = old_close_connections
+        self.assertEqual(pools, [2])
+        self.assertEqual(list(User.objects.values_list('username', flat=True)), [u'alice'])
+        self.assertEqual(command.stdout.getvalue(), "Deleted 3 expired accounts.\n")
+
+    def test_bulk_user_creation(self):
+        """
+        ``RegistrationProfile.objects.create_inactive_users()`` creates
+        inactive accounts with profiles, sends their activation emails,
+        adds their ``UserLookup``s if those are kept up to date, and
+        reports a result for every record.
+        
+        """
+        old_sync = getattr(settings, 'REGISTRATION_USER_LOOKUP_SYNC', False)
+        settings.REGISTRATION_USER_LOOKUP_SYNC = True
+        try:
+            User.objects.create_user('carol', 'carol@example.com', 'secret')
+            records = [('alice', 'alice@EXAMPLE.com', 'swordfish'),
+                       ('bob', 'bob@example.com', 'secret'),
+                       ('carol', 'carol@example.com', 'secret'),
+                       ('bob', 'bob2@example.com', 'secret')]
+            results = RegistrationProfile.objects.create_inactive_users(iter(records),
+                                                                        Site.objects.get_current(),
+                                                                        batch_size=3)
+
+            self.assertEqual([user and user.username for user, error in results],
+                             ['alice', 'bob', None, None])
+            self.assertEqual([error is None for user, error in results],
+                             [True, True, False, False])
+
+            alice = User.objects.get(username='alice')
+            self.assertEqual(alice.email, 'alice@example.com')
+            self.failUnless(alice.check_password('swordfish'))
+            self.failIf(alice.is_active)
+            self.assertEqual(RegistrationProfile.objects.count(), 2)
+            self.assertEqual(len(mail.outbox), 2)
+
+            profile = RegistrationProfile.objects.get(user=alice)
+            self.assertEqual(RegistrationProfile.objects.activate_user(profile.activation_key), alice)
+            self.assertEqual(sorted(UserLookup.objects.values_list('username', 'email')),
+                             [(u'alice', u'alice@example.com'), (u'bob', u'bob@example.com'),
+                              (u'carol', u'carol@example.com')])
+        finally:
+            settings.REGISTRATION_USER_LOOKUP_SYNC = old_sync
+
+    def test_bulk_user_creation_invalid(self):
+        """
+        ``RegistrationProfile.objects.create_inactive_users()`` skips,
+        with an error for each, records with invalid usernames or
+        email addresses and usernames taken in a different case,
+        while creating the rest of the batch.
+        
+        """
+        User.objects.create_user('carol', 'carol@example.com', 'secret')
+        records = [('alice', 'alice@example.com', 'swordfish'),
+                   ('Carol', 'carol2@example.com', 'secret'),
+                   ('ALICE', 'alice2@example.com', 'secret'),
+                   ('foo/bar', 'foo@example.com', 'secret'),
+                   ('x' * 31, 'x@example.com', 'secret'),
+                   ('dave', 'not an address', 'secret')]
+        results = RegistrationProfile.objects.create_inactive_users(records,
+                                                                    Site.objects.get_current(),
+                                                                    send_email=False)
+        self.assertEqual([user and user.username for user, error in results],
+                         ['alice', None, None, None, None, None])
+        self.assertEqual(results[1][1], u"A user with that username already exists.")
+        self.assertEqual(results[2][1], u"A user with that username already exists.")
+        self.assertEqual(results[3][1], results[4][1])
+        self.assertEqual(results[5][1], u"The email address is not valid.")
+        self.assertEqual(RegistrationProfile.objects.count(), 1)
+
+    def test_bulk_user_creation_no_email(self):
+        """
+        Passing ``send_email=False`` to
+        ``RegistrationProfile.objects.create_inactive_users()`` does not
+        send activation emails.
+        
+        """
+        RegistrationProfile.objects.create_inactive_users([('alice', 'alice@example.com', 'swordfish')],
+                                                          Site.objects.get_current(),
+                                                          send_email=False)
+        self.assertEqual(RegistrationProfile.objects.count(), 1)
+        self.assertEqual(len(mail.outbox), 0)
+
+    def test_lookup_backfill_command(self):
+        """
+        The ``backfillregistrationlookup`` management command adds the
+        missing ``UserLookup`` of every existing user.
+        
+        """
+        for username in ('Alice', 'bob', 'carol'):
+            User.objects.create_user(username, '%s@Example.com' % username, 'secret')
+        UserLookup.objects.exclude(username='bob').delete()
+
+        management.call_command('backfillregistrationlookup', batch_size=2, stdout=StringIO())
+        self.assertEqual(sorted(UserLookup.objects.values_list('username', 'email')),
+                         [(u'alice', u'alice@example.com'), (u'bob', u'bob@example.com'),
+                          (u'carol', u'carol@example.com')])
+
+    def test_import_command(self):
+        """
+        The ``importregistrations`` management command creates
+        accounts from CSV and newline-delimited JSON files.
+        
+        """
+        files = [('.csv', 'username,email,password\n'
+                          'alice,alice@example.com,swordfish\n'
+                          'alice,alice@example.com,swordfish\n'),
+                 ('.ndjson', '{"username": "bob", "email": "bob@example.com", "password": "secret"}\n\n')]
+        for suffix, contents in files:
+            fd, path = tempfile.mkstemp(suffix=suffix)
+            try:
+                os.write(fd, contents)
+                os.close(fd)
+                management.call_command('importregistrations', path, batch_size=1,
+                                        stdout=StringIO(), stderr=StringIO())
+            finally:
+                os.remove(path)
+
+        self.assertEqual(sorted(User.objects.values_list('username', flat=True)),
+                         [u'alice', u'bob'])
+        self.assertEqual(RegistrationProfile.objects.count(), 2)
+        self.assertEqual(len(mail.outbox), 2)
+
+
+class QueuedEmailTests(TestCase):
+    """
+    Test the email outbox and the management command which sends from
+    it.
+    
+    """
+    user_info = {'username': 'alice',
+                 'password': 'swordfish',
+                 'email': 'alice@example.com'}
+
+    def setUp(self):
+        self.old_activation = getattr(settings, 'ACCOUNT_ACTIVATION_DAYS', None)
+        self.old_outbox = getattr(settings, 'REGISTRATION_EMAIL_OUTBOX', False)
+        self.old_email = (settings.EMAIL_BACKEND, settings.EMAIL_HOST, settings.EMAIL_PORT)
+        settings.ACCOUNT_ACTIVATION_DAYS = 7
+        settings.REGISTRATION_EMAIL_OUTBOX = True
+        self.smtp_server = LocalSMTPServer()
+        self.smtp_server.start()
+        settings.EMAIL_BACKEND = 'django.core.mail.backends.smtp.EmailBackend'
+        settings.EMAIL_HOST = self.smtp_server.host
+        settings.EMAIL_PORT = self.smtp_server.port
+
+    def tearDown(self):
+        self.smtp_server.stop()
+        settings.ACCOUNT_ACTIVATION_DAYS = self.old_activation
+        settings.REGISTRATION_EMAIL_OUTBOX = self.old_outbox
+        settings.EMAIL_BACKEND, settings.EMAIL_HOST, settings.EMAIL_PORT = self.old_email
+
+    def test_activation_email_queued(self):
+        """
+        With ``REGISTRATION_EMAIL_OUTBOX`` set, activation emails are
+        queued instead of being sent; re-sent emails are queued behind
+        first-time emails.
+        
+        """
+        new_user = RegistrationProfile.objects.create_inactive_user(site=Site.objects.get_current(),
+                                                                    **self.user_info)
+        profile = RegistrationProfile.objects.get(user=new_user)
+        profile.send_activation_email(Site.objects.get_current(), resend=True)
+
+        self.assertEqual(self.smtp_server.messages, [])
+        self.assertEqual([(email.recipient, email.priority) for email in QueuedEmail.objects.claim(10)],
+                         [('alice@example.com', QueuedEmail.FIRST_SEND),
+                          ('alice@example.com', QueuedEmail.RESEND)])
+
+        # Claimed emails aren't handed out again until their lease
+        # expires.
+        self.assertEqual(QueuedEmail.objects.claim(10), [])
+
+    def test_claim_key(self):
+        """
+        Each claim of queued emails gets only the emails it marked
+        with its own claim key.
+        
+        """
+        QueuedEmail.objects.enqueue_many([('alice@example.com', 'Subject', 'Message'),
+                                          ('bob@example.com', 'Subject', 'Message')],
+                                         'registration@example.com')
+        first = QueuedEmail.objects.claim(1, lease=0)
+        second = QueuedEmail.objects.claim(1, lease=0)
+        self.assertEqual(len(first), 1)
+        self.assertEqual(len(second), 1)
+        self.assertNotEqual(first[0].pk, second[0].pk)
+        self.assertNotEqual(first[0].claim_key, second[0].claim_key)
+
+        # With a lease of zero, claimed emails are due again at once;
+        # claiming them again takes them away from the earlier claims.
+        third = QueuedEmail.objects.claim(10, lease=0)
+        self.assertEqual(sorted([email.pk for email in third]),
+                         sorted([first[0].pk, second[0].pk]))
+        self.failIf(QueuedEmail.objects.filter(claim_key=first[0].claim_key).exists())
+
+    def test_send_command(self):
+        """
+        The ``sendregistrationmail`` management command sends queued
+        emails over SMTP and removes them from the outbox.
+        
+        """
+        for username in ('alice', 'bob', 'carol'):
+            RegistrationProfile.objects.create_inactive_user(site=Site.objects.get_current(),
+                                                             username=username,
+                                                             password='secret',
+                                                             email='%s@example.com' % username)
+        management.call_command('sendregistrationmail', once=True, batch_size=2,
+                                stdout=StringIO())
+
+        self.assertEqual(sorted([rcpttos for mailfrom, rcpttos, data in self.smtp_server.messages]),
+                         [['alice@example.com'], ['bob@example.com'], ['carol@example.com']])
+        self.assertEqual(QueuedEmail.objects.count(), 0)
+
+    def test_send_command_failure(self):
+        """
+        Emails which can't be sent are retried later, and eventually
+        given up on.
+        
+        """
+        RegistrationProfile.objects.create_inactive_user(site=Site.objects.get_current(),
+                                                         **self.user_info)
+        self.smtp_server.stop()
+        try:
+            management.call_command('sendregistrationmail', once=True,
+                                    stdout=StringIO())
+            queued = QueuedEmail.objects.get()
+            self.assertEqual(queued.attempts, 1)
+            self.failIf(queued.failed)
+            self.failUnless(queued.last_error)
+            self.failUnless(queued.next_attempt_at > datetime.datetime.now())
+
+            QueuedEmail.objects.update(next_attempt_at=datetime.datetime.now())
+            management.call_command('sendregistrationmail', once=True, max_attempts=2,
+                                    stdout=StringIO())
+            queued = QueuedEmail.objects.get()
+            self.assertEqual(queued.attempts, 2)
+            self.failUnless(queued.failed)
+        finally:
+            self.smtp_server.start()
+
+
+class BulkCreationRaceTests(TransactionTestCase):
+    """
+    Test bulk account creation when another process registers one of
+    the usernames between the check and the insert.
+    
+    """
+    def test_bulk_user_creation_race(self):
+        """
+        A batch whose insert fails on a username taken since it was
+        checked is inserted again record by record, and only the
+        clashing record is skipped.
+        
+        """
+        User.objects.create_user('carol', 'carol@example.com', 'secret')
+        old_taken_usernames = models._taken_usernames
+        models._taken_usernames = lambda usernames: set()
+        try:
+            results = RegistrationProfile.objects.create_inactive_users([('alice', 'alice@example.com', 'secret'),
+                                                                         ('carol', 'carol2@example.com', 'secret'),
+                                                                         ('dave', 'dave@example.com', 'secret')],
+                                                                        Site.objects.get_current(),
+                                                                        send_email=False)
+        finally:
+            models._taken_usernames = old_taken_usernames
+        self.assertEqual([user and user.username for user, error in results], ['alice', None, 'dave'])
+        self.assertEqual(results[1][1], u"A user with that username already exists.")
+        self.assertEqual(sorted(User.objects.values_list('username', flat=True)),
+                         [u'alice', u'carol', u'dave'])
+        self.assertEqual(RegistrationProfile.objects.count(), 2)
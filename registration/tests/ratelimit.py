@@ -0,0 +1,116 @@
+import json
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.urlresolvers import reverse
+from django.test import TestCase
+
+from registration import ratelimit
+from registration.models import RegistrationProfile
+
+
+class RateLimitTests(TestCase):
+    """
+    Test the throttling of the registration and activation views.
+
+    """
+    urls = 'registration.tests.urls'
+
+    def setUp(self):
+        cache.clear()
+        self.old_settings = {}
+        for name, value in (('REGISTRATION_RATE_LIMIT', True),
+                            ('REGISTRATION_RATE_LIMIT_IP', (3, 60)),
+                            ('REGISTRATION_RATE_LIMIT_SUBNET', (5, 60))):
+            self.old_settings[name] = getattr(settings, name, None)
+            setattr(settings, name, value)
+
+    def tearDown(self):
+        for name, value in self.old_settings.items():
+            if value is None:
+                delattr(settings, name)
+            else:
+                setattr(settings, name, value)
+        cache.clear()
+
+    def test_subnet(self):
+        """
+        IPv4 addresses are grouped by /24 and IPv6 addresses by /64.
+
+        """
+        self.assertEqual(ratelimit.subnet('192.0.2.17'), '192.0.2.0/24')
+        self.assertEqual(ratelimit.subnet('2001:DB8:0:1:2::1'), '2001:db8:0:1::/64')
+        self.assertEqual(ratelimit.subnet('2001:db8::1'), '2001:db8:0:0::/64')
+        self.assertEqual(ratelimit.subnet('::1'), '0:0:0:0::/64')
+
+    def test_subnet_ipv4_mapped(self):
+        """
+        IPv4-mapped IPv6 addresses are counted as the IPv4 address
+        they map, so that clients of a dual-stack server share their
+        own address's and /24's limits rather than all sharing
+        ``::/64``.
+
+        """
+        self.assertEqual(ratelimit.subnet('::ffff:192.0.2.17'), '192.0.2.0/24')
+        self.assertEqual(ratelimit.subnet('::FFFF:198.51.100.7'), '198.51.100.0/24')
+        now = 6000.0
+        for i in range(3):
+            self.failUnless(ratelimit.check('::ffff:192.0.2.1', 'register', now) is None)
+        self.assertEqual(ratelimit.check('192.0.2.1', 'register', now), 60)
+
+    def test_check(self):
+        """
+        Requests are allowed up to the limit for each address and
+        subnet, and the previous window counts towards the current
+        one in proportion to their overlap.
+
+        """
+        now = 6000.0
+        for i in range(3):
+            self.failUnless(ratelimit.check('192.0.2.1', 'register', now) is None)
+        self.assertEqual(ratelimit.check('192.0.2.1', 'register', now), 60)
+        # Other views are limited separately.
+        self.failUnless(ratelimit.check('192.0.2.1', 'activate', now) is None)
+        # Other addresses in the subnet are limited by the subnet's limit.
+        self.failUnless(ratelimit.check('192.0.2.2', 'register', now) is None)
+        self.assertEqual(ratelimit.check('192.0.2.3', 'register', now + 15), 45)
+
+        # Half way through the next window, half of the previous
+        # window's four requests from 192.0.2.1 still count.
+        self.failUnless(ratelimit.check('192.0.2.1', 'register', now + 90) is None)
+        self.assertEqual(ratelimit.check('192.0.2.1', 'register', now + 90), 30)
+
+    def test_views_throttled(self):
+        """
+        Requests over the limit receive a 429 response, in JSON if
+        they accept it, without reaching the view.
+
+        """
+        data = {'username': 'bob', 'email': 'bob@example.com',
+                'password1': 'secret', 'password2': 'secret'}
+        for i in range(3):
+            self.assertEqual(self.client.get(reverse('registration_register')).status_code, 200)
+        response = self.client.post(reverse('registration_register'), data=data)
+        self.assertEqual(response.status_code, 429)
+        self.failUnless(int(response['Retry-After']) > 0)
+        response = self.client.post(reverse('registration_register'), data=data,
+                                    **{'HTTP_ACCEPT': 'application/json'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(json.loads(response.content),
+                         {'success': False, 'errors': [u'Too many requests.']})
+        self.assertEqual(RegistrationProfile.objects.count(), 0)
+
+        for i in range(3):
+            self.assertEqual(self.client.get(reverse('registration_test_activate_template_name',
+                                                     kwargs={'activation_key': 'foo'})).status_code, 200)
+        self.assertEqual(self.client.get(reverse('registration_test_activate_template_name',
+                                                 kwargs={'activation_key': 'foo'})).status_code, 429)
+
+        url = reverse('registration_check_availability') + '?username=alice'
+        for i in range(3):
+            self.assertEqual(self.client.get(url).status_code, 200)
+        response = self.client.get(url, **{'HTTP_ACCEPT': 'application/json'})
+        self.assertEqual(response.status_code, 429)
+
+        settings.REGISTRATION_RATE_LIMIT = False
+        self.assertEqual(self.client.get(reverse('registration_register')).status_code, 200)
@@ -0,0 +1,59 @@
+from django.contrib.sites.models import RequestSite
+from django.contrib.sites.models import Site
+from django.test import TestCase
+
+from registration import sites
+from registration.decorators import HttpResponseNotAuthorized
+from registration.tests.backends import _mock_request
+
+
+class CurrentSiteTests(TestCase):
+    """
+    Test the cached resolution of the current site.
+
+    """
+    def setUp(self):
+        sites.clear_site_cache()
+
+    def tearDown(self):
+        sites.clear_site_cache()
+
+    def test_site_cached(self):
+        """
+        The current ``Site`` is fetched once, and fetched again after
+        it changes.
+
+        """
+        self.assertEqual(sites.get_current_site(), Site.objects.get_current())
+        self.assertNumQueries(0, sites.get_current_site)
+
+        site = Site.objects.get_current()
+        site.name = 'Renamed'
+        site.save()
+        self.assertEqual(sites.get_current_site().name, 'Renamed')
+
+    def test_request_site(self):
+        """
+        Without ``django.contrib.sites``, a ``RequestSite`` is built
+        from the request, and ``None`` is returned without one.
+
+        """
+        Site._meta.installed = False
+        try:
+            self.failUnless(isinstance(sites.get_current_site(_mock_request()), RequestSite))
+            self.assertEqual(sites.get_current_site(), None)
+        finally:
+            Site._meta.installed = True
+
+    def test_not_authorized_realm(self):
+        """
+        ``HttpResponseNotAuthorized`` names the current site as its
+        realm, without a query once the site is cached.
+
+        """
+        sites.get_current_site()
+        responses = []
+        self.assertNumQueries(0, lambda: responses.append(HttpResponseNotAuthorized('')))
+        response = responses[0]
+        self.assertEqual(response['WWW-Authenticate'],
+                         'Cookie realm="%s"' % Site.objects.get_current().name)
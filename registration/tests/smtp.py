@@ -0,0 +1,64 @@
+"""
+A local SMTP server for tests which need to exercise a real SMTP
+connection rather than Django's in-memory test email backend.
+
+"""
+
+import asyncore
+import smtpd
+import threading
+
+
+class _CollectingSMTPServer(smtpd.SMTPServer):
+    def __init__(self, localaddr, owner):
+        smtpd.SMTPServer.__init__(self, localaddr, None)
+        self.owner = owner
+        self.messages = owner.messages
+
+    def handle_accept(self):
+        self.owner.connections += 1
+        smtpd.SMTPServer.handle_accept(self)
+
+    def process_message(self, peer, mailfrom, rcpttos, data):
+        self.messages.append((mailfrom, rcpttos, data))
+
+
+class LocalSMTPServer(object):
+    """
+    An SMTP server listening on an arbitrary free port on
+    ``127.0.0.1``, which accepts every message it receives and stores
+    it as a ``(mailfrom, rcpttos, data)`` tuple in ``messages``;
+    ``connections`` counts the connections it has accepted.
+
+    Call ``start()`` to begin serving, in a background thread, and
+    ``stop()`` to shut the server down; ``host`` and ``port`` give
+    the address to connect to.
+    
+    """
+    def __init__(self):
+        self.messages = []
+        self.connections = 0
+        self.host = '127.0.0.1'
+        self.port = None
+        self._server = None
+        self._thread = None
+        self._running = False
+
+    def start(self):
+        self._server = _CollectingSMTPServer((self.host, 0), self)
+        self.port = self._server.socket.getsockname()[1]
+        self._running = True
+        self._thread = threading.Thread(target=self._serve)
+        self._thread.setDaemon(True)
+        self._thread.start()
+
+    def _serve(self):
+        while self._running:
+            asyncore.loop(timeout=0.01, count=1)
+
+    def stop(self):
+        self._running = False
+        self._thread.join()
+        self._server.close()
+        # Close any client channels left open by the server.
+        asyncore.close_all()
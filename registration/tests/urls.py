@@ -13,8 +13,18 @@ handled.
 from django.conf.urls.defaults import *
 from django.views.generic.base import TemplateView
 
+from registration.forms import RegistrationFormUniqueEmail
+from registration.forms import RegistrationFormUsernameEmailMatch
 from registration.views import activate
+from registration.views import check_availability
 from registration.views import register
+from registration.views import register_batch
+from registration.views import ActivateView
+from registration.views import RegisterView
+
+
+def context_unused():
+    raise AssertionError("extra_context shouldn't be evaluated for JSON requests.")
 
 
 urlpatterns = patterns('',
@@ -52,6 +62,35 @@ urlpatterns = patterns('',
                            {'extra_context': {'foo': 'bar', 'callable': lambda: 'called'},
                             'backend': 'registration.backends.default.DefaultBackend'},
                            name='registration_test_register_extra_context'),
+                       # Test that the 'register' view doesn't
+                       # evaluate extra_context for JSON requests.
+                       url(r'^register-json-extra-context/$',
+                           register,
+                           {'extra_context': {'callable': context_unused},
+                            'backend': 'registration.backends.default.DefaultBackend'},
+                           name='registration_test_register_json_extra_context'),
+                       # Test the class-based views with custom
+                       # template names and extra_context.
+                       url(r'^register-class-view/$',
+                           RegisterView.as_view(backend='registration.backends.default.DefaultBackend',
+                                                template_name='registration/test_template_name.html',
+                                                extra_context={'foo': 'bar', 'callable': lambda: 'called'}),
+                           name='registration_test_register_class_view'),
+                       url(r'^activate-class-view/(?P<activation_key>\w+)/$',
+                           ActivateView.as_view(backend='registration.backends.default.DefaultBackend',
+                                                template_name='registration/test_template_name.html',
+                                                extra_context={'foo': 'bar', 'callable': lambda: 'called'}),
+                           name='registration_test_activate_class_view'),
+                       url(r'^register-class-view-override/$',
+                           RegisterView.as_view(backend='registration.backends.default.DefaultBackend',
+                                                template_name='registration/test_template_name.html',
+                                                extra_context={'user': 'static', 'perms': lambda: 'called'}),
+                           name='registration_test_register_class_view_override'),
+                       url(r'^activate-class-view-templates/(?P<activation_key>\w+)/$',
+                           ActivateView.as_view(backend='registration.backends.default.DefaultBackend',
+                                                template_name=('registration/nonexistent_template.html',
+                                                               'registration/test_template_name.html')),
+                           name='registration_test_activate_class_view_templates'),
                        # Test the 'register' view with custom URL for
                        # closed registration.
                        url(r'^register-with-disallowed-url/$',
@@ -72,6 +111,20 @@ urlpatterns = patterns('',
                             'backend': 'registration.backends.default.DefaultBackend'},
                            name='registration_test_register_success_url'
                            ),
+                       # Test the 'check_availability' view with a
+                       # form class which checks email addresses too.
+                       url(r'^available-unique-email/$',
+                           check_availability,
+                           {'form_class': RegistrationFormUniqueEmail,
+                            'backend': 'registration.backends.default.DefaultBackend'},
+                           name='registration_test_check_availability_unique_email'),
+                       # Test the 'register_batch' view with a form
+                       # class whose usernames are email addresses.
+                       url(r'^register-batch-email-match/$',
+                           register_batch,
+                           {'form_class': RegistrationFormUsernameEmailMatch,
+                            'backend': 'registration.backends.default.DefaultBackend'},
+                           name='registration_test_register_batch_email_match'),
                        # Pattern for custom redirect set above.
                        url(r'^custom-success/$',
                            TemplateView.as_view(template_name='registration/test_template_name.html'),
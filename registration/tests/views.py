@@ -3,13 +3,19 @@ import datetime
 import json
 
 from django.conf import settings
+from django.conf.urls.defaults import patterns
 from django.contrib.auth.models import User
 from django.core import mail
+from django.core.cache import cache
 from django.core.urlresolvers import reverse
 from django.test import TestCase
+from django.utils import translation
 
 from registration import forms
+from registration.backends import get_backend
+from registration.backends import load_backends
 from registration.models import RegistrationProfile
+from registration.views import RegisterView
 
 
 class RegistrationViewTests(TestCase):
@@ -119,6 +125,91 @@ class RegistrationViewTests(TestCase):
         self.assertTrue(u"The two password fields didn't match." in json.loads(response.content)['errors'].get('__all__', None))
         self.assertEqual(len(mail.outbox), 0)
 
+    def test_registration_view_json_skips_context(self):
+        """
+        The ``register`` view reports missing fields in JSON without
+        evaluating ``extra_context``.
+
+        """
+        response = self.client.post(reverse('registration_test_register_json_extra_context'),
+                                    data={'username': 'bob'},
+                                    **{'HTTP_ACCEPT': 'application/json'})
+        self.assertEqual(response.status_code, 200)
+        response_data = json.loads(response.content)
+        self.assertFalse(response_data['success'])
+        self.assertEqual(sorted(response_data['errors'].keys()),
+                         ['email', 'password1', 'password2'])
+        self.assertEqual(response_data['errors']['email'], [u'This field is required.'])
+        self.assertEqual(RegistrationProfile.objects.count(), 0)
+
+    def test_registration_batch_view(self):
+        """
+        The ``register_batch`` view registers the valid accounts of a
+        JSON batch, reporting errors for the others -- including
+        usernames claimed earlier in the batch -- and is only
+        available to users who may add users.
+
+        """
+        User.objects.create_user('alice', 'alice@example.com', 'secret')
+        url = reverse('registration_register_batch')
+        batch = [{'username': 'bob', 'email': 'bob@example.com',
+                  'password1': 'secret', 'password2': 'secret'},
+                 {'username': 'Alice', 'email': 'alice2@example.com',
+                  'password1': 'secret', 'password2': 'secret'},
+                 {'username': 'BOB', 'email': 'bob2@example.com',
+                  'password1': 'secret', 'password2': 'secret'},
+                 {'username': 'carol', 'email': 'carol@example.com',
+                  'password1': 'secret', 'password2': 'other'},
+                 'dave']
+
+        response = self.client.post(url, json.dumps(batch), content_type='application/json')
+        self.assertEqual(response.status_code, 403)
+
+        partner = User.objects.create_user('partner', 'partner@example.com', 'secret')
+        partner.is_superuser = True
+        partner.save()
+        self.client.login(username='partner', password='secret')
+
+        self.assertEqual(self.client.get(url).status_code, 405)
+        response = self.client.post(url, '{"username": "bob"}', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post(url, json.dumps(batch), content_type='application/json')
+        self.assertEqual(response.status_code, 200)
+        response_data = json.loads(response.content)
+        self.assertFalse(response_data['success'])
+        results = response_data['results']
+        self.assertEqual(results[0], {'success': True, 'username': 'bob'})
+        self.assertEqual(results[1]['errors']['username'], [u"A user with that username already exists."])
+        self.assertEqual(results[2]['errors']['username'], [u"A user with that username already exists."])
+        self.assertEqual(results[3]['errors']['__all__'], [u"The two password fields didn't match."])
+        self.failIf(results[4]['success'])
+
+        self.assertEqual(RegistrationProfile.objects.count(), 1)
+        self.failIf(User.objects.get(username='bob').is_active)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_registration_batch_view_form_class(self):
+        """
+        Registrations accepted by the ``register_batch`` view's form
+        class are created, even if the default form's rules would
+        reject them.
+
+        """
+        partner = User.objects.create_user('partner', 'partner@example.com', 'secret')
+        partner.is_superuser = True
+        partner.save()
+        self.client.login(username='partner', password='secret')
+
+        batch = [{'username': 'bob@example.com', 'email': 'bob@example.com',
+                  'password1': 'secret', 'password2': 'secret'}]
+        response = self.client.post(reverse('registration_test_register_batch_email_match'),
+                                    json.dumps(batch), content_type='application/json')
+        self.assertEqual(json.loads(response.content),
+                         {'success': True, 'results': [{'success': True, 'username': 'bob@example.com'}]})
+        self.failIf(User.objects.get(username='bob@example.com').is_active)
+        self.assertEqual(RegistrationProfile.objects.count(), 1)
+
     def test_registration_view_closed(self):
         """
         Any attempt to access the ``register`` view when registration
@@ -197,6 +288,77 @@ class RegistrationViewTests(TestCase):
         # Callables in extra_context are called to obtain the value.
         self.assertEqual(response.context['callable'], 'called')
 
+    def test_class_based_views(self):
+        """
+        ``RegisterView`` and ``ActivateView`` resolve their backend and
+        form class when the URLconf is loaded, and render the
+        configured template with ``extra_context``.
+
+        """
+        backend = get_backend('registration.backends.default.DefaultBackend')
+        response = self.client.get(reverse('registration_test_register_class_view'))
+        self.assertTemplateUsed(response, 'registration/test_template_name.html')
+        self.assertEqual(response.context['foo'], 'bar')
+        self.assertEqual(response.context['callable'], 'called')
+        self.failUnless(isinstance(response.context['form'], forms.RegistrationForm))
+
+        def get_form_class(request):
+            raise AssertionError("The form class should already be resolved.")
+        backend.get_form_class = get_form_class
+        try:
+            response = self.client.get(reverse('registration_test_register_class_view'))
+            self.assertEqual(response.status_code, 200)
+        finally:
+            del backend.get_form_class
+
+        response = self.client.get(reverse('registration_test_activate_class_view',
+                                           kwargs={'activation_key': 'foo'}))
+        self.assertTemplateUsed(response, 'registration/test_template_name.html')
+        self.assertEqual(response.context['callable'], 'called')
+        self.assertEqual(response.context['activation_key'], 'foo')
+
+        view = RegisterView.as_view(backend='registration.backends.default.DefaultBackend')
+        self.failUnless(view.backend is backend)
+        self.assertEqual(load_backends(patterns('', (r'^register/$', view))), [backend])
+
+    def test_class_based_views_extra_context(self):
+        """
+        As in the function views, ``extra_context`` passed to the
+        class-based views overrides the context processors' values.
+
+        """
+        response = self.client.get(reverse('registration_test_register_class_view_override'))
+        self.assertEqual(response.context['user'], 'static')
+        self.assertEqual(response.context['perms'], 'called')
+
+    def test_class_based_views_methods(self):
+        """
+        The class-based views answer the same HTTP methods as the
+        function views, and accept a list of template names.
+
+        """
+        response = self.client.head(reverse('registration_test_register_class_view'))
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.head(reverse('registration_test_activate_class_view',
+                                            kwargs={'activation_key': 'foo'}))
+        self.assertEqual(response.status_code, 200)
+
+        response = self.client.get(reverse('registration_test_activate_class_view_templates',
+                                           kwargs={'activation_key': 'foo'}))
+        self.assertTemplateUsed(response, 'registration/test_template_name.html')
+
+        self.client.post(reverse('registration_register'),
+                         data={'username': 'alice',
+                               'email': 'alice@example.com',
+                               'password1': 'swordfish',
+                               'password2': 'swordfish'})
+        profile = RegistrationProfile.objects.get(user__username='alice')
+        response = self.client.post(reverse('registration_test_activate_class_view',
+                                            kwargs={'activation_key': profile.activation_key}))
+        self.assertEqual(response.status_code, 302)
+        self.failUnless(User.objects.get(username='alice').is_active)
+
     def test_registration_disallowed_url(self):
         """
         Passing ``disallowed_url`` to the ``register`` view will
@@ -265,6 +427,8 @@ class RegistrationViewTests(TestCase):
         expired_user = User.objects.get(username='bob')
         expired_user.date_joined = expired_user.date_joined - datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS)
         expired_user.save()
+        RegistrationProfile.objects.filter(user=expired_user).update(expires_at=expired_user.date_joined +
+                                                                         datetime.timedelta(days=settings.ACCOUNT_ACTIVATION_DAYS))
 
         expired_profile = RegistrationProfile.objects.get(user=expired_user)
         response = self.client.get(reverse('registration_activate',
@@ -313,3 +477,61 @@ class RegistrationViewTests(TestCase):
         self.assertEqual(response.context['foo'], 'bar')
         # Callables in extra_context are called to obtain the value.
         self.assertEqual(response.context['callable'], 'called')
+
+    def test_check_availability(self):
+        """
+        The ``check_availability`` view validates several candidate
+        usernames and email addresses with the form's rules, looks up
+        whether they are taken in a single query, and caches the
+        results.
+
+        """
+        cache.clear()
+        User.objects.create_user('alice', 'alice@example.com', 'secret')
+        url = reverse('registration_test_check_availability_unique_email') + \
+              '?username=Alice&username=bob&username=foo/bar&email=ALICE@example.com&email=bob@example.com'
+
+        responses = []
+        self.assertNumQueries(1, lambda: responses.append(self.client.get(url)))
+        response_data = json.loads(responses[0].content)
+        self.assertEqual(response_data['username']['Alice'],
+                         {'available': False,
+                          'errors': [u"A user with that username already exists."]})
+        self.assertEqual(response_data['username']['bob'], {'available': True, 'errors': []})
+        self.failIf(response_data['username']['foo/bar']['available'])
+        self.failIf(response_data['email']['ALICE@example.com']['available'])
+        self.failUnless(response_data['email']['bob@example.com']['available'])
+
+        self.assertNumQueries(0, self.client.get, url)
+
+        response = self.client.get(reverse('registration_check_availability') + '?email=alice@example.com')
+        self.assertEqual(json.loads(response.content),
+                         {'email': {'alice@example.com': {'available': True, 'errors': []}}})
+
+    def test_check_availability_limits(self):
+        """
+        The ``check_availability`` view refuses more candidates than
+        ``REGISTRATION_AVAILABILITY_MAX``, and caches its results
+        separately for each language.
+
+        """
+        cache.clear()
+        old_max = getattr(settings, 'REGISTRATION_AVAILABILITY_MAX', 20)
+        settings.REGISTRATION_AVAILABILITY_MAX = 2
+        try:
+            response = self.client.get(reverse('registration_check_availability') +
+                                       '?username=alice&username=bob&username=carol')
+            self.assertEqual(response.status_code, 400)
+            self.failUnless(json.loads(response.content)['errors'])
+        finally:
+            settings.REGISTRATION_AVAILABILITY_MAX = old_max
+
+        url = reverse('registration_check_availability') + '?username=foo/bar'
+        translation.activate('de')
+        try:
+            german = json.loads(self.client.get(url).content)
+        finally:
+            translation.deactivate()
+        english = json.loads(self.client.get(url).content)
+        self.assertNotEqual(german['username']['foo/bar']['errors'],
+                            english['username']['foo/bar']['errors'])
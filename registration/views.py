@@ -5,12 +5,28 @@ Views which allow users to create and activate accounts.
 
 import json
 
+from django.conf import settings
 from django.contrib.auth import REDIRECT_FIELD_NAME
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
 from django.shortcuts import redirect
 from django.shortcuts import render_to_response
 from django.template import RequestContext
+from django.template import loader
+from django.forms.forms import NON_FIELD_ERRORS
 from django.http import HttpResponse
-
+from django.http import HttpResponseBadRequest
+from django.http import HttpResponseForbidden
+from django.http import HttpResponseNotAllowed
+from django.utils.encoding import force_unicode
+from django.utils.decorators import classonlymethod
+from django.utils.hashcompat import md5_constructor
+from django.utils import translation
+from django.views.generic.base import View
+
+from registration import forms
+from registration import mail
+from registration import ratelimit
 from registration.backends import get_backend
 
 
@@ -74,6 +90,9 @@ def activate(request, backend,
     registration/activate.html or ``template_name`` keyword argument.
     
     """
+    throttled = ratelimit.throttle(request, 'activate')
+    if throttled is not None:
+        return throttled
     backend = get_backend(backend)
     account = backend.activate(request, **kwargs)
 
@@ -179,6 +198,9 @@ def register(request, backend, success_url=None, form_class=None,
     argument.
     
     """
+    throttled = ratelimit.throttle(request, 'register')
+    if throttled is not None:
+        return throttled
     json_response = lambda data: HttpResponse(json.dumps(data), mimetype='application/json')
     response_data = {'success':True}
 
@@ -195,19 +217,18 @@ def register(request, backend, success_url=None, form_class=None,
             return redirect(disallowed_url)
     if form_class is None:
         form_class = backend.get_form_class(request)
+    if accept_json:
+        return _register_json(request, backend, form_class)
 
     if request.method == 'POST':
         form = form_class(data=request.POST, files=request.FILES)
         if form.is_valid():
             new_user = backend.register(request, **form.cleaned_data)
-            if accept_json:
-                return json_response(response_data)
+            if success_url is None:
+                to, args, kwargs = backend.post_registration_redirect(request, new_user)
+                return redirect(to, *args, **kwargs)
             else:
-                if success_url is None:
-                    to, args, kwargs = backend.post_registration_redirect(request, new_user)
-                    return redirect(to, *args, **kwargs)
-                else:
-                    return redirect(success_url)
+                return redirect(success_url)
     else:
         form = form_class()
 
@@ -217,16 +238,436 @@ def register(request, backend, success_url=None, form_class=None,
     for key, value in extra_context.items():
         context[key] = callable(value) and value() or value
 
-    if accept_json:
-        response_data['success'] = False
-        if bool(form.errors):
-            response_data['errors'] = form.errors
-        return json_response(response_data)
+    return render_to_response(template_name,
+                              {
+                                  redirect_field_name: request.REQUEST.get(redirect_field_name, ''),
+                                  'form': form
+                              },
+                              context_instance=context)
 
-    else:
-        return render_to_response(template_name,
-                                    {
-                                        redirect_field_name: request.REQUEST.get(redirect_field_name, ''),
-                                        'form': form
-                                    },
-                                    context_instance=context)
+
+def _register_json(request, backend, form_class):
+    """
+    Handle a registration request which accepts a JSON response.
+
+    The submitted data is validated by the compiled form of
+    ``form_class`` (see ``registration.forms.compile_form()``), without
+    instantiating the form or building a template context; forms which
+    can't be compiled are validated normally.
+
+    """
+    response_data = {'success': False}
+    if request.method == 'POST':
+        cleaned_data, errors = _validate(form_class, request.POST, request.FILES)
+        if not errors:
+            backend.register(request, **cleaned_data)
+            response_data['success'] = True
+        else:
+            response_data['errors'] = errors
+    return HttpResponse(json.dumps(response_data), mimetype='application/json')
+
+
+def _validate(form_class, data, files=None):
+    """
+    Validate ``data`` with the compiled form of ``form_class``, or an
+    instance of it if it can't be compiled, returning a tuple of the
+    cleaned data and the errors.
+
+    """
+    compiled = forms.compile_form(form_class)
+    if compiled is not None:
+        return compiled.validate(data, files)
+    form = form_class(data=data, files=files)
+    form.is_valid()
+    return getattr(form, 'cleaned_data', None), form.errors
+
+
+def check_availability(request, backend, form_class=None, cache_timeout=None,
+                       max_candidates=None):
+    """
+    Check whether one or more candidate usernames and/or email
+    addresses could be used to register, returning the result as
+    JSON; intended for checking a signup form's fields as the user
+    types.
+
+    Candidates are passed in the query string as (possibly repeated)
+    ``username`` and ``email`` parameters. Each is validated by the
+    corresponding field, and ``clean_<field>()`` method, of the
+    registration form class, so the same rules apply as when
+    registering; whether they are already taken is looked up for all
+    of them at once, in a single query (see
+    ``registration.forms.prefetch_taken()``), which, if
+    ``REGISTRATION_BLOOM_FILTER`` is ``True``, skips the values the
+    Bloom filter of existing users doesn't hold. Since the answers
+    are only advice to the user, they may lag slightly behind the
+    database; registering always checks it.
+
+    The response maps each field to an object mapping each candidate
+    to ``{"available": <boolean>, "errors": [<messages>]}``. Results
+    are cached for a few seconds, for each language, to absorb bursts
+    of requests as the user types. A request with more candidates than
+    allowed gets a 400 response, with ``{"errors": [<messages>]}``.
+    Requests are throttled like those to the ``register`` view (see
+    ``registration.ratelimit``).
+
+    **Required arguments**
+
+    ``backend``
+        The dotted Python import path to the backend class to use.
+
+    **Optional arguments**
+
+    ``form_class``
+        The form class whose rules to apply. If not supplied, this
+        will be retrieved from the registration backend.
+
+    ``cache_timeout``
+        The number of seconds to cache each result for. If not
+        supplied, this will be the value of the setting
+        ``REGISTRATION_AVAILABILITY_CACHE_TIMEOUT``, or 5 if it is
+        not set.
+
+    ``max_candidates``
+        The largest number of candidates accepted in one request. If
+        not supplied, this will be the value of the setting
+        ``REGISTRATION_AVAILABILITY_MAX``, or 20 if it is not set.
+
+    """
+    throttled = ratelimit.throttle(request, 'check_availability')
+    if throttled is not None:
+        return throttled
+
+    backend_path = backend
+    backend = get_backend(backend)
+    if form_class is None:
+        form_class = backend.get_form_class(request)
+    if cache_timeout is None:
+        cache_timeout = getattr(settings, 'REGISTRATION_AVAILABILITY_CACHE_TIMEOUT', 5)
+    if max_candidates is None:
+        max_candidates = getattr(settings, 'REGISTRATION_AVAILABILITY_MAX', 20)
+    form = form_class()
+
+    # Error messages are translated, so results are cached per
+    # language.
+    language = translation.get_language() or ''
+    def cache_key(name, value):
+        key = u'|'.join([backend_path, form_class.__module__, form_class.__name__,
+                         language, name, value])
+        return 'registration.availability.%s' % md5_constructor(key.encode('utf-8')).hexdigest()
+
+    candidates = [(name, value) for name in ('username', 'email') if name in form.fields
+                  for value in request.GET.getlist(name)]
+    if len(candidates) > max_candidates:
+        message = u'At most %d candidates may be checked at once.' % max_candidates
+        return HttpResponseBadRequest(json.dumps({'errors': [message]}), mimetype='application/json')
+    keys = dict([(candidate, cache_key(*candidate)) for candidate in candidates])
+    cached = cache.get_many(keys.values())
+    results = dict([(candidate, cached[keys[candidate]]) for candidate in candidates
+                    if keys[candidate] in cached])
+
+    uncached = [candidate for candidate in candidates if candidate not in results]
+    if uncached:
+        forms.prefetch_taken(usernames=[value for name, value in uncached if name == 'username'],
+                             emails=[value for name, value in uncached if name == 'email'],
+                             hint=True)
+        try:
+            for name, value in uncached:
+                try:
+                    form.cleaned_data = {name: form.fields[name].clean(value)}
+                    if hasattr(form, 'clean_%s' % name):
+                        getattr(form, 'clean_%s' % name)()
+                except ValidationError, e:
+                    results[(name, value)] = [force_unicode(message) for message in e.messages]
+                else:
+                    results[(name, value)] = []
+        finally:
+            forms.clear_prefetched_taken()
+        cache.set_many(dict([(keys[candidate], results[candidate]) for candidate in uncached]),
+                       cache_timeout)
+
+    response_data = {}
+    for (name, value), errors in results.items():
+        response_data.setdefault(name, {})[value] = {'available': not errors,
+                                                     'errors': errors}
+    return HttpResponse(json.dumps(response_data), mimetype='application/json')
+
+
+def register_batch(request, backend, form_class=None, max_registrations=None):
+    """
+    Register a batch of new user accounts, submitted by ``POST`` as a
+    JSON array of objects with the fields of the registration form,
+    and return the outcome for each of them as JSON; intended for
+    partners who sign users up on our behalf.
+
+    Only users with the ``auth.add_user`` permission may use this
+    view. Each registration is validated by the registration form
+    class, with whether its username and email address are taken
+    looked up for the whole batch at once (see
+    ``registration.forms.prefetch_taken()``); a username or email
+    address may also only be claimed once within a batch. The valid
+    registrations are then passed together, as a list of cleaned data
+    dictionaries, to the backend's ``register_batch()`` method, which
+    creates them in one transaction and then sends their activation
+    emails.
+
+    The response is ``{"success": <boolean>, "results": [...]}``,
+    with one result per registration, in the order given:
+    ``{"success": true, "username": <username>}`` if it was created
+    (with an ``"email_error"`` message added if its activation email
+    couldn't be sent), or ``{"success": false, "errors": {<field>:
+    [<messages>]}}`` if not. ``success`` is ``true`` only if all of
+    them were created.
+
+    **Required arguments**
+
+    ``backend``
+        The dotted Python import path to the backend class to use.
+        If it has no ``register_batch()`` method, every request gets
+        a 400 response saying so.
+
+    **Optional arguments**
+
+    ``form_class``
+        The form class to use for validation. If not supplied, this
+        will be retrieved from the registration backend.
+
+    ``max_registrations``
+        The largest number of registrations accepted in one request.
+        If not supplied, this will be the value of the setting
+        ``REGISTRATION_BATCH_MAX_SIZE``, or 500 if it is not set.
+
+    """
+    json_response = lambda data, response_class=HttpResponse: response_class(json.dumps(data),
+                                                                              mimetype='application/json')
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    if not request.user.has_perm('auth.add_user'):
+        return json_response({'success': False,
+                              'errors': [u'You are not permitted to register users.']},
+                             HttpResponseForbidden)
+
+    backend = get_backend(backend)
+    if getattr(backend, 'register_batch', None) is None:
+        return json_response({'success': False,
+                              'errors': [u'This backend does not support batch registration.']},
+                             HttpResponseBadRequest)
+    if not backend.registration_allowed(request):
+        return json_response({'success': False, 'errors': [u'Registration is closed.']})
+    if form_class is None:
+        form_class = backend.get_form_class(request)
+    if max_registrations is None:
+        max_registrations = getattr(settings, 'REGISTRATION_BATCH_MAX_SIZE', 500)
+
+    try:
+        registrations = json.loads(request.raw_post_data)
+    except ValueError:
+        registrations = None
+    if not isinstance(registrations, list):
+        return json_response({'success': False,
+                              'errors': [u'The request body must be a JSON array of registrations.']},
+                             HttpResponseBadRequest)
+    if len(registrations) > max_registrations:
+        return json_response({'success': False,
+                              'errors': [u'At most %d registrations may be submitted at once.' % max_registrations]},
+                             HttpResponseBadRequest)
+
+    results = [None] * len(registrations)
+    valid = []
+    values = lambda name: [data[name] for data in registrations
+                           if isinstance(data, dict) and isinstance(data.get(name), basestring)]
+    forms.prefetch_taken(usernames=values('username'), emails=values('email'))
+    try:
+        for i, data in enumerate(registrations):
+            if not isinstance(data, dict):
+                results[i] = {'success': False,
+                              'errors': {NON_FIELD_ERRORS: [u'Each registration must be a JSON object.']}}
+                continue
+            cleaned_data, errors = _validate(form_class, data)
+            if errors:
+                results[i] = {'success': False, 'errors': errors}
+                continue
+            forms.mark_taken(cleaned_data.get('username'), cleaned_data.get('email'))
+            valid.append((i, cleaned_data))
+    finally:
+        forms.clear_prefetched_taken()
+
+    if valid:
+        created = backend.register_batch(request, [cleaned_data for i, cleaned_data in valid])
+        for (i, cleaned_data), (user, error) in zip(valid, created):
+            if user is not None:
+                results[i] = {'success': True, 'username': user.username}
+                if error is not None:
+                    results[i]['email_error'] = error
+            else:
+                results[i] = {'success': False, 'errors': {NON_FIELD_ERRORS: [error]}}
+    return json_response({'success': bool(results) and all(result['success'] for result in results),
+                          'results': results})
+
+
+class BackendView(View):
+    """
+    Base class for the class-based registration views.
+
+    Everything which doesn't depend on the request is worked out once,
+    by ``as_view()``, when the URLconf is loaded: the backend is
+    loaded, the values of ``extra_context`` which aren't callable are
+    set aside as a static context, and ``configure()`` is called to
+    let subclasses resolve anything else. Each request then only calls
+    the callables in ``extra_context`` and renders the (cached)
+    template.
+
+    """
+    backend = None
+    template_name = None
+    extra_context = None
+    rate_limit_scope = None
+    static_context = None
+    dynamic_context = None
+
+    def as_view(cls, **initkwargs):
+        backend = initkwargs.get('backend', cls.backend)
+        if isinstance(backend, basestring):
+            backend = get_backend(backend)
+        initkwargs['backend'] = backend
+        extra_context = initkwargs.pop('extra_context', cls.extra_context) or {}
+        initkwargs['static_context'] = dict([(key, value) for key, value in extra_context.items()
+                                             if not callable(value)])
+        initkwargs['dynamic_context'] = [(key, value) for key, value in extra_context.items()
+                                         if callable(value)]
+        cls.configure(initkwargs)
+        view = super(BackendView, cls).as_view(**initkwargs)
+        # Lets registration.backends.load_backends() find the backend.
+        view.backend = backend
+        return view
+    as_view = classonlymethod(as_view)
+
+    def configure(cls, initkwargs):
+        """
+        Resolve, in place, any further arguments of ``initkwargs``
+        which don't depend on the request; called by ``as_view()``
+        once the backend has been loaded.
+
+        """
+        pass
+    configure = classmethod(configure)
+
+    def dispatch(self, request, *args, **kwargs):
+        # Turn away clients over their rate limit before doing anything
+        # else (see registration.ratelimit).
+        if self.rate_limit_scope is not None:
+            throttled = ratelimit.throttle(request, self.rate_limit_scope)
+            if throttled is not None:
+                return throttled
+        return self.handle(request, *args, **kwargs)
+
+    def handle(self, request, *args, **kwargs):
+        """
+        Respond to a request which is within the rate limits; by
+        default, by calling the method named after the request's HTTP
+        method.
+
+        """
+        return super(BackendView, self).dispatch(request, *args, **kwargs)
+
+    def render(self, request, context):
+        """
+        Render ``template_name`` with ``context``, on top of
+        ``extra_context``, on top of the context processors' values
+        of a ``RequestContext``. As with
+        ``render_to_response()``, ``template_name`` may be a list or
+        tuple of names, of which the first that exists is used.
+
+        """
+        # Like the function views, let extra_context override the
+        # context processors.
+        context_instance = RequestContext(request)
+        context_instance.update(self.static_context)
+        for key, value in self.dynamic_context:
+            context_instance[key] = value()
+        context_instance.update(context)
+        if isinstance(self.template_name, (list, tuple)):
+            template = loader.select_template(self.template_name)
+        else:
+            template = mail.get_template(self.template_name)
+        return HttpResponse(template.render(context_instance))
+
+
+class RegisterView(BackendView):
+    """
+    Class-based equivalent of the ``register`` view, taking the same
+    arguments as keyword arguments to ``as_view()``.
+
+    Unless ``form_class`` is given, the form class is obtained from
+    the backend's ``get_form_class()`` method once, when the URLconf
+    is loaded, and not for every request; ``None`` is passed as the
+    request. Use the ``register`` view with backends which choose the
+    form class according to the request.
+
+    """
+    form_class = None
+    success_url = None
+    disallowed_url = 'registration_disallowed'
+    template_name = 'registration/registration_form.html'
+    redirect_field_name = REDIRECT_FIELD_NAME
+    rate_limit_scope = 'register'
+
+    def configure(cls, initkwargs):
+        if initkwargs.get('form_class', cls.form_class) is None:
+            initkwargs['form_class'] = initkwargs['backend'].get_form_class(None)
+        # Compile the form for JSON requests now, too.
+        forms.compile_form(initkwargs.get('form_class', cls.form_class))
+    configure = classmethod(configure)
+
+    def handle(self, request, *args, **kwargs):
+        accept = request.META.get('HTTP_ACCEPT')
+        accept_json = bool(accept) and 'application/json' in accept
+        if not self.backend.registration_allowed(request):
+            if accept_json:
+                return HttpResponse(json.dumps({'success': False,
+                                                'errors': [u'Registration is closed.']}),
+                                    mimetype='application/json')
+            return redirect(self.disallowed_url)
+        if accept_json:
+            return _register_json(request, self.backend, self.form_class)
+        return super(RegisterView, self).handle(request, *args, **kwargs)
+
+    def get(self, request, *args, **kwargs):
+        return self.render_form(request, self.form_class())
+    # Django 1.3's View doesn't answer HEAD requests with get().
+    head = get
+
+    def post(self, request, *args, **kwargs):
+        form = self.form_class(data=request.POST, files=request.FILES)
+        if not form.is_valid():
+            return self.render_form(request, form)
+        new_user = self.backend.register(request, **form.cleaned_data)
+        if self.success_url is None:
+            to, args, kwargs = self.backend.post_registration_redirect(request, new_user)
+            return redirect(to, *args, **kwargs)
+        return redirect(self.success_url)
+
+    def render_form(self, request, form):
+        return self.render(request, {self.redirect_field_name: request.REQUEST.get(self.redirect_field_name, ''),
+                                     'form': form})
+
+
+class ActivateView(BackendView):
+    """
+    Class-based equivalent of the ``activate`` view, taking the same
+    arguments as keyword arguments to ``as_view()``. Like that view,
+    it activates on ``GET``, ``HEAD`` and ``POST`` requests alike.
+
+    """
+    success_url = None
+    template_name = 'registration/activate.html'
+    rate_limit_scope = 'activate'
+
+    def get(self, request, *args, **kwargs):
+        account = self.backend.activate(request, **kwargs)
+        if not account:
+            return self.render(request, kwargs)
+        if self.success_url is None:
+            to, args, kwargs = self.backend.post_activation_redirect(request, account)
+            return redirect(to, *args, **kwargs)
+        return redirect(self.success_url)
+    head = post = get